@@ -1,3 +1,10 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import keras_tuner as kt
@@ -8,12 +15,13 @@ from tensorflow.keras.layers import Dense, Conv1D, Flatten, LSTM, MaxPooling1D,
 from tensorflow.keras.optimizers import Adam, RMSprop
 from tensorflow.keras.regularizers import l2
 from tensorflow.keras.callbacks import EarlyStopping
+import tensorflow as tf
 from sklearn.model_selection import train_test_split, KFold
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 from sklearn.preprocessing import LabelEncoder
 
-# Load dataset
-df2 = pd.read_excel("./data/New_Dummy/Project Dummy Data.xlsx", sheet_name="Task_Table1") 
+sys.path.append('./src')
+from storage import load_matrix, sample_rows
 
 # Data preprocessing function
 def preprocess_project(df):
@@ -78,86 +86,197 @@ def build_model(hp, input_shape):
     
     return model
 
+TUNING_DIR = 'tuning_dir'
+PROJECT_NAME = 'cnn_lstm_hyperband'
+
 # Hyperparameter tuning function
-def tune_model(X_train, y_train, X_val, y_val, input_shape):
-    tuner = kt.RandomSearch(
+def data_key(X, y, source):
+    """ Short ID of the training data, from its shape, the matrix it was read from and its first and last rows. Saved searches
+    and fold results are kept per ID, so another dataset never resumes the search of this one."""
+    origin = os.path.abspath(os.path.join(source[1], source[2])) if source[0] == 'matrix' else 'arrays'
+    digest = hashlib.sha1(json.dumps({'shape': list(X.shape), 'source': origin}).encode())
+    for rows in (X[:100], X[-100:], y[:100], y[-100:]):
+        digest.update(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+    return digest.hexdigest()[:10]
+
+def tune_model(X_train, y_train, X_val, y_val, input_shape, max_epochs=50, overwrite=False, project_name=PROJECT_NAME):
+    """ Hyperband search on one train/validation split. Weak trials are stopped after a few epochs and every trial stops early once
+    val_loss stalls. The search state lives in tuning_dir/project_name, an interrupted search resumes where it stopped unless
+    overwrite is set.
+
+    Returns:
+        HyperParameters: best hyperparameters found
+    """
+    tuner = kt.Hyperband(
         lambda hp: build_model(hp, input_shape=input_shape),
         objective='val_loss',
-        max_trials=20,  # Increased number of trials for broader search
-        executions_per_trial=3,
-        directory='tuning_dir',
-        project_name='cnn_lstm_extended_tuning'
+        max_epochs=max_epochs,
+        factor=3,
+        directory=TUNING_DIR,
+        project_name=project_name,
+        overwrite=overwrite
     )
-    tuner.search(X_train, y_train, epochs=50, validation_data=(X_val, y_val), verbose=1)
-    
+    early_stopping = EarlyStopping(monitor='val_loss', patience=5)
+    tuner.search(X_train, y_train, validation_data=(X_val, y_val), callbacks=[early_stopping], verbose=1)
+
     # Get the best hyperparameters
-    best_hps = tuner.get_best_hyperparameters(num_trials=1)[0]
-    best_model = tuner.hypermodel.build(best_hps)
+    return tuner.get_best_hyperparameters(num_trials=1)[0]
 
-    return best_model
+def pin_threads(threads):
+    # Every fold worker gets its own share of the cores instead of all of them competing for every core
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+def load_source(source):
+    # Fold workers reopen a memory-mapped matrix instead of receiving a pickled copy of it
+    if source[0] == 'matrix':
+        X, y, _ = load_matrix(source[1], source[2])
+        return np.expand_dims(X, axis=2), y
+    return source[1], source[2]
+
+def train_fold(source, fold, train_index, val_index, hp_config, threads, epochs=100):
+    """ Train and score one cross-validation fold with fixed hyperparameters, in its own process.
+
+    Returns:
+        dict: fold scores and the number of epochs early stopping kept
+    """
+    pin_threads(threads)
+    X, y = load_source(source)
+    X_train, X_val = X[train_index], X[val_index]
+    y_train, y_val = y[train_index], y[val_index]
+
+    model = build_model(kt.HyperParameters.from_config(hp_config), input_shape=X.shape[1])
+    early_stopping = EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True)
+    history = model.fit(X_train, y_train, validation_data=(X_val, y_val),
+                        epochs=epochs, batch_size=20, verbose=0, callbacks=[early_stopping])
+
+    y_val_pred = model.predict(X_val, verbose=0)
+    y_train_pred = model.predict(X_train, verbose=0)
+    result = {
+        'fold': fold,
+        'mae_train': float(mean_absolute_error(y_train, y_train_pred)),
+        'mae_val': float(mean_absolute_error(y_val, y_val_pred)),
+        'rmse_val': float(np.sqrt(mean_squared_error(y_val, y_val_pred))),
+        'r2_val': float(r2_score(y_val, y_val_pred)),
+        'best_epoch': int(np.argmin(history.history['val_loss'])) + 1,
+    }
+    print(f"Fold {fold} MAE Train: {result['mae_train']}, MAE Validation: {result['mae_val']}")
+    return result
 
 # Train and evaluate the model with cross-validation
-def train_evaluate_model(df, target, background_data):
-    X = df.drop(columns=[target])
-    y = df[target]
-    X = np.expand_dims(X.values, axis=2)
-    
-    kf = KFold(n_splits=5, shuffle=True, random_state=42)
-    mae_scores = []
-    rmse_scores = []
-    r2_scores = []
-    
-    # Perform cross-validation
-    for train_index, val_index in kf.split(X):
-        X_train, X_val = X[train_index], X[val_index]
-        y_train, y_val = y[train_index], y[val_index]
-        input_shape = X_train.shape[1]
+def train_evaluate_model(df, target, background_data, **kwargs):
+    X = df.drop(columns=[target]).values.astype(np.float32)
+    y = df[target].values.astype(np.float32)
+    return train_evaluate_arrays(X, y, source=('arrays', np.expand_dims(X, axis=2), y), **kwargs)
 
-        # Tune and train the model
-        best_model = tune_model(X_train, y_train, X_val, y_val, input_shape)
+# Cross-validation on a 2D feature matrix, e.g. a memory-mapped export from preprocess.py
+def train_evaluate_arrays(X, y, source=None, n_splits=5, workers=None, max_epochs=50, overwrite=False):
+    """ Tune once on a held-out split, cross-validate the best hyperparameters with the folds trained in parallel processes, then
+    train the final model on all rows. The search and the finished folds are stored in tuning_dir per dataset, folds are skipped
+    when the run is started again on the same data with the same n_splits and hyperparameters.
 
-        # Early stopping
-        early_stopping = EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True)
-        history = best_model.fit(X_train, y_train, validation_data=(X_val, y_val), 
-                                 epochs=100, batch_size=20, verbose=1, callbacks=[early_stopping])
+    Args:
+        X (ndarray): 2D feature matrix
+        y (ndarray): target vector
+        source (tuple): how fold workers get the data, ('matrix', dir_path, name) or ('arrays', X, y)
+        n_splits (int): number of cross-validation folds
+        workers (int): parallel fold processes, the CPU count bounded by n_splits when None
+        max_epochs (int): epochs of the longest Hyperband trial
+        overwrite (bool): drop the saved search and fold results and start over
 
-        # Make predictions
-        y_val_pred = best_model.predict(X_val)
-        y_train_pred = best_model.predict(X_train)
+    Returns:
+        Model: final model trained on every row
+    """
+    data = data_key(X, y, source or ('arrays',))
+    project_name = f'{PROJECT_NAME}_{data}'
+    # expand_dims returns a view, a memory-mapped matrix is not copied here
+    X = np.expand_dims(X, axis=2)
+    source = source or ('arrays', X, y)
+    input_shape = X.shape[1]
 
-        mae_train = mean_absolute_error(y_train, y_train_pred)
-        mae_val = mean_absolute_error(y_val, y_val_pred)
-        rmse_val = np.sqrt(mean_squared_error(y_val, y_val_pred))
-        r2_val = r2_score(y_val, y_val_pred)
+    # Tune once on a held-out 20%, instead of a full search inside every fold
+    tune_index, holdout_index = train_test_split(np.arange(len(X)), test_size=0.2, random_state=42)
+    best_hps = tune_model(X[tune_index], y[tune_index], X[holdout_index], y[holdout_index], input_shape, max_epochs, overwrite,
+                          project_name)
+    print(f"Best hyperparameters: {best_hps.values}")
 
-        # Append scores
-        mae_scores.append(mae_val)
-        rmse_scores.append(rmse_val)
-        r2_scores.append(r2_val)
+    folds_dir = os.path.join(TUNING_DIR, project_name, 'folds')
+    os.makedirs(folds_dir, exist_ok=True)
+    results = {}
+    for file_name in os.listdir(folds_dir):
+        with open(os.path.join(folds_dir, file_name)) as f:
+            saved = json.load(f)
+        # Folds of an earlier run with other hyperparameters, data or number of splits are trained again
+        matches = (saved['hyperparameters'] == best_hps.values and saved.get('n_splits') == n_splits
+                   and saved.get('data') == data)
+        if not overwrite and matches:
+            results[saved['fold']] = saved
 
-        print(f"MAE Train: {mae_train}, MAE Validation: {mae_val}")
-        print(f"RMSE Validation: {rmse_val}, R² Validation: {r2_val}")
+    kf = KFold(n_splits=n_splits, shuffle=True, random_state=42)
+    pending = [(fold, train_index, val_index) for fold, (train_index, val_index) in enumerate(kf.split(X)) if fold not in results]
+    workers = max(1, min(len(pending), workers or os.cpu_count() or 1))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Training {len(pending)} of {n_splits} folds with {workers} workers and {threads} threads each")
 
-    # Average cross-validation scores
-    avg_mae = np.mean(mae_scores)
-    avg_rmse = np.mean(rmse_scores)
-    avg_r2 = np.mean(r2_scores)
+    # TensorFlow is not fork safe once it has run, start the workers fresh
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(train_fold, source, fold, train_index, val_index, best_hps.get_config(), threads)
+                   for fold, train_index, val_index in pending]
+        for future in futures:
+            result = future.result()
+            result['hyperparameters'] = best_hps.values
+            result['n_splits'] = n_splits
+            result['data'] = data
+            with open(os.path.join(folds_dir, f"fold_{result['fold']}_of_{n_splits}.json"), 'w') as f:
+                json.dump(result, f, indent=4)
+            results[result['fold']] = result
 
-    print(f"\nAverage MAE: {avg_mae}")
-    print(f"Average RMSE: {avg_rmse}")
-    print(f"Average R²: {avg_r2}")
+    # Average cross-validation scores
+    scores = pd.DataFrame(list(results.values())).sort_values('fold')
+    print(scores[['fold', 'mae_train', 'mae_val', 'rmse_val', 'r2_val', 'best_epoch']].to_string(index=False))
+    print(f"\nAverage MAE: {scores['mae_val'].mean()}")
+    print(f"Average RMSE: {scores['rmse_val'].mean()}")
+    print(f"Average R²: {scores['r2_val'].mean()}")
 
+    # Final model on every row, for the number of epochs the folds needed on average. The parent keeps TensorFlow's default thread
+    # pools, they can not be changed once the search has initialised TensorFlow and already use every core
+    best_model = build_model(best_hps, input_shape)
+    best_model.fit(X, y, epochs=int(round(scores['best_epoch'].mean())), batch_size=20, verbose=1)
     return best_model
 
-# Preprocess the dataset
-processed_df = preprocess_project(df2)
-train_df = processed_df.drop(columns=['ID', 'Outline_Number','Name','StartDate','EndDate', 'Predecessors', 'Successors', 'ActualStartDate','ActualEndDate'])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tune, cross-validate and train the CNN-LSTM delay model')
+    parser.add_argument('manifest', nargs='?', help='matrix exported by preprocess.py, e.g. data/30_2019/task_train_manifest.json')
+    parser.add_argument('--workers', type=int, help='parallel fold processes')
+    parser.add_argument('--max-epochs', type=int, default=50, help='epochs of the longest Hyperband trial')
+    parser.add_argument('--n-splits', type=int, default=5, help='cross-validation folds')
+    parser.add_argument('--overwrite', action='store_true', help='discard the saved search and folds in tuning_dir')
+    args = parser.parse_args()
+    options = {'workers': args.workers, 'max_epochs': args.max_epochs, 'n_splits': args.n_splits, 'overwrite': args.overwrite}
 
-# Prepare background data for SHAP
-background_data = train_df.drop(columns=['Delay']).sample(n=100, random_state=42)
+    if args.manifest:
+        # Train from a matrix exported by preprocess.py, e.g. data/30_2019/task_train_manifest.json
+        manifest_path = args.manifest
+        dir_path, name = os.path.split(manifest_path[:-len('_manifest.json')])
+        X_mm, y_mm, manifest = load_matrix(dir_path, name)
 
-# Train and evaluate the model with cross-validation
-best_model = train_evaluate_model(train_df, 'Delay', background_data)
+        # Prepare background data for SHAP, only the sampled rows are read from disk
+        background_data = pd.DataFrame(sample_rows(X_mm, 100, seed=42), columns=manifest['features'])
+
+        best_model = train_evaluate_arrays(X_mm, y_mm, source=('matrix', dir_path, name), **options)
+    else:
+        # Load dataset
+        df2 = pd.read_excel("./data/New_Dummy/Project Dummy Data.xlsx", sheet_name="Task_Table1")
+
+        # Preprocess the dataset
+        processed_df = preprocess_project(df2)
+        train_df = processed_df.drop(columns=['ID', 'Outline_Number','Name','StartDate','EndDate', 'Predecessors', 'Successors', 'ActualStartDate','ActualEndDate'])
+
+        # Prepare background data for SHAP
+        background_data = train_df.drop(columns=['Delay']).sample(n=100, random_state=42)
+
+        # Train and evaluate the model with cross-validation
+        best_model = train_evaluate_model(train_df, 'Delay', background_data, **options)
 
-# Save the final model
-joblib.dump(best_model, './model/30_2019_v6_CNN_LSTM_Final_Tuned.pkl')
+    # Save the final model
+    joblib.dump(best_model, './model/30_2019_v6_CNN_LSTM_Final_Tuned.pkl')
@@ -0,0 +1,110 @@
+import os
+import time
+import queue
+import weakref
+import threading
+from functools import partial
+import numpy as np
+import pandas as pd
+
+# Queued by close, the batching thread ends once it has served the requests queued before it
+_STOP = object()
+
+def _after_fork(ref):
+    # Threads do not survive fork, pre-fork servers need a fresh batching thread in every worker. The hook only holds a weak
+    # reference, so replaced batchers are not kept alive, and closed ones are not restarted.
+    batcher = ref()
+    if batcher is None:
+        return
+    batcher.lock = threading.Lock()
+    if not batcher.closed:
+        batcher._start()
+
+class PredictionBatcher:
+    def __init__(self, predict_fn, columns, max_rows=256, max_wait_ms=5):
+        """ Coalesce concurrent predict calls into one batched forward pass. Requests wait up to max_wait_ms for others to join,
+        a batch is dispatched as soon as it holds max_rows rows, and each caller gets back only its own rows.
+
+        Args:
+            predict_fn (function): batched predict function, e.g. model.predict
+            columns (list): feature order expected by the model
+            max_rows (int): maximum number of rows in one batch
+            max_wait_ms (float): latency budget spent waiting for more requests
+        """
+        self.predict_fn = predict_fn
+        self.columns = list(columns)
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self.closed = False
+        self.lock = threading.Lock()
+        self._start()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=partial(_after_fork, weakref.ref(self)))
+
+    def _start(self):
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._loop, name='predict-batcher', daemon=True)
+        self.worker.start()
+
+    def predict(self, df):
+        """ Predict the rows of df through the shared batch, blocking until the result is ready."""
+        # Selecting the columns here makes a malformed request fail on its own instead of failing the whole batch
+        item = {'df': df[self.columns], 'event': threading.Event(), 'result': None, 'error': None}
+        with self.lock:
+            queued = not self.closed
+            if queued:
+                self.queue.put(item)
+        if not queued:
+            # Requests still holding a replaced model finish without the batching thread
+            return np.asarray(self.predict_fn(item['df']))
+        item['event'].wait()
+        if item['error'] is not None:
+            raise item['error']
+        return item['result']
+
+    def close(self):
+        """ Stop the batching thread once the requests already queued are served, later predict calls run without batching."""
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.put(_STOP)
+
+    def _collect(self):
+        """ Next batch of requests, and whether close was called after them."""
+        item = self.queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        rows = len(item['df'])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            rows += len(item['df'])
+        return batch, False
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            try:
+                X = pd.concat([item['df'] for item in batch], ignore_index=True)
+                predictions = np.asarray(self.predict_fn(X))
+                offsets = np.cumsum([len(item['df']) for item in batch])[:-1]
+                for item, result in zip(batch, np.split(predictions, offsets)):
+                    item['result'] = result
+            except Exception as e:
+                for item in batch:
+                    item['error'] = e
+            for item in batch:
+                item['event'].set()
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+
+def model_version(model_path):
+    """ Fingerprint of the model file, changes whenever the file is replaced."""
+    stat = os.stat(model_path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+class PredictionCache:
+    def __init__(self, model_path, columns, max_entries=10000, ttl=3600, decimals=4, shared_dir=None, check_interval=5, name=''):
+        """ LRU/TTL cache of (model version, rounded feature vector) -> (prediction, SHAP dictionary). Entries are dropped when the
+        model file changes, and with shared_dir they are also kept in a SQLite file shared by every worker process.
+
+        Args:
+            model_path (str): model file, its size and modification time are the model version
+            columns (list): feature columns forming the key, in model order
+            max_entries (int): maximum number of entries kept in memory
+            ttl (int): seconds an entry stays valid
+            decimals (int): features are rounded to this many decimals before hashing
+            shared_dir (str): directory of the shared on-disk cache, None keeps the cache in memory only
+            check_interval (float): seconds between two checks of the model file
+            name (str): model name, keeps the entries of several models apart in a shared cache
+        """
+        self.model_path = model_path
+        self.name = name
+        self.columns = list(columns)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.decimals = decimals
+        self.check_interval = check_interval
+        self.db_path = os.path.join(shared_dir, 'prediction_cache.sqlite') if shared_dir else None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self.version = self._version()
+        self.checked = time.monotonic()
+        if self.db_path:
+            os.makedirs(shared_dir, exist_ok=True)
+            self._db().execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, version TEXT, prediction REAL, shap TEXT, created REAL)')
+
+    def _db(self):
+        # SQLite connections can't cross threads or forks, open one per thread of each process
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            self.local.conn.execute('PRAGMA journal_mode=WAL')
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def _version(self):
+        return f'{self.name}@{model_version(self.model_path)}'
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        version = self._version()
+        if version != self.version:
+            print(f'Model file {self.model_path} changed, prediction cache cleared')
+            with self.lock:
+                self.version = version
+                self.entries.clear()
+                self.counters['invalidations'] += 1
+            if self.db_path:
+                prefix = f'{self.name}@'
+                self._db().execute('DELETE FROM cache WHERE substr(version, 1, ?) = ? AND version != ?', (len(prefix), prefix, version))
+
+    def keys(self, df):
+        """ Cache key of every row: model version and the rounded feature bytes."""
+        self._check_version()
+        # Adding 0.0 turns -0.0 into 0.0 so both hash the same
+        values = np.round(df[self.columns].to_numpy(dtype=np.float64), self.decimals) + 0.0
+        return [f'{self.version}:{row.tobytes().hex()}' for row in values]
+
+    def get_many(self, keys, need_shap=False):
+        """ Look up keys, returning (prediction, SHAP dictionary) or None for every key. With need_shap, entries stored
+        without SHAP count as misses."""
+        now = time.time()
+        results = [None] * len(keys)
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                entry = self.entries.get(key)
+                if entry is not None and now - entry[2] > self.ttl:
+                    del self.entries[key]
+                    entry = None
+                if entry is not None and (entry[1] is not None or not need_shap):
+                    self.entries.move_to_end(key)
+                    results[i] = (entry[0], entry[1])
+                    self.counters['hits'] += 1
+                else:
+                    missing.append(i)
+
+        if missing and self.db_path:
+            missing = self._get_disk(keys, missing, results, now, need_shap)
+
+        with self.lock:
+            self.counters['misses'] += len(missing)
+        return results
+
+    def _get_disk(self, keys, missing, results, now, need_shap):
+        placeholders = ','.join('?' * len(missing))
+        rows = self._db().execute(
+            f'SELECT key, prediction, shap, created FROM cache WHERE key IN ({placeholders}) AND created > ?',
+            [keys[i] for i in missing] + [now - self.ttl]
+        ).fetchall()
+        found = {key: (prediction, json.loads(shap) if shap else None, created) for key, prediction, shap, created in rows}
+
+        still_missing = []
+        for i in missing:
+            entry = found.get(keys[i])
+            if entry is not None and (entry[1] is not None or not need_shap):
+                results[i] = (entry[0], entry[1])
+                self._put_memory(keys[i], entry)
+                with self.lock:
+                    self.counters['disk_hits'] += 1
+            else:
+                still_missing.append(i)
+        return still_missing
+
+    def _put_memory(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def put_many(self, keys, predictions, shap_dicts=None):
+        """ Store the predictions, and the SHAP dictionaries when given, of the rows behind keys."""
+        now = time.time()
+        shap_dicts = shap_dicts if shap_dicts is not None else [None] * len(keys)
+        for key, prediction, shap_dict in zip(keys, predictions, shap_dicts):
+            self._put_memory(key, (float(prediction), shap_dict, now))
+
+        if self.db_path:
+            self._db().executemany(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                [(key, key.split(':')[0], float(prediction), json.dumps(shap_dict) if shap_dict is not None else None, now)
+                 for key, prediction, shap_dict in zip(keys, predictions, shap_dicts)]
+            )
+
+    def stats(self):
+        """ Hit and miss counters, with the hit rate over all lookups."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.entries)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        stats['model_version'] = self.version
+        stats['shared'] = self.db_path is not None
+        return stats
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from runtime import load_model, round_half_up
+
+# Distil a deep model into a gradient-boosted tree student for low-latency serving. The student learns the teacher's predictions
+# on the task rows of the simulated datasets plus rows sampled from their feature distributions, and is served with exact TreeSHAP.
+# Usage: python distill.py model/CNN_LSTM_V7.npz --data data/New_Dummy/background_data.csv data/30_2019 --samples 200000
+# The student is saved as model/XGB_CNN_LSTM_V7.pkl with a fidelity report next to it, serve it with ?model=XGB_CNN_LSTM
+
+FEATURES = ['Duration', 'Trade', 'Progress', 'WorkerScore', 'Temperature', 'RainProb', 'WindSpeed']
+DEFAULT_DATA = ['data/New_Dummy/background_data.csv', 'test/randomized_multiple_task_test.csv']
+
+# Students TreeSHAP explains exactly, xgb needs xgboost and gbm only scikit-learn
+STUDENTS = {
+    'xgb': {'n_estimators': 300, 'max_depth': 5, 'learning_rate': 0.1, 'subsample': 0.8, 'colsample_bytree': 1.0},
+    'gbm': {'n_estimators': 300, 'max_depth': 5, 'learning_rate': 0.05, 'subsample': 0.8},
+}
+
+def read_rows(path, features=FEATURES):
+    """ Feature rows of a CSV/Parquet file or of the task_data table of a dataset directory, rows with gaps are dropped.
+
+    Returns:
+        DataFrame: rows with the feature columns, None when the source lacks one of them
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, f'task_data.{ext}') for ext in ['parquet', 'feather', 'csv']]
+        path = next((f for f in files if os.path.exists(f)), None)
+        if path is None:
+            return None
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    elif path.endswith('.feather'):
+        df = pd.read_feather(path)
+    else:
+        df = pd.read_csv(path)
+    missing = [col for col in features if col not in df.columns]
+    if missing:
+        print(f'Skipping {path}: no {missing} columns')
+        return None
+    return df[features].apply(pd.to_numeric, errors='coerce').dropna()
+
+def sample_rows(df, n, seed=0):
+    """ n rows drawn column by column from the observed values, so the student also sees combinations the datasets miss but
+    the API may receive. The teacher labels them, no ground truth is needed.
+
+    Returns:
+        DataFrame: sampled rows with the columns of df
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({col: rng.choice(df[col].to_numpy(), size=n) for col in df.columns})
+
+def teacher_predict(model, df, batch_size=8192):
+    # Batches bound the memory of the NumPy and Keras models on large transfer sets
+    values = df.to_numpy(dtype=np.float32)
+    out = [np.asarray(model.predict(values[i:i + batch_size])).reshape(-1) for i in range(0, len(values), batch_size)]
+    return np.concatenate(out) if out else np.empty(0)
+
+def build_student(kind, seed=0, **params):
+    settings = dict(STUDENTS[kind], **params)
+    if kind == 'xgb':
+        from xgboost import XGBRegressor
+        return XGBRegressor(tree_method='hist', random_state=seed, n_jobs=-1, **settings)
+    from sklearn.ensemble import GradientBoostingRegressor
+    return GradientBoostingRegressor(random_state=seed, **settings)
+
+def fidelity(teacher, student):
+    """ Agreement of the student with the teacher, in raw predictions and in the rounded delay days the API returns.
+
+    Returns:
+        dict: R², MAE, largest absolute difference and share of rows with the same rounded prediction
+    """
+    teacher, student = np.asarray(teacher), np.asarray(student)
+    residual = teacher - student
+    variance = ((teacher - teacher.mean()) ** 2).sum()
+    return {
+        'rows': int(len(teacher)),
+        'r2': float(1 - (residual ** 2).sum() / variance) if variance > 0 else None,
+        'mae': float(np.abs(residual).mean()),
+        'max_abs': float(np.abs(residual).max()),
+        'rounded_agreement': float((round_half_up(teacher) == round_half_up(student)).mean()),
+    }
+
+def latency(model, df, repeat=5):
+    """ Best of repeat timings of predict and of exact TreeSHAP on df, in microseconds per row.
+
+    Returns:
+        dict: predict and SHAP microseconds per row
+    """
+    def best(function):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return round(min(timings) / len(df) * 1e6, 2)
+
+    result = {'predict_us_per_row': best(lambda: model.predict(df))}
+    if hasattr(model, 'get_booster'):
+        # The same TreeSHAP values shap.TreeExplainer returns, computed by xgboost itself
+        from xgboost import DMatrix
+        matrix = DMatrix(df)
+        result['shap_us_per_row'] = best(lambda: model.get_booster().predict(matrix, pred_contribs=True))
+    return result
+
+def student_path(teacher_path, kind, output_dir=None):
+    # model/CNN_LSTM_V7.npz -> model/XGB_CNN_LSTM_V7.pkl, served by the registry as XGB_CNN_LSTM
+    base = os.path.splitext(os.path.basename(teacher_path))[0]
+    return os.path.join(output_dir or os.path.dirname(teacher_path), f'{kind.upper()}_{base}.pkl')
+
+def distill(teacher_path, data=DEFAULT_DATA, samples=100000, kind='xgb', holdout=0.2, output_dir=None, seed=0, **params):
+    """ Train a tree student on the predictions of a teacher model and save it with its fidelity report.
+
+    Args:
+        teacher_path (str): deep model file, a .npz bundle (no TensorFlow needed) or a Keras pickle
+        data (list): CSV/Parquet files and dataset directories with the feature columns
+        samples (int): extra rows sampled from the feature distributions of the data
+        kind (str): 'xgb' or 'gbm'
+        holdout (float): share of the rows kept out of training to measure fidelity
+        output_dir (str): folder of the student, the folder of the teacher when None
+        seed (int): seed of sampling, split and training
+        params: student settings overriding STUDENTS[kind]
+
+    Returns:
+        Tuple: path of the saved student and the report dictionary
+    """
+    import joblib
+    frames = [df for df in (read_rows(path) for path in data) if df is not None and len(df)]
+    if not frames:
+        raise ValueError(f'None of {data} has the columns {FEATURES}')
+    observed = pd.concat(frames, ignore_index=True)
+    rows = pd.concat([observed, sample_rows(observed, samples, seed)], ignore_index=True)
+    is_observed = np.arange(len(rows)) < len(observed)
+
+    started = time.perf_counter()
+    teacher = load_model(teacher_path)
+    labels = teacher_predict(teacher, rows)
+    teacher_seconds = time.perf_counter() - started
+    print(f'{teacher_path} labelled {len(rows)} rows ({len(observed)} observed, {samples} sampled) in {teacher_seconds:.1f}s')
+
+    test = np.random.default_rng(seed).random(len(rows)) < holdout
+    student = build_student(kind, seed, **params)
+    started = time.perf_counter()
+    student.fit(rows[~test], labels[~test])
+    train_seconds = time.perf_counter() - started
+
+    predicted = np.asarray(student.predict(rows[test]))
+    observed_test = is_observed[test]
+    report = {
+        'teacher': teacher_path,
+        'student': kind,
+        'params': dict(STUDENTS[kind], **params),
+        'features': FEATURES,
+        'data': list(data),
+        'rows': {'observed': int(len(observed)), 'sampled': int(samples), 'train': int((~test).sum()), 'holdout': int(test.sum())},
+        'fidelity': fidelity(labels[test], predicted),
+        # Sampled rows dominate the holdout, the observed ones are the rows the API sees most
+        'fidelity_observed': fidelity(labels[test][observed_test], predicted[observed_test]) if observed_test.any() else None,
+        'teacher_us_per_row': round(teacher_seconds / len(rows) * 1e6, 2),
+        'train_seconds': round(train_seconds, 1),
+        'latency': latency(student, rows[test].head(1000)),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+    path = student_path(teacher_path, kind, output_dir)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    joblib.dump(student, path)
+    with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Student saved at {path}')
+    return path, report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Distil a deep delay model into a tree model served with exact TreeSHAP')
+    parser.add_argument('teacher', nargs='?', default='model/CNN_LSTM_V7.npz', help='deep model, .npz bundle or Keras pickle')
+    parser.add_argument('--data', nargs='+', default=DEFAULT_DATA, help='CSV/Parquet files or dataset directories with task_data')
+    parser.add_argument('--samples', type=int, default=100000, help='rows sampled from the feature distributions of the data')
+    parser.add_argument('--student', choices=list(STUDENTS), default='xgb')
+    parser.add_argument('--holdout', type=float, default=0.2)
+    parser.add_argument('--output-dir', help='folder of the student, next to the teacher by default')
+    parser.add_argument('--min-agreement', type=float, help='exit with code 1 when fewer held-out rounded predictions match the teacher')
+    args = parser.parse_args()
+
+    path, report = distill(args.teacher, args.data, args.samples, args.student, args.holdout, args.output_dir)
+    print(json.dumps({key: report[key] for key in ['fidelity', 'fidelity_observed', 'teacher_us_per_row', 'latency']}, indent=2))
+    if args.min_agreement is not None and report['fidelity']['rounded_agreement'] < args.min_agreement:
+        print(f'Rounded agreement {report["fidelity"]["rounded_agreement"]:.2%} is below {args.min_agreement:.2%}')
+        sys.exit(1)
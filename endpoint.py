@@ -1,24 +1,44 @@
 from flask import Flask, request, jsonify
+import os
 import pandas as pd
-import h2o
-from h2o.automl import H2OAutoML
-h2o.init()
 
 app = Flask(__name__)
 
-model = h2o.load_model("model/30_2018_30")
+# MOJO exported with h2o_mojo.py, scored in this process without an H2O cluster. Without it the model is served from a local cluster.
+MOJO_PATH = os.environ.get('MOJO_PATH', 'model/30_2018_30.zip')
+H2O_MODEL_PATH = os.environ.get('H2O_MODEL_PATH', 'model/30_2018_30')
+
+if os.path.exists(MOJO_PATH):
+    from h2o_mojo import MojoScorer
+    scorer = MojoScorer(MOJO_PATH)
+    print(f'Serving MOJO {MOJO_PATH} in process')
+
+    def predict_frame(data_df):
+        return scorer.predict(data_df)['predict']
+else:
+    import h2o
+    h2o.init()
+    model = h2o.load_model(H2O_MODEL_PATH)
+    print(f'{MOJO_PATH} not found, serving {H2O_MODEL_PATH} from the H2O cluster. Export it with: python h2o_mojo.py {H2O_MODEL_PATH}')
+
+    def predict_frame(data_df):
+        return model.predict(h2o.H2OFrame(data_df)).as_data_frame()['predict']
 
 @app.route('/predict', methods=['POST'])
 def predict():
+    # A single task object, or a list of task objects scored in one batch
     data = request.json
+    if isinstance(data, list):
+        predictions = predict_frame(pd.DataFrame(data))
+        return jsonify({'predictions': predictions.tolist()})
+
     data_df = pd.DataFrame(data, index=[0])
-    data_h2o = h2o.H2OFrame(data_df)
-    prediction = model.predict(data_h2o)
+    prediction = predict_frame(data_df)
     result = {
-        'prediction' : prediction.as_data_frame().iat[0, 0]
+        'prediction' : prediction.iat[0]
     }
-    
+
     return jsonify(result)
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
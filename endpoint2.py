@@ -1,30 +1,213 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, send_file, jsonify, Response, stream_with_context, g
+from werkzeug.datastructures import FileStorage
 import pandas as pd
-import joblib
-import shap
 import traceback
-import matplotlib.pyplot as plt
-import matplotlib
 import io
+import time
 import numpy as np
+import os
 import sys
 import json
+import hmac
+import functools
 from flask_restx import Api, reqparse, fields, Resource, Namespace
 
 from utility import *
-
-# Use the 'Agg' backend for matplotlib
-matplotlib.use('Agg')
+from jobs import JobQueue
+from batcher import PredictionBatcher
+from cache import PredictionCache
+from model_registry import ModelRegistry, UnknownModelError
+from metrics import Metrics, SamplingProfiler, server_timing
+from graph import TaskGraph
+from scenarios import WEATHER_COLUMNS, load_weather, planned_starts, weather_windows, scenario_frame, delay_distribution
 
 app = Flask(__name__)
 
-# Load the model
-# model = joblib.load("./model/LSTM_V7.pkl")
-model = joblib.load("/src/app/model/LSTM_V7.pkl")
+# Prometheus metrics served at /metrics, with METRICS_DIR every gunicorn worker writes its metrics there and /metrics sums them
+metrics = Metrics(shared_dir=os.environ.get('METRICS_DIR') or None)
+metrics.counter('api_requests_total', 'Requests by route, method and status code')
+metrics.histogram('api_request_seconds', 'Request latency by route')
+metrics.histogram('api_stage_seconds', 'Time spent per stage: parse, cache, predict (batch wait included), model, shap, graph')
+metrics.counter('api_rows_total', 'Task rows received by route')
+metrics.counter('api_model_calls_total', 'model.predict calls by model')
+metrics.counter('api_model_rows_total', 'Rows passed to model.predict by model')
+metrics.counter('api_shap_calls_total', 'SHAP explainer calls by model')
+metrics.counter('api_shap_rows_total', 'Rows explained with SHAP by model')
+metrics.counter('api_cache_rows_total', 'Prediction cache lookups by model and result')
+
+# Server-Timing header on every response with SERVER_TIMING=1, or on requests with ?timing=1
+server_timing_enabled = os.environ.get('SERVER_TIMING', '0') == '1'
+
+# Sampling profiler, PROFILER=1 starts it at boot and /DelayPrediction/profiler turns it on and off
+profiler = SamplingProfiler(interval_ms=float(os.environ.get('PROFILER_INTERVAL_MS', 10)))
+if os.environ.get('PROFILER', '0') == '1':
+    profiler.start()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses are timed until the first chunk only
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.inc('api_requests_total', route=route, method=request.method, status=response.status_code)
+    metrics.observe('api_request_seconds', elapsed, route=route)
+    timings = metrics.end_request()
+    if server_timing_enabled or request.args.get('timing') == '1':
+        response.headers['Server-Timing'] = server_timing(timings + [('total', elapsed)])
+    return response
+
+def count_rows(n):
+    metrics.inc('api_rows_total', n, route=request.url_rule.rule)
 
 # background data
 # background_data = pd.read_csv("./data/background_data.csv")
 background_data = pd.read_csv("/src/app/data/background_data.csv")
+background_df = background_data.drop(columns=['Unnamed: 0'])
+
+# Daily weather history for the date range scenarios of /predict_project_weather, the same file as WEATHER_HISTORICAL_PATH of the simulation
+# MAX_SCENARIOS: scenarios one request may evaluate
+weather_path = os.environ.get('WEATHER_HISTORICAL_PATH', '/src/app/data/weather_historical.csv')
+weather_history = load_weather(weather_path) if os.path.isfile(weather_path) else None
+max_scenarios = int(os.environ.get('MAX_SCENARIOS', 1000))
+
+# Concurrent predict calls share one batched model.predict
+# PREDICT_BATCHING: 1 to enable | PREDICT_BATCH_ROWS: maximum batch size | PREDICT_BATCH_WAIT_MS: time a request waits for others
+# Cache of predictions and SHAP scores for task features seen before, cleared when the model file changes
+# PREDICT_CACHE: 1 to enable | PREDICT_CACHE_SIZE: entries per worker | PREDICT_CACHE_TTL: seconds | PREDICT_CACHE_DECIMALS: feature rounding
+# PREDICT_CACHE_DIR: directory of a SQLite cache shared by all workers, empty for in-memory only
+def counted_predict(entry):
+    # model.predict with call, row and time metrics, runs in the batcher thread when batching is on
+    def model_predict(X):
+        metrics.inc('api_model_calls_total', model=entry.key)
+        metrics.inc('api_model_rows_total', len(X), model=entry.key)
+        with metrics.timer('model', model=entry.key):
+            return entry.model.predict(X)
+    return model_predict
+
+def prepare_model(entry):
+    # Every served model gets its own batcher and cache
+    entry.predict = counted_predict(entry)
+    entry.batcher = None
+    if os.environ.get('PREDICT_BATCHING', '1') == '1':
+        entry.batcher = PredictionBatcher(
+            entry.predict,
+            entry.features,
+            max_rows=int(os.environ.get('PREDICT_BATCH_ROWS', 256)),
+            max_wait_ms=float(os.environ.get('PREDICT_BATCH_WAIT_MS', 5))
+        )
+    entry.cache = None
+    if os.environ.get('PREDICT_CACHE', '1') == '1':
+        entry.cache = PredictionCache(
+            entry.path,
+            entry.features,
+            max_entries=int(os.environ.get('PREDICT_CACHE_SIZE', 10000)),
+            ttl=int(os.environ.get('PREDICT_CACHE_TTL', 3600)),
+            decimals=int(os.environ.get('PREDICT_CACHE_DECIMALS', 4)),
+            shared_dir=os.environ.get('PREDICT_CACHE_DIR') or None,
+            name=entry.key
+        )
+
+# Models of the model folder, loaded on first use. MODEL_PATH is the default model, a .npz bundle from export_model.py runs
+# on the NumPy runtime without importing TensorFlow. MODEL_DEFAULT_FILE holds the default model name shared by all workers.
+# SHAP_EXPLAINER: auto, tree, gradient or kernel | SHAP_NSAMPLES: kernel evaluations per row | SHAP_BACKGROUND_K: k-means background size
+# model_path = "./model/LSTM_V7.pkl"
+model_path = os.environ.get('MODEL_PATH', '/src/app/model/LSTM_V7.pkl')
+shap_nsamples = os.environ.get('SHAP_NSAMPLES', 'auto')
+registry = ModelRegistry(
+    os.environ.get('MODEL_DIR', os.path.dirname(model_path)),
+    background_df,
+    default=model_path,
+    default_file=os.environ.get('MODEL_DEFAULT_FILE') or None,
+    explainer=os.environ.get('SHAP_EXPLAINER', 'auto'),
+    shap_settings={
+        'nsamples': shap_nsamples if shap_nsamples == 'auto' else int(shap_nsamples),
+        'background_k': int(os.environ.get('SHAP_BACKGROUND_K', 10))
+    },
+    on_load=prepare_model
+)
+
+# The default model and its SHAP explainer are built once at startup and shared by every request
+registry.get().explainer(background_df)
+
+def requested_model():
+    # ?model=RF or ?model=RF_V6 serves that model instead of the default
+    return registry.get(request.args.get('model'))
+
+def predict(df, entry):
+    with metrics.timer('predict', model=entry.key):
+        return entry.batcher.predict(df) if entry.batcher is not None else entry.predict(df[entry.features])
+
+def explain_rows(entry, df):
+    # SHAP dictionaries of every row, with call, row and time metrics
+    metrics.inc('api_shap_calls_total', model=entry.key)
+    metrics.inc('api_shap_rows_total', len(df), model=entry.key)
+    with metrics.timer('shap', model=entry.key):
+        return entry.explainer(background_df).shap_dicts(df)
+
+def cached_predict(df, explain=False, entry=None):
+    """ Predictions, and SHAP dictionaries when explain is set, of every row of df. Only rows missing from the cache go
+    through the model and the explainer.
+
+    Returns:
+        Tuple: 1D prediction array and list of SHAP dictionaries (None without explain)
+    """
+    entry = entry or registry.get()
+    cache = entry.cache
+    if cache is None:
+        predictions = np.asarray(predict(df, entry)).reshape(len(df), -1)[:, 0]
+        return predictions, explain_rows(entry, df) if explain else None
+
+    with metrics.timer('cache', model=entry.key):
+        keys = cache.keys(df)
+        results = cache.get_many(keys, need_shap=explain)
+    missing = [i for i, result in enumerate(results) if result is None]
+    metrics.inc('api_cache_rows_total', len(df) - len(missing), model=entry.key, result='hit')
+    metrics.inc('api_cache_rows_total', len(missing), model=entry.key, result='miss')
+    if missing:
+        missing_df = df.iloc[missing]
+        predictions = np.asarray(predict(missing_df, entry)).reshape(len(missing), -1)[:, 0]
+        shap_dicts = explain_rows(entry, missing_df) if explain else [None] * len(missing)
+        cache.put_many([keys[i] for i in missing], predictions, shap_dicts if explain else None)
+        for i, prediction, shap_dict in zip(missing, predictions, shap_dicts):
+            results[i] = (prediction, shap_dict)
+
+    predictions = np.array([result[0] for result in results], dtype=np.float64)
+    return predictions, [result[1] for result in results] if explain else None
+
+def warmup():
+    # One inference and one explanation at boot, so the first request doesn't pay for graph building
+    entry = registry.get()
+    sample = background_df[entry.features].head(1)
+    entry.model.predict(sample)
+    if os.environ.get('WARMUP_SHAP', '1') == '1':
+        entry.explainer(background_df).shap_values(sample)
+
+# Background SHAP jobs for ?explain=async
+# JOBS_DIR: directory of a SQLite job store shared by all workers, so any worker answers /jobs/<id>; empty for in-memory only
+jobs = JobQueue(workers=int(os.environ.get('SHAP_JOB_WORKERS', 2)), shared_dir=os.environ.get('JOBS_DIR') or None)
+
+def task_shap_job(entry, task_ids, data_df):
+    shap_dicts = explain_rows(entry, data_df)
+    return [{"Task_Id": int(task_id), "SHAP_Score": shap_dict} for task_id, shap_dict in zip(task_ids, shap_dicts)]
+
+def project_shap_job(entry, task_ids, partial_df):
+    shap_dicts = explain_rows(entry, partial_df)
+    return {
+        "average_shap": calculate_shap_average(pd.DataFrame({'SHAP_score': shap_dicts})),
+        "predicted_task_details": [{"Task_id": int(task_id), "SHAP_Score": shap_dict} for task_id, shap_dict in zip(task_ids, shap_dicts)]
+    }
+
+def projects_shap_job(entry, project_ids, task_ids, starts, partial_df):
+    shap_dicts = explain_rows(entry, partial_df)
+    return [{
+        "project_id": project_id,
+        "average_shap": calculate_shap_average(pd.DataFrame({'SHAP_score': shap_dicts[lo:hi]})),
+        "predicted_task_details": [{"Task_id": int(task_id), "SHAP_Score": shap_dict} for task_id, shap_dict in zip(task_ids[lo:hi], shap_dicts[lo:hi])]
+    } for project_id, lo, hi in zip(project_ids, starts[:-1], starts[1:])]
 
 #Example file for predict_project_delay
 with open('/src/app/data/predict_project_delay_input_example2-3.json') as f:
@@ -33,7 +216,7 @@ with open('/src/app/data/predict_project_delay_input_example2-3.json') as f:
 
 # Define the parser for file upload
 upload_parser = reqparse.RequestParser()
-upload_parser.add_argument('file', location='files', type='FileStorage', required=True, help='CSV file with task data')
+upload_parser.add_argument('file', location='files', type=FileStorage, required=True, help='CSV or NDJSON file with task data')
 
 api = Api(app, version="1.0", title="Method Prediction API")
 
@@ -113,30 +296,80 @@ task_model3 = api.model('ProjectTasksModel', {
     'values': fields.List(fields.List(fields.Raw), required=True, description="Values for the tasks", example=json_example['values'])
 })
 
+# Many projects of ProjectTasksModel rows in one request
+project_entry = api.model('ProjectEntry', {
+    'project_id': fields.Raw(required=True, description='Project ID, returned with the project result', example='P1'),
+    'values': fields.List(fields.List(fields.Raw), required=True, description='Values for the tasks of the project', example=json_example['values'])
+})
+task_model4 = api.model('ProjectBatchModel', {
+    'header': fields.List(fields.String, required=True, description="Headers for task attributes, shared by every project", example=json_example['header']),
+    'projects': fields.List(fields.Nested(project_entry), required=True, description='Projects to predict, task IDs only have to be unique within a project')
+})
+
+# One project of ProjectTasksModel rows with weather scenarios, given as values or as a range of project start dates
+weather_scenarios = api.model('WeatherScenarios', {
+    'header': fields.List(fields.String, required=True, description='Weather columns', example=WEATHER_COLUMNS),
+    'values': fields.List(fields.List(fields.Float), required=True, description='Weather of every scenario, applied to every task', example=[[18, 0, 10], [22, 60, 25], [25, 95, 40]])
+})
+date_range = api.model('DateRange', {
+    'start': fields.String(required=True, description='First project start date', example='2023-01-01'),
+    'end': fields.String(required=True, description='Last project start date', example='2023-12-31'),
+    'step_days': fields.Integer(description='Days between two start dates', example=7)
+})
+task_model5 = api.model('WeatherScenarioModel', {
+    'header': fields.List(fields.String, required=True, description="Headers for task attributes", example=json_example['header']),
+    'values': fields.List(fields.List(fields.Raw), required=True, description="Values for the tasks", example=json_example['values']),
+    'scenarios': fields.Nested(weather_scenarios, description='Weather scenarios, or use date_range'),
+    'date_range': fields.Nested(date_range, description='Project start dates, every task gets the historical weather of the days it is planned to run')
+})
+
+# ?model= parameter shared by the prediction routes
+model_param = {'model': 'model to use, e.g. RF (latest version) or RF_V6, see /models. Empty for the default model'}
+
+# ADMIN_TOKEN: token of the routes that change the server (default model swap, profiler), sent in the X-Admin-Token header.
+# Those routes are off while it is empty
+admin_token = os.environ.get('ADMIN_TOKEN') or None
+admin_param = {'X-Admin-Token': {'in': 'header', 'description': 'ADMIN_TOKEN of the server'}}
+
+def admin_only(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if admin_token is None:
+            return {'error': 'Admin routes are disabled, set ADMIN_TOKEN to enable them'}, 403
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), admin_token.encode()):
+            return {'error': 'Missing or wrong X-Admin-Token header'}, 401
+        return method(*args, **kwargs)
+    return wrapper
+
 #predict single task endpoint
 @ns1_route.route('/predict_single_task')
 class PredictSingleTask(Resource):
     @ns1_route.expect(task_model)
     @ns1_route.response(200, 'Success', fields.String(description='Prediction value'))
     @ns1_route.response(400, 'Invalid Input', fields.String(description='Error message'))
-    @ns1_route.doc(description="Make a prediction for a single task based on the provided features.")
+    @ns1_route.doc(description="Make a prediction for a single task based on the provided features.", params=model_param)
     def post(self):
         """Predict single task based on input features"""
         try:
-            data = request.json
-            data_df = pd.DataFrame([data])
-
-            # Prediction
-            prediction = model.predict(data_df)  # Replace with actual model prediction
-            if prediction[0] < 1:
-                prediction[0] = 0.0
+            entry = requested_model()
+            with metrics.timer('parse'):
+                data = request.json
+                data_df = pd.DataFrame([data])
+            count_rows(len(data_df))
+
+            # Prediction, served from the cache when these features were seen before
+            predictions, _ = cached_predict(data_df, entry=entry)
+            prediction = float(predictions[0])
+            if prediction < 1:
+                prediction = 0.0
 
             result = {
-                'prediction': float(prediction[0])
+                'prediction': prediction,
+                'model': entry.key
             }
             return jsonify(result)
         except Exception as e:
-            return jsonify({'error': str(e)}), 400
+            return {'error': str(e)}, 400
 
 #predict multiple task endpoint    
 @ns1_route.route('/predict_multiple_task')
@@ -145,9 +378,12 @@ class PredictMultipleTasks(Resource):
     @ns1_route.response(200, 'Success', fields.String(description='JSON object with predictions and SHAP values'))
     @ns1_route.response(400, 'Invalid Input', fields.String(description='Error message'))
     @ns1_route.response(500, 'Internal Server Error', fields.String(description='Error message'))
+    @ns1_route.doc(params=dict(model_param, explain='true (default) computes SHAP scores, false skips them, async returns a job ID to poll at /jobs/<id>'))
     def post(self):
         """Predict multiple tasks based on JSON input, and return the results as JSON"""
         try:
+            entry = requested_model()
+
             # Parse JSON input
             data = request.json
             headers = data.get('headers', [])
@@ -155,44 +391,32 @@ class PredictMultipleTasks(Resource):
 
             # If headers or values are missing
             if not headers or not values:
-                return jsonify({'error': 'Headers or values missing from input'}), 400
+                return {'error': 'Headers or values missing from input'}, 400
 
             # Convert the JSON input to a DataFrame
-            data_df = pd.DataFrame(values, columns=headers)
+            with metrics.timer('parse'):
+                data_df = pd.DataFrame(values, columns=headers)
+            count_rows(len(data_df))
 
             # Separate 'Task_Id' from the data for prediction
             task_ids = data_df['Task_Id']
             data_df = data_df.drop(columns=['Task_Id'])
 
             # Ensure required columns are present for prediction
-            required_columns = required_column_task()
+            required_columns = entry.features
 
             if not all(col in data_df.columns for col in required_columns):
-                return jsonify({'error': f'Missing required columns. Required columns are: {required_columns}'}), 400
+                return {'error': f'Missing required columns. Required columns are: {required_columns}'}, 400
 
             # Ensure columns are in the correct order
             data_df = data_df[required_columns]
 
-            # Prepare background data
-            background_df = pd.DataFrame(background_data, index=[0])
-            background_df = background_df.drop(columns=['Unnamed: 0'], axis=1)
-
-            # ML Model
-            # shap_eval = SHAP_Evaluation(model, data_df, background_df, model_code='ML')
-
-            # Neural Network Model
-            shap_eval = SHAP_Evaluation(model, data_df, background_df, model_code='DL')
-
-            # Ensemble Model
-            # shap_eval = SHAP_Evaluation(model, data_df, background_df, model_code='EL')
-
-            shap_dicts = shap_eval.SHAP_Dictionary()
-
-            # Prediction
-            predictions = model.predict(data_df)
+            # Predictions and SHAP values (skipped with ?explain=false), served from the cache when these features were seen before
+            explain = explain_mode(request.args)
+            predictions, shap_dicts = cached_predict(data_df, explain=explain == 'sync', entry=entry)
 
             # Apply the conditions to round and set the predictions
-            rounded_predictions = np.where(predictions < 0.5, 0, np.where(predictions % 1 >= 0.5, np.ceil(predictions), np.floor(predictions)).astype(int))
+            rounded_predictions = round_predictions(predictions)
 
             # Apply a minimum of 1 for any predictions between 0.5 and 1
             rounded_predictions = np.where((rounded_predictions > 0) & (rounded_predictions < 1), 1, rounded_predictions)
@@ -200,19 +424,95 @@ class PredictMultipleTasks(Resource):
             # Build the response payload with Task_Id, Prediction, and SHAP_Score
             response_payload = []
             for idx, task_id in enumerate(task_ids):
-                response_payload.append({
+                task_payload = {
                     "Task_Id": int(task_id),
-                    "Prediction": int(rounded_predictions[idx]),
-                    "SHAP_Score": {key: shap_dicts[idx][key] for key in required_columns}
-                })
+                    "Prediction": int(rounded_predictions[idx])
+                }
+                if explain == 'sync':
+                    task_payload["SHAP_Score"] = {key: shap_dicts[idx][key] for key in required_columns}
+                response_payload.append(task_payload)
+
+            # Return the predictions now and compute SHAP in the background
+            if explain == 'async':
+                job_id = jobs.submit(task_shap_job, entry, task_ids.tolist(), data_df.copy())
+                return jsonify({'job_id': job_id, 'job_url': api.url_for(JobStatus, job_id=job_id), 'predictions': response_payload})
 
             # Return as JSON response
             return jsonify(response_payload)
+        except UnknownModelError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             print(traceback.format_exc())
-            return jsonify({'error': str(e)}), 500
+            return {'error': str(e)}, 500
     
 
+#Bulk prediction endpoint
+@ns1_route.route('/predict_bulk')
+class PredictBulk(Resource):
+    @ns1_route.expect(upload_parser)
+    @ns1_route.response(200, 'Success', fields.String(description='NDJSON stream, one line per task with Task_Id, Prediction and SHAP_Score'))
+    @ns1_route.response(400, 'Invalid Input', fields.String(description='Error message'))
+    @ns1_route.response(500, 'Internal Server Error', fields.String(description='Error message'))
+    @ns1_route.doc(description="Upload a CSV or NDJSON file (.ndjson/.jsonl) of tasks. Rows are scored in chunks and the results are streamed back as NDJSON while the file is read.",
+                   params=dict(model_param, explain='false (default) skips SHAP scores, true computes them', chunk_size='rows scored per model call (default 1000)'))
+    def post(self):
+        """Predict a large file of tasks, streaming the results as NDJSON"""
+        try:
+            entry = requested_model()
+            file = upload_parser.parse_args()['file']
+            # Flask closes uploaded files when the view returns, detach the upload so the response can keep reading it
+            file = FileStorage(stream=file.stream, filename=file.filename, content_type=file.content_type)
+            request.files['file'].stream = io.BytesIO()
+            chunk_size = int(request.args.get('chunk_size', 1000))
+            explain = explain_mode(request.args, default='false') == 'sync'
+            required_columns = entry.features
+
+            # Read the first chunk before streaming, so a malformed file still gets a 400
+            route = request.url_rule.rule
+            chunks = read_chunks(file, chunk_size)
+            with metrics.timer('parse'):
+                first = next(chunks, None)
+            if first is None:
+                return {'error': 'Uploaded file has no rows'}, 400
+            if not all(col in first.columns for col in required_columns):
+                return {'error': f'Missing required columns. Required columns are: {required_columns}'}, 400
+        except UnknownModelError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            print(traceback.format_exc())
+            return {'error': str(e)}, 400
+
+        def generate():
+            offset = 0
+            chunk = first
+            try:
+                while chunk is not None:
+                    # Task_Id is optional, rows without it are numbered from 1
+                    task_ids = chunk['Task_Id'].tolist() if 'Task_Id' in chunk.columns else range(offset + 1, offset + len(chunk) + 1)
+                    metrics.inc('api_rows_total', len(chunk), route=route)
+                    predictions, shap_dicts = cached_predict(chunk[required_columns], explain=explain, entry=entry)
+                    rounded_predictions = round_predictions(predictions)
+
+                    lines = []
+                    for idx, task_id in enumerate(task_ids):
+                        task_payload = {"Task_Id": int(task_id), "Prediction": int(rounded_predictions[idx])}
+                        if explain:
+                            task_payload["SHAP_Score"] = shap_dicts[idx]
+                        lines.append(json.dumps(task_payload))
+                    yield '\n'.join(lines) + '\n'
+
+                    offset += len(chunk)
+                    with metrics.timer('parse'):
+                        chunk = next(chunks, None)
+            except Exception as e:
+                # The status code is already sent, report the failure as the last line
+                print(traceback.format_exc())
+                yield json.dumps({'error': str(e), 'rows_done': offset}) + '\n'
+            finally:
+                file.close()
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 #Predict project delay endpoint
 @ns1_route.route('/predict_project_delay')
 class PredictProjectDelay(Resource):
@@ -220,10 +520,12 @@ class PredictProjectDelay(Resource):
     @ns1_route.response(200, 'Success', fields.String(description='Project delay prediction payload'))
     @ns1_route.response(400, 'Invalid Input', fields.String(description='Error message'))
     @ns1_route.response(500, 'Internal Server Error', fields.String(description='Error message'))
-    @ns1_route.doc(description="Upload a JSON object with project tasks to predict the total project delay.")
+    @ns1_route.doc(description="Upload a JSON object with project tasks to predict the total project delay.", params=dict(model_param, explain='true (default) computes SHAP scores, false skips them, async returns a job ID to poll at /jobs/<id>'))
     def post(self):
         """Predict the whole project total delay"""
         try:
+            entry = requested_model()
+
             # Parse JSON input
             data = request.json
             headers = data.get('header', [])
@@ -231,35 +533,35 @@ class PredictProjectDelay(Resource):
 
             # If headers or values are missing
             if not headers or not values:
-                return jsonify({'error': 'Headers or values missing from input'}), 400
+                return {'error': 'Headers or values missing from input'}, 400
 
             # Convert the values to a DataFrame using the headers
-            data_df = pd.DataFrame(values, columns=headers)
+            with metrics.timer('parse'):
+                data_df = pd.DataFrame(values, columns=headers)
+            count_rows(len(data_df))
+            # Clients send the task ID as Task_Id
+            data_df = data_df.rename(columns={'Task_Id': 'Id'})
 
             # Ensure required columns are present
             required_columns = required_column_project()
 
             if not all(col in data_df.columns for col in required_columns):
-                return jsonify({'error': f'Missing required columns. Required columns are: {required_columns}'}), 400
+                return {'error': f'Missing required columns. Required columns are: {required_columns}'}, 400
 
             # Ensure columns are in the correct order
             data_df = data_df[required_columns]
 
             # Process the relevant columns
-            partial_df = data_df.iloc[:, 3:]
-
-            # Prepare background data
-            background_df = pd.DataFrame(background_data, index=[0])
-            background_df = background_df.drop(columns=['Unnamed: 0'], axis=1)
-
-            # Neural Network Model
-            shap_eval = SHAP_Evaluation(model, partial_df, background_df, model_code='DL')
+            partial_df = data_df[entry.features]
 
-            shap_dicts = shap_eval.SHAP_Dictionary()
+            # Predictions and SHAP values through the prediction cache, SHAP skipped with ?explain=false
+            explain = explain_mode(request.args)
+            predictions, shap_dicts = cached_predict(partial_df, explain=explain == 'sync', entry=entry)
+            if shap_dicts is None:
+                shap_dicts = [{} for _ in range(len(partial_df))]
 
             # Add predictions to the DataFrame
-            predictions = model.predict(partial_df)
-            rounded_predictions = np.where(predictions < 0.5, 0, np.where(predictions % 1 >= 0.5, np.ceil(predictions), np.floor(predictions)).astype(int))
+            rounded_predictions = round_predictions(predictions)
             rounded_predictions_list = [pred[0] if isinstance(pred, list) else pred for pred in rounded_predictions.tolist()]
             data_df['Prediction'] = rounded_predictions_list
 
@@ -272,60 +574,273 @@ class PredictProjectDelay(Resource):
                 shap_dict_serialized = {key: float(value) for key, value in shap_dict.items()}
                 shap_dicts_serializable.append(shap_dict_serialized)
 
-            # Calculate total project delay
-            sequential_delay = project_total_delay(data_df)
+            # Propagate the task delays through the dependency graph
+            try:
+                with metrics.timer('graph'):
+                    analysis = project_delay_analysis(data_df)
+            except ValueError as e:
+                return {'error': str(e)}, 400
 
             # Average SHAP scores
-            average_shap = calculate_shap_average(data_df)
+            average_shap = calculate_shap_average(data_df) if explain == 'sync' else None
 
             # Prepare predicted task details
             predicted_task_details = []
             for idx, row in data_df.iterrows():
                 predicted_task_details.append({
-                    "Task_id": int(row["Task_Id"]),
+                    "Task_id": int(row["Id"]),
                     "Prediction": int(rounded_predictions_list[idx]),
+                    "Slack": float(analysis['slack'][idx]),
                     "SHAP_Score": shap_dicts_serializable[idx]
                 })
 
             # Create the final response payload
             payload = {
-                "project_delay": int(sequential_delay),
+                "project_delay": int(analysis['total_delay']),
+                "critical_path": [int(task_id) for task_id in analysis['critical_path']],
                 "average_shap": average_shap,
-                "predicted_task_details": predicted_task_details
+                "predicted_task_details": predicted_task_details,
+                "model": entry.key
             }
 
+            # SHAP scores follow in a background job
+            if explain == 'async':
+                job_id = jobs.submit(project_shap_job, entry, data_df['Id'].tolist(), partial_df.copy())
+                payload['job_id'] = job_id
+                payload['job_url'] = api.url_for(JobStatus, job_id=job_id)
+
             # Return the payload as a JSON response
             return jsonify(payload)
+        except UnknownModelError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             print(traceback.format_exc())
-            return jsonify({'error': str(e)}), 500
+            return {'error': str(e)}, 500
         
+@ns1_route.route('/predict_projects')
+class PredictProjects(Resource):
+    @ns1_route.expect(task_model4)
+    @ns1_route.response(200, 'Success', fields.String(description='Project delay prediction payload of every project'))
+    @ns1_route.response(400, 'Invalid Input', fields.String(description='Error message'))
+    @ns1_route.response(500, 'Internal Server Error', fields.String(description='Error message'))
+    @ns1_route.doc(description="Predict the total delay of many projects in one request. The tasks of all projects go through the model in one call and the delays are propagated over one graph of every project.", params=dict(model_param, explain='true (default) computes SHAP scores, false skips them, async returns a job ID to poll at /jobs/<id>'))
+    def post(self):
+        """Predict the total delay of many projects"""
+        try:
+            entry = requested_model()
+
+            # Parse JSON input
+            data = request.json
+            headers = data.get('header', [])
+            projects = data.get('projects', [])
+
+            # If headers or projects are missing
+            if not headers or not projects:
+                return {'error': 'Headers or projects missing from input'}, 400
+            empty = [project.get('project_id', i) for i, project in enumerate(projects) if not project.get('values')]
+            if empty:
+                return {'error': f'Projects without values: {empty}'}, 400
+
+            project_ids = [project.get('project_id', i) for i, project in enumerate(projects)]
+            if len(set(project_ids)) < len(project_ids):
+                return {'error': 'Project IDs must be unique'}, 400
+
+            # All tasks in one DataFrame, Project holds the project ID of every row
+            with metrics.timer('parse'):
+                sizes = [len(project['values']) for project in projects]
+                data_df = pd.DataFrame([row for project in projects for row in project['values']], columns=headers)
+                data_df['Project'] = pd.Series(project_ids, dtype=object).repeat(sizes).to_numpy()
+            count_rows(len(data_df))
+            # Clients send the task ID as Task_Id
+            data_df = data_df.rename(columns={'Task_Id': 'Id'})
+
+            # Ensure required columns are present
+            required_columns = required_column_project()
+
+            if not all(col in data_df.columns for col in required_columns):
+                return {'error': f'Missing required columns. Required columns are: {required_columns}'}, 400
+
+            data_df = data_df[required_columns + ['Project']]
+            partial_df = data_df[entry.features]
+
+            # One model call for the tasks of every project, SHAP values skipped with ?explain=false
+            explain = explain_mode(request.args)
+            predictions, shap_dicts = cached_predict(partial_df, explain=explain == 'sync', entry=entry)
+            rounded_predictions = round_predictions(predictions)
+            data_df['Prediction'] = rounded_predictions
+
+            # Propagate the task delays of every project through one combined dependency graph
+            try:
+                with metrics.timer('graph'):
+                    analyses = projects_delay_analysis(data_df, 'Project')
+            except ValueError as e:
+                return {'error': str(e)}, 400
+
+            if explain == 'sync':
+                averages = pd.DataFrame(shap_dicts).groupby(np.repeat(np.arange(len(projects)), sizes)).mean()
+
+            task_ids = data_df['Id'].tolist()
+            starts = np.concatenate(([0], np.cumsum(sizes)))
+            results = []
+            for code, (project_id, analysis) in enumerate(zip(project_ids, analyses)):
+                lo, hi = starts[code], starts[code + 1]
+                results.append({
+                    "project_id": project_id,
+                    "project_delay": int(analysis['total_delay']),
+                    "critical_path": [int(task_id) for task_id in analysis['critical_path']],
+                    "average_shap": averages.loc[code].to_dict() if explain == 'sync' else None,
+                    "predicted_task_details": [{
+                        "Task_id": int(task_ids[i]),
+                        "Prediction": int(rounded_predictions[i]),
+                        "Slack": float(analysis['slack'][i - lo]),
+                        "SHAP_Score": shap_dicts[i] if explain == 'sync' else {}
+                    } for i in range(lo, hi)]
+                })
+
+            payload = {"projects": results, "model": entry.key}
+
+            # SHAP scores follow in a background job
+            if explain == 'async':
+                job_id = jobs.submit(projects_shap_job, entry, project_ids, task_ids, starts.tolist(), partial_df.copy())
+                payload['job_id'] = job_id
+                payload['job_url'] = api.url_for(JobStatus, job_id=job_id)
+
+            return jsonify(payload)
+        except UnknownModelError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            print(traceback.format_exc())
+            return {'error': str(e)}, 500
+
+@ns1_route.route('/predict_project_weather')
+class PredictProjectWeather(Resource):
+    @ns1_route.expect(task_model5)
+    @ns1_route.response(200, 'Success', fields.String(description='Project delay distribution over the weather scenarios'))
+    @ns1_route.response(400, 'Invalid Input', fields.String(description='Error message'))
+    @ns1_route.response(500, 'Internal Server Error', fields.String(description='Error message'))
+    @ns1_route.doc(description="What-if weather analysis of one project. Give weather scenarios, or a range of project start dates evaluated against the historical weather. Every scenario is scored in one model call and propagated through the dependency graph together.", params=model_param)
+    def post(self):
+        """Predict the project delay under many weather scenarios"""
+        try:
+            entry = requested_model()
+
+            # Parse JSON input
+            data = request.json
+            headers = data.get('header', [])
+            values = data.get('values', [])
+
+            # If headers or values are missing
+            if not headers or not values:
+                return {'error': 'Headers or values missing from input'}, 400
+
+            with metrics.timer('parse'):
+                data_df = pd.DataFrame(values, columns=headers)
+            count_rows(len(data_df))
+            # Clients send the task ID as Task_Id
+            data_df = data_df.rename(columns={'Task_Id': 'Id'})
+
+            # Ensure required columns are present
+            required_columns = required_column_project()
+
+            if not all(col in data_df.columns for col in required_columns):
+                return {'error': f'Missing required columns. Required columns are: {required_columns}'}, 400
+
+            data_df = data_df[required_columns]
+
+            # The graph is built once and shared by every scenario
+            try:
+                graph = TaskGraph.from_frame(data_df)
+            except ValueError as e:
+                return {'error': str(e)}, 400
+
+            # Weather of every scenario and task, shape (scenarios, tasks, 3). The scenario count is checked before the array is built
+            scenarios = data.get('scenarios')
+            dates = data.get('date_range')
+            too_many = f'Between 1 and {max_scenarios} scenarios can be evaluated per request, got {{}}'
+            if scenarios:
+                scenario_df = pd.DataFrame(scenarios.get('values', []), columns=scenarios.get('header', WEATHER_COLUMNS))
+                if not all(col in scenario_df.columns for col in WEATHER_COLUMNS):
+                    return {'error': f'Scenarios need the columns {WEATHER_COLUMNS}'}, 400
+                if not 0 < len(scenario_df) <= max_scenarios:
+                    return {'error': too_many.format(len(scenario_df))}, 400
+                labels = scenario_df[WEATHER_COLUMNS].to_dict('records')
+                weather = np.repeat(scenario_df[WEATHER_COLUMNS].to_numpy(dtype=float)[:, None, :], len(data_df), axis=1)
+            elif dates:
+                if weather_history is None:
+                    return {'error': f'No weather history at {weather_path}, send scenarios instead'}, 400
+                try:
+                    start, end, step = pd.Timestamp(dates.get('start')), pd.Timestamp(dates.get('end')), int(dates.get('step_days', 1))
+                    if pd.isna(start) or pd.isna(end):
+                        raise ValueError('start and end are required')
+                    if step < 1:
+                        raise ValueError('step_days must be at least 1')
+                    count = (end - start).days // step + 1
+                    if not 0 < count <= max_scenarios:
+                        return {'error': too_many.format(max(count, 0))}, 400
+                    start_dates = pd.date_range(start, end, freq=f'{step}D')
+                except (ValueError, TypeError) as e:
+                    return {'error': f'Invalid date_range: {e}'}, 400
+                labels = [{'start_date': date.date().isoformat()} for date in start_dates]
+                durations = data_df['Duration'].to_numpy(dtype=float)
+                try:
+                    weather = weather_windows(weather_history, start_dates, planned_starts(graph, durations), durations)
+                except ValueError as e:
+                    return {'error': str(e)}, 400
+            else:
+                return {'error': 'Send scenarios or a date_range'}, 400
+
+            # The submitted weather goes first, then every scenario, all scored in one model call
+            weather = np.concatenate([data_df[WEATHER_COLUMNS].to_numpy(dtype=float)[None], weather])
+            scenario_df = scenario_frame(data_df, weather, entry.features)
+            predictions = np.asarray(predict(scenario_df, entry)).reshape(len(scenario_df), -1)[:, 0]
+            rounded_predictions = round_predictions(predictions).reshape(len(weather), len(data_df))
+
+            # One propagation for every scenario
+            with metrics.timer('graph'):
+                finish = graph.propagate(rounded_predictions)
+                totals = finish.max(axis=1)
+                slack = totals[:, None] - (finish + graph.downstream(rounded_predictions))
+
+            task_predictions, task_slack = rounded_predictions[1:], slack[1:]
+            payload = {
+                "baseline_delay": int(totals[0]),
+                "scenarios": len(labels),
+                "project_delay": delay_distribution(totals[1:]),
+                "scenario_results": [dict(label, project_delay=int(total)) for label, total in zip(labels, totals[1:])],
+                "predicted_task_details": [{
+                    "Task_id": int(task_id),
+                    "Prediction": int(rounded_predictions[0, i]),
+                    "Mean_Prediction": float(task_predictions[:, i].mean()),
+                    "Max_Prediction": int(task_predictions[:, i].max()),
+                    # Share of the scenarios with the task on a critical path
+                    "Critical_Share": float((task_slack[:, i] <= 0).mean())
+                } for i, task_id in enumerate(data_df['Id'])],
+                "model": entry.key
+            }
+            return jsonify(payload)
+        except UnknownModelError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            print(traceback.format_exc())
+            return {'error': str(e)}, 500
+
 #Feature Importance endpooint
 @ns1_route.route('/feature_importance')
 class FeatureImportance(Resource):
     @ns1_route.expect(task_model)
     @ns1_route.response(200, 'Success', fields.Raw(description='SHAP feature importance values'))
     @ns1_route.response(500, 'Internal Server Error', fields.String(description='Error message'))
-    @ns1_route.doc(description="Get feature importance using SHAP values based on input features.")
+    @ns1_route.doc(description="Get feature importance using SHAP values based on input features.", params=model_param)
     def post(self):
         """Get feature importance from single task prediction"""
         try:
-            # Parse the input data
-            data = request.json
-            data_df = pd.DataFrame(data, index=[0])
-            background_df = pd.DataFrame(background_data, index=[0])
-
-            # Drop unnecessary columns
-            background_df = background_df.drop(columns=['Unnamed: 0'], axis=1)
-
-            # ML Model
-            # shap_eval = SHAP_Evaluation(model, data_df, background_df, model_code='ML')
-
-            # Neural Network Model
-            shap_eval = SHAP_Evaluation(model, data_df, background_df, model_code='DL')
+            entry = requested_model()
 
-            # Ensemble Model
-            # shap_eval = SHAP_Evaluation(model, data_df, background_df, model_code='EL')
+            # Parse the input data
+            with metrics.timer('parse'):
+                data = request.json
+                data_df = pd.DataFrame(data, index=[0])
+            count_rows(len(data_df))
 
             # Calculate SHAP values
             # shap_values = shap_eval.SHAP_Calculation()
@@ -336,17 +851,130 @@ class FeatureImportance(Resource):
             # plt.close()
 
             # Return the SHAP dictionary
-            shap_dicts = shap_eval.SHAP_Dictionary()
+            shap_dicts = explain_rows(entry, data_df)
 
             return shap_dicts
+        except UnknownModelError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             print(traceback.format_exc())
-            return jsonify({'error': str(e)}), 500
+            return {'error': str(e)}, 500
         
+#Prediction cache statistics endpoint
+@ns1_route.route('/cache')
+class CacheStats(Resource):
+    @ns1_route.response(200, 'Success', fields.Raw(description='Cache hit and miss counters of this worker, per loaded model'))
+    @ns1_route.doc(description="Hit-rate counters of the prediction caches in the worker that serves the request.")
+    def get(self):
+        """Get the prediction cache statistics"""
+        if os.environ.get('PREDICT_CACHE', '1') != '1':
+            return {'enabled': False}, 200
+        models = {key: entry.cache.stats() for key, entry in list(registry.entries.items()) if getattr(entry, 'cache', None) is not None}
+        return {'enabled': True, 'models': models}, 200
+
+#Profiler endpoints
+@ns1_route.route('/profiler')
+class Profiler(Resource):
+    @ns1_route.response(200, 'Success', fields.Raw(description='Profiler status, or the sampled stacks with format=collapsed'))
+    @ns1_route.doc(description="Status of the sampling profiler of the worker that serves the request. With format=collapsed, the sampled stacks in the collapsed format read by flamegraph.pl and speedscope.",
+                   params={'format': 'json (default) or collapsed', 'limit': 'number of stacks returned with format=collapsed, all when empty'})
+    def get(self):
+        """Get the sampling profiler status or its collapsed stacks"""
+        if request.args.get('format') == 'collapsed':
+            limit = request.args.get('limit')
+            return Response(profiler.collapsed(int(limit) if limit else None), mimetype='text/plain')
+        return profiler.describe(), 200
+
+@ns1_route.route('/profiler/start')
+class ProfilerStart(Resource):
+    @ns1_route.response(200, 'Success', fields.Raw(description='Profiler status'))
+    @ns1_route.response(401, 'Missing or wrong admin token', fields.String(description='Error message'))
+    @ns1_route.response(403, 'Admin routes disabled', fields.String(description='Error message'))
+    @ns1_route.doc(description="Start sampling the stacks of this worker, previous samples are dropped. Needs ADMIN_TOKEN.", params=dict(admin_param, interval_ms='milliseconds between two samples (default PROFILER_INTERVAL_MS)'))
+    @admin_only
+    def post(self):
+        """Start the sampling profiler"""
+        interval_ms = request.args.get('interval_ms')
+        profiler.start(float(interval_ms) if interval_ms else None)
+        return profiler.describe(), 200
+
+@ns1_route.route('/profiler/stop')
+class ProfilerStop(Resource):
+    @ns1_route.response(200, 'Success', fields.Raw(description='Profiler status'))
+    @ns1_route.response(401, 'Missing or wrong admin token', fields.String(description='Error message'))
+    @ns1_route.response(403, 'Admin routes disabled', fields.String(description='Error message'))
+    @ns1_route.doc(description="Stop sampling, the samples stay available at /profiler?format=collapsed. Needs ADMIN_TOKEN.", params=admin_param)
+    @admin_only
+    def post(self):
+        """Stop the sampling profiler"""
+        profiler.stop()
+        return profiler.describe(), 200
+
+#Model registry endpoints
+model_select = api.model('ModelSelection', {
+    'model': fields.String(required=True, description='Model name, e.g. RF (latest version) or RF_V6', example='RF_V6')
+})
+
+@ns1_route.route('/models')
+class Models(Resource):
+    @ns1_route.response(200, 'Success', fields.Raw(description='Default model and every registered model with its explainer and feature order'))
+    @ns1_route.doc(description="List the models of the model folder that requests can pick with ?model=.")
+    def get(self):
+        """List the available models"""
+        registry.refresh()
+        return registry.describe(), 200
+
+@ns1_route.route('/models/default')
+class DefaultModel(Resource):
+    @ns1_route.expect(model_select)
+    @ns1_route.response(200, 'Success', fields.Raw(description='Registry with the new default model'))
+    @ns1_route.response(400, 'Unknown model', fields.String(description='Error message'))
+    @ns1_route.response(401, 'Missing or wrong admin token', fields.String(description='Error message'))
+    @ns1_route.response(403, 'Admin routes disabled', fields.String(description='Error message'))
+    @ns1_route.doc(description="Load a model and make it the default without restarting. With MODEL_DEFAULT_FILE set, every worker switches within a few seconds. Needs ADMIN_TOKEN.", params=admin_param)
+    @admin_only
+    def post(self):
+        """Swap the default model"""
+        try:
+            registry.set_default(request.json['model'])
+            return registry.describe(), 200
+        except UnknownModelError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            print(traceback.format_exc())
+            return {'error': str(e)}, 500
+
+#SHAP job status endpoint
+@ns1_route.route('/jobs/<string:job_id>')
+class JobStatus(Resource):
+    @ns1_route.response(200, 'Job finished', fields.Raw(description='Job status with the SHAP result or the error'))
+    @ns1_route.response(202, 'Job still queued or running', fields.Raw(description='Job status'))
+    @ns1_route.response(404, 'Unknown or expired job', fields.String(description='Error message'))
+    @ns1_route.doc(description="Poll the SHAP job created by a request with explain=async.")
+    def get(self, job_id):
+        """Get the status and result of a background SHAP job"""
+        job = jobs.get(job_id)
+        if job is None:
+            return {'error': f'Unknown or expired job {job_id}'}, 404
+
+        payload = {'job_id': job_id, 'status': job['status']}
+        if job['status'] == 'done':
+            payload['result'] = job['result']
+        elif job['status'] == 'failed':
+            payload['error'] = job['error']
+
+        return payload, 200 if 'finished' in job else 202
+
 #Header namespacec
 api.add_namespace(ns1_route)
+
+#Prometheus scrape endpoint, outside the Swagger namespace
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
     
 if __name__ == '__main__':
+    # Development server for local debugging only, production runs wsgi.py under gunicorn
     # Default port is 5500 if no port argument is provided
     port = 5500
     if len(sys.argv) > 1 and sys.argv[1] == '--port':
@@ -0,0 +1,158 @@
+import io
+import re
+import sys
+import json
+import pickle
+import zipfile
+import argparse
+import numpy as np
+
+from runtime import LAYERS, NumpyModel, check_parity
+
+# Export the joblib-pickled Keras models in model/ to NumPy weight bundles for runtime.NumpyModel, without importing TensorFlow
+# Usage: python export_model.py model/CNN_LSTM_V7.pkl model/MLP_V6.pkl [--check test/predictions_output_LSTM.csv]
+
+DEFAULT_MODELS = ['model/LSTM_V7.pkl', 'model/CNN_LSTM_V7.pkl', 'model/MLP_V6.pkl']
+
+# Layer settings the runtime needs, everything else in the Keras config is dropped
+CONFIG_KEYS = ['activation', 'recurrent_activation', 'return_sequences', 'strides', 'pool_size', 'padding', 'n',
+               'scale', 'center', 'epsilon', 'data_format']
+
+class _ArchiveUnpickler(pickle.Unpickler):
+    # Keras pickles a model as a call to deserialize_model_from_bytecode on its .keras archive, keep the archive bytes instead
+    def find_class(self, module, name):
+        if name == 'deserialize_model_from_bytecode':
+            return lambda archive: archive
+        raise pickle.UnpicklingError(f'{module}.{name} is not a pickled Keras model')
+
+def read_archive(model_path):
+    """ Read the Keras archive (config.json and model.weights.h5) embedded in a joblib pickle.
+
+    Returns:
+        Tuple: model config dictionary and opened h5py weights file
+    """
+    import h5py
+    with open(model_path, 'rb') as f:
+        archive = _ArchiveUnpickler(f).load()
+    with zipfile.ZipFile(io.BytesIO(archive)) as z:
+        config = json.loads(z.read('config.json'))
+        weights = h5py.File(io.BytesIO(z.read('model.weights.h5')), 'r')
+    return config, weights
+
+def snake_case(name):
+    name = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
+    return re.sub('([a-z])([A-Z])', r'\1_\2', name).lower()
+
+def _group_vars(group):
+    # vars/0, vars/1, ... of a layer group and of its sub-layers (the LSTM cell), in order
+    arrays = []
+    if 'vars' in group:
+        arrays += [group['vars'][key][()] for key in sorted(group['vars'], key=int)]
+    return arrays
+
+def layer_weights(config, weights):
+    """ Weight arrays of every layer of a Sequential config, in layer order."""
+    layers = [layer for layer in config['config']['layers'] if layer['class_name'] != 'InputLayer']
+
+    # Keras 3 archives name the weight groups after the layers
+    if 'layers' in weights:
+        result = []
+        for layer in layers:
+            group = weights['layers'][layer['config']['name']]
+            arrays = _group_vars(group)
+            if 'cell' in group:
+                arrays += _group_vars(group['cell'])
+            result.append(arrays)
+        return result
+
+    # Keras 2 archives name them after the layer class with a counter, so match them per class in layer order
+    prefix = '_layer_checkpoint_dependencies\\'
+    groups = {}
+    for key in weights:
+        if key.startswith(prefix) and '\\' not in key[len(prefix):]:
+            name = key[len(prefix):]
+            match = re.fullmatch(r'(.+?)(?:_(\d+))?', name)
+            groups.setdefault(match.group(1), []).append((int(match.group(2) or 0), key))
+
+    result = []
+    used = {}
+    for layer in layers:
+        base = snake_case(layer['class_name'])
+        candidates = sorted(groups.get(base, []))
+        position = used.get(base, 0)
+        if position >= len(candidates):
+            raise ValueError(f'No weights found for layer {layer["config"]["name"]}')
+        key = candidates[position][1]
+        used[base] = position + 1
+        arrays = _group_vars(weights[key])
+        if key + '\\cell' in weights:
+            arrays += _group_vars(weights[key + '\\cell'])
+        result.append(arrays)
+    return result
+
+def export(model_path, output_path=None):
+    """ Write the weight bundle of a pickled Keras Sequential model next to it.
+
+    Returns:
+        str: path of the .npz bundle
+    """
+    config, weights = read_archive(model_path)
+    if config['class_name'] != 'Sequential':
+        raise ValueError(f'{model_path}: only Sequential models can be exported, found {config["class_name"]}')
+
+    layers = config['config']['layers']
+    input_config = layers[0]['config']
+    input_shape = input_config.get('batch_input_shape') or input_config.get('batch_shape')
+
+    spec = {'source': model_path, 'input_shape': input_shape, 'layers': []}
+    arrays = {}
+    for i, (layer, layer_arrays) in enumerate(zip([l for l in layers if l['class_name'] != 'InputLayer'], layer_weights(config, weights))):
+        if layer['class_name'] not in LAYERS:
+            raise ValueError(f'{model_path}: layer {layer["class_name"]} is not supported by the NumPy runtime')
+        keys = [f'layer{i}_{j}' for j in range(len(layer_arrays))]
+        arrays.update(zip(keys, layer_arrays))
+        spec['layers'].append({
+            'class_name': layer['class_name'],
+            'config': {key: layer['config'][key] for key in CONFIG_KEYS if key in layer['config']},
+            'weights': keys,
+        })
+    weights.close()
+
+    output_path = output_path or re.sub(r'\.pkl$', '', model_path) + '.npz'
+    np.savez(output_path, spec=np.array(json.dumps(spec)), **arrays)
+    # Loading it back validates the bundle against the runtime
+    NumpyModel.load(output_path)
+    print(f'{model_path} exported to {output_path}')
+    return output_path
+
+def compare_keras(model_path, bundle_path, csv_path, features):
+    """ Compare the raw predictions of the original Keras model and the NumPy runtime, only where TensorFlow is installed."""
+    import joblib
+    import pandas as pd
+    X = pd.read_csv(csv_path)[features].to_numpy(dtype=np.float32)
+    keras_model = joblib.load(model_path)
+    expected = keras_model.predict(X.reshape((-1,) + tuple(keras_model.input_shape[1:])), verbose=0)
+    diff = np.abs(expected - NumpyModel.load(bundle_path).predict(X)).max()
+    print(f'{bundle_path}: max abs difference to Keras {diff:.2e}')
+    return diff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export Keras models to NumPy weight bundles')
+    parser.add_argument('models', nargs='*', default=DEFAULT_MODELS)
+    parser.add_argument('--check', help='saved predictions CSV (e.g. test/predictions_output_LSTM.csv) to check the exported bundles against')
+    parser.add_argument('--keras', action='store_true', help='also compare with the original Keras model, needs TensorFlow')
+    args = parser.parse_args()
+
+    features = ['Duration', 'Trade', 'Progress', 'WorkerScore', 'Temperature', 'RainProb', 'WindSpeed']
+    ok = True
+    for model_path in args.models:
+        try:
+            bundle_path = export(model_path)
+        except (FileNotFoundError, ValueError) as e:
+            print(f'Skipping {model_path}: {e}')
+            continue
+        if args.check:
+            ok &= check_parity(bundle_path, args.check, features) == 1.0
+        if args.keras and args.check:
+            ok &= compare_keras(model_path, bundle_path, args.check, features) < 1e-4
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+
+def parse_predecessors(series):
+    """ Parse a Predecessor column into flat edge lists. Accepts ints, comma separated strings ('1,2') and lists; 0, empty and
+    missing values mean no predecessor.
+
+    Returns:
+        Tuple: row position of each edge's task and the predecessor task ID of each edge
+    """
+    tokens = pd.Series(series.to_numpy(), index=np.arange(len(series)))
+    if not pd.api.types.is_numeric_dtype(tokens):
+        tokens = tokens.astype(str).str.strip('[]').str.split(',').explode().str.strip()
+    pred_ids = pd.to_numeric(tokens, errors='coerce')
+    valid = pred_ids.notna() & (pred_ids != 0)
+    return pred_ids.index.to_numpy()[valid.to_numpy()], pred_ids[valid].to_numpy().astype(np.int64)
+
+def _segments(indptr, nodes):
+    # Concatenated CSR ranges of the given nodes, and the offset of each node's segment
+    counts = indptr[nodes + 1] - indptr[nodes]
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    positions = np.repeat(indptr[nodes] - offsets, counts) + np.arange(counts.sum())
+    return positions, offsets
+
+class TaskGraph:
+    def __init__(self, task_ids, edge_task, edge_pred_id):
+        """ Task dependency graph stored as CSR adjacency arrays, with its topological levels computed once so delays can be
+        propagated for any number of delay vectors.
+
+        Args:
+            task_ids (array): task ID of every row
+            edge_task (array): row position of the dependent task of every edge
+            edge_pred_id (array): task ID of the predecessor of every edge
+
+        Raises:
+            ValueError: duplicate task IDs, unknown predecessors or a dependency cycle
+        """
+        self.task_ids = np.asarray(task_ids)
+        n = len(self.task_ids)
+        self.n = n
+
+        ids = pd.Index(self.task_ids)
+        if not ids.is_unique:
+            raise ValueError(f'Duplicate task IDs: {ids[ids.duplicated()].tolist()}')
+        src = ids.get_indexer(edge_pred_id)
+        if (src < 0).any():
+            raise ValueError(f'Unknown predecessor IDs: {sorted(set(np.asarray(edge_pred_id)[src < 0].tolist()))}')
+        dst = np.asarray(edge_task, dtype=np.int64)
+
+        # Successor CSR (predecessor -> tasks) and predecessor CSR (task -> predecessors)
+        order = np.argsort(src, kind='stable')
+        self.out_indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+        self.out_indices = dst[order]
+        order = np.argsort(dst, kind='stable')
+        self.in_indptr = np.concatenate(([0], np.cumsum(np.bincount(dst, minlength=n))))
+        self.in_indices = src[order]
+
+        # Kahn's algorithm over the CSR arrays, the level of a task is the length of its longest predecessor chain
+        out_indptr, out_indices = self.out_indptr.tolist(), self.out_indices.tolist()
+        indegree = np.diff(self.in_indptr).tolist()
+        level = [0] * n
+        topo = [v for v in range(n) if indegree[v] == 0]
+        for v in topo:
+            for succ in out_indices[out_indptr[v]:out_indptr[v + 1]]:
+                level[succ] = max(level[succ], level[v] + 1)
+                indegree[succ] -= 1
+                if indegree[succ] == 0:
+                    topo.append(succ)
+
+        if len(topo) < n:
+            stuck = np.flatnonzero(np.array(indegree) > 0)
+            raise ValueError(f'Dependency cycle between tasks: {self.task_ids[stuck].tolist()}')
+
+        # Tasks grouped by level, level i spans order[bounds[i]:bounds[i + 1]]
+        level = np.array(level, dtype=np.int64)
+        self.topo = topo
+        self.order = np.argsort(level, kind='stable')
+        self.bounds = np.searchsorted(level[self.order], np.arange(level.max() + 2 if n else 1))
+        self.in_positions, self.in_offsets = _segments(self.in_indptr, self.order)
+        self.out_positions, self.out_offsets = _segments(self.out_indptr, self.order)
+        self.in_offsets = np.append(self.in_offsets, len(self.in_positions))
+        self.out_offsets = np.append(self.out_offsets, len(self.out_positions))
+
+        # Narrow, deep graphs (long chains) are faster node by node than level by level
+        self.deep = n > 0 and n / (len(self.bounds) - 1) < 8
+
+    @classmethod
+    def from_frame(cls, df, id_col='Id', pred_col='Predecessor'):
+        edge_task, edge_pred_id = parse_predecessors(df[pred_col])
+        return cls(df[id_col].to_numpy(), edge_task, edge_pred_id)
+
+    @classmethod
+    def from_projects(cls, df, project_col, id_col='Id', pred_col='Predecessor'):
+        """ One graph over the tasks of many projects, so a single propagation covers all of them. Task IDs only have to be unique
+        within their project, they are shifted per project and every project stays a separate component.
+
+        Args:
+            df (DataFrame): tasks of every project, the rows of a project next to each other
+            project_col (string): project column
+
+        Returns:
+            TaskGraph: graph with project_starts (first row of every project, then the row count), projects and local_ids set
+
+        Raises:
+            ValueError: a project that is not contiguous, or duplicate task IDs, unknown predecessors or a cycle in a project
+        """
+        codes, projects = pd.factorize(df[project_col])
+        # Codes count up in order of first appearance, so they only go down when a project comes back after another one
+        if (np.diff(codes) < 0).any():
+            raise ValueError('The rows of every project must be next to each other')
+        local_ids = df[id_col].to_numpy().astype(np.int64)
+        edge_task, edge_pred_id = parse_predecessors(df[pred_col])
+        span = int(max(local_ids.max(initial=0), edge_pred_id.max(initial=0))) + 1
+        try:
+            graph = cls(local_ids + codes * span, edge_task, edge_pred_id + codes[edge_task] * span)
+        except ValueError:
+            # Shifted IDs mean nothing to the client, find the project at fault and report it with its own IDs
+            starts = np.searchsorted(codes, np.arange(len(projects) + 1))
+            for code, project in enumerate(projects):
+                try:
+                    cls.from_frame(df.iloc[starts[code]:starts[code + 1]], id_col, pred_col)
+                except ValueError as e:
+                    raise ValueError(f'Project {project}: {e}') from None
+            raise
+        graph.projects = projects
+        graph.project_starts = np.searchsorted(codes, np.arange(len(projects) + 1))
+        graph.local_ids = local_ids
+        return graph
+
+    def _levels(self, reverse=False):
+        levels = range(len(self.bounds) - 1)
+        return reversed(levels) if reverse else levels
+
+    def propagate(self, delays):
+        """ Accumulated delay of every task: its own delay plus the largest accumulated delay of its predecessors.
+
+        Args:
+            delays (array): task delays of shape (tasks,) or (scenarios, tasks)
+
+        Returns:
+            ndarray: accumulated delays, same shape as delays
+        """
+        delays = np.asarray(delays, dtype=np.float64)
+        if self.deep and delays.ndim == 1:
+            return self._propagate_scalar(delays)
+
+        finish = delays.copy()
+        for i in self._levels():
+            if i == 0:
+                continue
+            lo, hi = self.bounds[i], self.bounds[i + 1]
+            nodes = self.order[lo:hi]
+            preds = self.in_indices[self.in_positions[self.in_offsets[lo]:self.in_offsets[hi]]]
+            start = np.maximum.reduceat(finish[..., preds], self.in_offsets[lo:hi] - self.in_offsets[lo], axis=-1)
+            finish[..., nodes] += start
+        return finish
+
+    def _propagate_scalar(self, delays):
+        in_indptr, in_indices = self.in_indptr.tolist(), self.in_indices.tolist()
+        finish = delays.tolist()
+        for v in self.topo:
+            lo, hi = in_indptr[v], in_indptr[v + 1]
+            if hi > lo:
+                finish[v] += max(finish[p] for p in in_indices[lo:hi])
+        return np.array(finish)
+
+    def downstream(self, delays):
+        """ Largest delay accumulated by the successors of every task, excluding the task itself."""
+        delays = np.asarray(delays, dtype=np.float64)
+        if self.deep and delays.ndim == 1:
+            return self._downstream_scalar(delays)
+
+        tail = np.zeros_like(delays)
+        counts = np.diff(self.out_indptr)
+        for i in self._levels(reverse=True):
+            lo, hi = self.bounds[i], self.bounds[i + 1]
+            nodes = self.order[lo:hi]
+            has_successor = counts[nodes] > 0
+            if not has_successor.any():
+                continue
+            succs = self.out_indices[self.out_positions[self.out_offsets[lo]:self.out_offsets[hi]]]
+            # reduceat needs non-empty segments, so only reduce the tasks that have successors
+            offsets = (self.out_offsets[lo:hi] - self.out_offsets[lo])[has_successor]
+            tail[..., nodes[has_successor]] = np.maximum.reduceat(delays[..., succs] + tail[..., succs], offsets, axis=-1)
+        return tail
+
+    def _downstream_scalar(self, delays):
+        out_indptr, out_indices = self.out_indptr.tolist(), self.out_indices.tolist()
+        delays = delays.tolist()
+        tail = [0.0] * self.n
+        for v in reversed(self.topo):
+            lo, hi = out_indptr[v], out_indptr[v + 1]
+            if hi > lo:
+                tail[v] = max(delays[s] + tail[s] for s in out_indices[lo:hi])
+        return np.array(tail)
+
+    def analyse(self, delays):
+        """ Project delay, critical path and slack for one delay vector.
+
+        Returns:
+            Dictionary: total delay, critical path task IDs in order, and per task accumulated delay and slack
+        """
+        delays = np.asarray(delays, dtype=np.float64)
+        finish = self.propagate(delays)
+        total = finish.max() if self.n else 0.0
+        slack = total - (finish + self.downstream(delays))
+
+        path = self._critical_path(finish, [int(np.argmax(finish))] if self.n else [])[0]
+        return {
+            'total_delay': total,
+            'critical_path': self.task_ids[path].tolist(),
+            'accumulated_delay': finish,
+            'slack': slack,
+        }
+
+    def _critical_path(self, finish, ends):
+        # Walk back from every end task through the predecessor that determined its start, paths are returned in task order
+        in_indptr, in_indices, finish_list = self.in_indptr.tolist(), self.in_indices.tolist(), finish.tolist()
+        paths = []
+        for node in ends:
+            path = []
+            while node is not None:
+                path.append(node)
+                preds = in_indices[in_indptr[node]:in_indptr[node + 1]]
+                node = max(preds, key=finish_list.__getitem__) if preds else None
+            paths.append(path[::-1])
+        return paths
+
+    def analyse_projects(self, delays):
+        """ analyse for every project of a graph built by from_projects, from one propagation over all of them.
+
+        Returns:
+            list: one analyse dictionary per project, in project order, with the project's own task IDs
+        """
+        delays = np.asarray(delays, dtype=np.float64)
+        finish = self.propagate(delays)
+        starts, sizes = self.project_starts[:-1], np.diff(self.project_starts)
+        totals = np.maximum.reduceat(finish, starts) if self.n else np.zeros(0)
+        slack = np.repeat(totals, sizes) - (finish + self.downstream(delays))
+
+        # Last finishing task of every project, the first one on ties like np.argmax
+        project_of_row = np.repeat(np.arange(len(starts)), sizes)
+        order = np.lexsort((np.arange(self.n), -finish, project_of_row))
+        paths = self._critical_path(finish, order[starts].tolist())
+
+        return [{
+            'total_delay': totals[i],
+            'critical_path': self.local_ids[paths[i]].tolist(),
+            'accumulated_delay': finish[lo:hi],
+            'slack': slack[lo:hi],
+        } for i, (lo, hi) in enumerate(zip(self.project_starts[:-1], self.project_starts[1:]))]
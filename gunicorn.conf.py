@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+# Production server for endpoint2, run with: gunicorn -c gunicorn.conf.py wsgi:app
+bind = f"0.0.0.0:{os.environ.get('PORT', 5500)}"
+workers = int(os.environ.get('WEB_WORKERS', 2))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+
+# A SHAP job is polled from whichever worker gets the request, with several workers keep the jobs in a store they all read
+if workers > 1:
+    os.environ.setdefault('JOBS_DIR', os.path.join(tempfile.gettempdir(), f"delay_prediction_jobs_{os.environ.get('PORT', 5500)}"))
+
+# Load the model once in the master, workers share its memory copy-on-write
+preload_app = True
+
+def post_worker_init(worker):
+    # Warm up inside every worker, the TensorFlow runtime is not fork-safe once it has run a graph
+    if os.environ.get('WARMUP', '1') == '1':
+        from endpoint2 import warmup
+        warmup()
+        worker.log.info('Model warmup done')
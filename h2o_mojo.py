@@ -0,0 +1,152 @@
+import os
+import sys
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+
+# MOJO export of the H2O models and an in-process scorer for them. The scorer runs the h2o-genmodel jar inside this process
+# through JPype, so serving needs neither an H2O cluster nor a REST round trip per request.
+# Export: python h2o_mojo.py model/30_2018_30 model/10_2019_5 [--check data/30_2018/task_train.csv]
+
+DEFAULT_MODELS = ['model/30_2018_30', 'model/10_2019_5']
+GENMODEL_JAR = 'h2o-genmodel.jar'
+
+_jvm_lock = threading.Lock()
+
+def start_jvm(genmodel_jar):
+    """ Start the JVM of this process with the genmodel jar on the classpath, once per process."""
+    try:
+        import jpype
+    except ImportError:
+        raise ImportError('MOJO scoring needs JPype and a Java runtime, install them with: pip install JPype1')
+    with _jvm_lock:
+        if not jpype.isJVMStarted():
+            jpype.startJVM(classpath=[os.path.abspath(genmodel_jar)], convertStrings=True)
+    return jpype
+
+def export_mojo(model_path, output_dir=None):
+    """ Export a saved H2O binary model as a MOJO zip next to it, with the h2o-genmodel jar. Needs h2o and a running cluster,
+    only at export time.
+
+    Returns:
+        str: path of the MOJO zip, named after the model file
+    """
+    import h2o
+    h2o.init()
+    model = h2o.load_model(model_path)
+    return save_mojo(model, output_dir or os.path.dirname(model_path), os.path.basename(model_path))
+
+def save_mojo(model, output_dir, name=None):
+    """ Download the MOJO of a trained H2O model, e.g. an AutoML leader, with the h2o-genmodel jar.
+
+    Returns:
+        str: path of the MOJO zip
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    downloaded = model.download_mojo(path=output_dir, get_genmodel_jar=True, genmodel_name=GENMODEL_JAR)
+    mojo_path = os.path.join(output_dir, f'{name or model.model_id}.zip')
+    os.replace(downloaded, mojo_path)
+    print(f'{model.model_id} exported to {mojo_path}')
+    return mojo_path
+
+class MojoScorer:
+    def __init__(self, mojo_path, genmodel_jar=None):
+        """ H2O MOJO scored in this process, a drop-in for H2O model.predict on pandas data.
+
+        Args:
+            mojo_path (str): MOJO zip written by export_mojo or H2OModel.save_mojo
+            genmodel_jar (str): h2o-genmodel jar, H2O_GENMODEL_JAR or the jar next to the MOJO when None
+        """
+        genmodel_jar = genmodel_jar or os.environ.get('H2O_GENMODEL_JAR') or os.path.join(os.path.dirname(mojo_path), GENMODEL_JAR)
+        self.jpype = start_jvm(genmodel_jar)
+        MojoModel = self.jpype.JClass('hex.genmodel.MojoModel')
+        self.mojo_path = mojo_path
+        self.model = MojoModel.load(os.path.abspath(mojo_path))
+        self.category = str(self.model.getModelCategory())
+
+        # Feature columns in model order, categorical ones with their level -> index map
+        names = list(self.model.getNames())
+        self.features = names[:self.model.nfeatures()]
+        self.domains = {}
+        for i, name in enumerate(self.features):
+            domain = self.model.getDomainValues(i)
+            if domain is not None:
+                self.domains[name] = {str(level): index for index, level in enumerate(domain)}
+        response_domain = self.model.getDomainValues(self.model.getResponseIdx()) if self.model.isSupervised() else None
+        self.labels = list(response_domain) if response_domain is not None else None
+        self.preds_size = self.model.getPredsSize()
+
+    def _encode(self, df):
+        # Rows as the double matrix score0 expects: categorical levels as domain indexes, missing columns and unknown levels as NaN
+        X = np.full((len(df), len(self.features)), np.nan)
+        for j, name in enumerate(self.features):
+            if name not in df.columns:
+                continue
+            column = df[name]
+            if name in self.domains:
+                levels = column.map(lambda value: str(int(value)) if isinstance(value, float) and value.is_integer() else str(value))
+                X[:, j] = levels.map(self.domains[name]).to_numpy(dtype=float, na_value=np.nan)
+            else:
+                X[:, j] = pd.to_numeric(column, errors='coerce').to_numpy(dtype=float)
+        return X
+
+    def predict_raw(self, df):
+        """ score0 output of every row, prediction first then class probabilities for classifiers.
+
+        Returns:
+            ndarray: array of shape (rows, preds size)
+        """
+        JDouble = self.jpype.JDouble
+        rows = self.jpype.JArray(JDouble, 2)(self._encode(df))
+        out = np.empty((len(df), self.preds_size))
+        preds = self.jpype.JArray(JDouble)(self.preds_size)
+        for i in range(len(df)):
+            self.model.score0(rows[i], preds)
+            out[i] = np.asarray(preds)
+        return out
+
+    def predict(self, df):
+        """ Same columns as H2O model.predict(...).as_data_frame(): predict, plus one probability column per class for classifiers.
+
+        Returns:
+            DataFrame: one row per input row
+        """
+        raw = self.predict_raw(df)
+        if self.labels is None or self.category == 'Regression':
+            return pd.DataFrame({'predict': raw[:, 0]})
+        result = pd.DataFrame(raw[:, 1:1 + len(self.labels)], columns=self.labels)
+        result.insert(0, 'predict', [self.labels[int(index)] for index in raw[:, 0]])
+        return result
+
+    def describe(self):
+        return {'mojo': self.mojo_path, 'category': self.category, 'features': self.features, 'labels': self.labels}
+
+def compare_h2o(model_path, mojo_path, csv_path):
+    """ Compare the predictions of the H2O binary model, scored in the cluster, and its MOJO, only where h2o is installed."""
+    import h2o
+    h2o.init()
+    df = pd.read_csv(csv_path)
+    expected = h2o.load_model(model_path).predict(h2o.H2OFrame(df)).as_data_frame()['predict']
+    predicted = MojoScorer(mojo_path).predict(df)['predict']
+    if pd.api.types.is_numeric_dtype(expected):
+        diff = np.abs(expected.to_numpy(dtype=float) - predicted.to_numpy(dtype=float)).max()
+        print(f'{mojo_path}: max abs difference to H2O {diff:.2e}')
+        return diff < 1e-6
+    matches = (expected.astype(str).to_numpy() == predicted.astype(str).to_numpy()).mean()
+    print(f'{mojo_path}: {matches:.2%} of the labels match H2O')
+    return matches == 1.0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export H2O models to MOJO for in-process scoring')
+    parser.add_argument('models', nargs='*', default=DEFAULT_MODELS)
+    parser.add_argument('--output-dir', help='folder of the MOJO zips, next to the models by default')
+    parser.add_argument('--check', help='CSV of feature rows to compare the MOJO with the H2O model on')
+    args = parser.parse_args()
+
+    ok = True
+    for model_path in args.models:
+        mojo_path = export_mojo(model_path, args.output_dir)
+        if args.check:
+            ok &= compare_h2o(model_path, mojo_path, args.check)
+    sys.exit(0 if ok else 1)
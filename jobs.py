@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_FIELDS = ['id', 'status', 'created', 'started', 'finished', 'result', 'error']
+
+class JobQueue:
+    def __init__(self, workers=2, max_jobs=1000, ttl=3600, shared_dir=None):
+        """ Background job queue, used to compute SHAP values after the predictions are returned. Jobs run on worker threads of the
+        process that created them. Without shared_dir their records live in that process's memory, with shared_dir they are kept in
+        a SQLite file every worker process reads, so any gunicorn worker can answer a poll.
+
+        Args:
+            workers (int): number of worker threads
+            max_jobs (int): maximum number of jobs kept, the oldest finished jobs are evicted first
+            ttl (int): seconds a finished job is kept before it expires
+            shared_dir (str): directory of the shared job store, None keeps the jobs in memory only
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.db_path = os.path.join(shared_dir, 'jobs.sqlite') if shared_dir else None
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        if self.db_path:
+            os.makedirs(shared_dir, exist_ok=True)
+            self._db().execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, created REAL, started REAL, '
+                               'finished REAL, result TEXT, error TEXT)')
+
+    def _db(self):
+        # SQLite connections can't cross threads or forks, open one per thread of each process
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            self.local.conn.execute('PRAGMA journal_mode=WAL')
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def submit(self, fn, *args, **kwargs):
+        """ Queue fn(*args, **kwargs) and return the job ID immediately."""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._evict()
+            if self.db_path:
+                self._db().execute('INSERT INTO jobs (id, status, created) VALUES (?, ?, ?)', (job_id, 'queued', time.time()))
+            else:
+                self.jobs[job_id] = {'id': job_id, 'status': 'queued', 'created': time.time()}
+        self.executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status='running', started=time.time())
+        try:
+            result = fn(*args, **kwargs)
+            self._update(job_id, status='done', result=result, finished=time.time())
+        except Exception as e:
+            print(traceback.format_exc())
+            self._update(job_id, status='failed', error=str(e), finished=time.time())
+
+    def _update(self, job_id, **fields):
+        if self.db_path:
+            if 'result' in fields:
+                fields['result'] = json.dumps(fields['result'])
+            columns = ', '.join(f'{field} = ?' for field in fields)
+            self._db().execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+            return
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+
+    def _evict(self):
+        now = time.time()
+        if self.db_path:
+            db = self._db()
+            db.execute('DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?', (now - self.ttl,))
+            excess = db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] - self.max_jobs + 1
+            if excess > 0:
+                db.execute('DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished IS NOT NULL ORDER BY finished LIMIT ?)',
+                           (excess,))
+            return
+        expired = [job_id for job_id, job in self.jobs.items() if 'finished' in job and now - job['finished'] > self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+        finished = [job_id for job_id, job in self.jobs.items() if 'finished' in job]
+        while len(self.jobs) >= self.max_jobs and finished:
+            del self.jobs[finished.pop(0)]
+
+    def get(self, job_id):
+        """ Return a copy of the job record, None if the job is unknown or expired."""
+        if self.db_path:
+            row = self._db().execute(f'SELECT {", ".join(JOB_FIELDS)} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = {field: value for field, value in zip(JOB_FIELDS, row) if value is not None}
+            if 'result' in job:
+                job['result'] = json.loads(job['result'])
+            return job
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
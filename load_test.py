@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# Load test of the prediction API: replays the example payloads in test/ and scaled copies of them at a chosen concurrency
+# Usage: python load_test.py --model model/RF_V6.pkl --sizes 10 100 1000 --concurrency 8 --output results.json [--baseline baseline.json]
+
+TASK_EXAMPLE = 'test/predict_multiple_task_input_example2-2.json'
+PROJECT_EXAMPLE = 'test/predict_project_delay_input_example2-3.json'
+TASK_HEADERS = ['Task_Id', 'Duration', 'Trade', 'Progress', 'WorkerScore', 'Temperature', 'RainProb', 'WindSpeed']
+
+# Latency percentiles and throughput compared with the baseline, higher is worse for latency and better for throughput
+COMPARED = {'p50_ms': 1, 'p95_ms': 1, 'p99_ms': 1, 'rows_per_s': -1}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(model_path, port, server='werkzeug', env=None):
+    """ Start endpoint2 in a child process and wait until it answers.
+
+    Args:
+        model_path (str): model served as the default model (MODEL_PATH)
+        port (int): port to listen on
+        server (str): 'werkzeug' for a threaded development server, 'gunicorn' for the production setup of gunicorn.conf.py
+        env (dict): extra environment variables, e.g. PREDICT_CACHE=0
+
+    Returns:
+        Popen: the server process
+    """
+    child_env = dict(os.environ, MODEL_PATH=os.path.abspath(model_path), PORT=str(port), **(env or {}))
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    else:
+        # Request logging is switched off, printing every request would slow the server down
+        command = [sys.executable, '-c', f'import logging; logging.getLogger("werkzeug").setLevel(logging.WARNING); '
+                                         f'from werkzeug.serving import run_simple; from endpoint2 import app; '
+                                         f'run_simple("127.0.0.1", {port}, app, threaded=True)']
+    process = subprocess.Popen(command, env=child_env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with code {process.returncode}')
+        try:
+            requests.get(f'{url}/DelayPrediction/models', timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('Server did not start within 300s')
+
+def task_payload(size, seed=0):
+    """ /predict_multiple_task body of size tasks, rows drawn from the example file with fresh Task_Ids."""
+    with open(TASK_EXAMPLE) as f:
+        tasks = json.load(f)['tasks']
+    rows = [[task[col] for col in TASK_HEADERS] for task in tasks]
+    picks = np.random.default_rng(seed).integers(len(rows), size=size) if size else range(len(rows))
+    return {'headers': TASK_HEADERS, 'values': [[i + 1] + rows[pick][1:] for i, pick in enumerate(picks)]}
+
+def project_payload(size):
+    """ /predict_project_delay body of size tasks: copies of the example project one after the other, IDs shifted per copy."""
+    with open(PROJECT_EXAMPLE) as f:
+        example = json.load(f)
+    template = example['values']
+    size = size or len(template)
+
+    def shift(ids, offset):
+        if isinstance(ids, list):
+            return [i + offset if i else 0 for i in ids]
+        return ids + offset if ids else 0
+
+    values = []
+    for copy in range(-(-size // len(template))):
+        offset = copy * len(template)
+        for task_id, predecessor, successor, *features in template:
+            values.append([task_id + offset, shift(predecessor, offset), shift(successor, offset)] + features)
+    values = values[:size]
+
+    # Successors cut off by the size limit are dropped, predecessors always have lower IDs in the example
+    for row in values:
+        if isinstance(row[2], list):
+            row[2] = [i for i in row[2] if i <= size] or [0]
+    return {'header': example['header'], 'values': values}
+
+def run_case(url, route, payload, rows, params, requests_count, concurrency, timeout):
+    """ Send requests_count identical requests with concurrency threads.
+
+    Returns:
+        dict: latency percentiles, throughput and error count
+    """
+    body = json.dumps(payload)
+    headers = {'Content-Type': 'application/json'}
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def call(_):
+        started = time.perf_counter()
+        try:
+            response = session.post(f'{url}{route}', data=body, headers=headers, params=params, timeout=timeout)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(call, range(requests_count)))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([latency for latency, ok in results if ok]) * 1000
+    errors = sum(not ok for _, ok in results)
+    result = {'requests': requests_count, 'errors': errors, 'seconds': round(elapsed, 3),
+              'rows_per_s': round(rows * (requests_count - errors) / elapsed, 1),
+              'requests_per_s': round((requests_count - errors) / elapsed, 2)}
+    for p in (50, 95, 99):
+        result[f'p{p}_ms'] = round(float(np.percentile(latencies, p)), 2) if len(latencies) else None
+    return result
+
+def run_suite(url, sizes, concurrency, requests_count, explain_modes, timeout, warmup=3):
+    """ Every route, payload size and explain mode, with a few unmeasured warmup requests before each case."""
+    cases = []
+    for route, build in [('/DelayPrediction/predict_multiple_task', task_payload), ('/DelayPrediction/predict_project_delay', project_payload)]:
+        for size in sizes:
+            payload = build(size)
+            rows = len(payload['values'])
+            for explain in explain_modes:
+                params = {'explain': explain}
+                # Every request repeats the same tasks, so with the prediction cache on the measured requests are cache hits,
+                # --no-cache measures the model itself
+                if warmup:
+                    run_case(url, route, payload, rows, params, warmup, 1, timeout)
+                result = run_case(url, route, payload, rows, params, requests_count, concurrency, timeout)
+                case = {'name': f'{route.rsplit("/", 1)[1]}[rows={rows},explain={explain}]', 'route': route, 'rows': rows,
+                        'explain': explain, 'concurrency': concurrency, **result}
+                print(f"{case['name']:<55} p50 {case['p50_ms']}ms  p95 {case['p95_ms']}ms  p99 {case['p99_ms']}ms  "
+                      f"{case['rows_per_s']} rows/s  errors {case['errors']}")
+                cases.append(case)
+    return cases
+
+def compare(results, baseline, tolerance):
+    """ Cases that got slower than the baseline by more than tolerance (0.2 = 20%).
+
+    Returns:
+        list: one message per regression
+    """
+    previous = {case['name']: case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        old = previous.get(case['name'])
+        if old is None:
+            continue
+        for metric, direction in COMPARED.items():
+            if not old.get(metric) or case.get(metric) is None:
+                continue
+            change = (case[metric] - old[metric]) / old[metric] * direction
+            if change > tolerance:
+                regressions.append(f'{case["name"]} {metric}: {old[metric]} -> {case[metric]} ({change:+.0%})')
+        if case['errors'] > old.get('errors', 0):
+            regressions.append(f'{case["name"]} errors: {old.get("errors", 0)} -> {case["errors"]}')
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test the prediction API')
+    parser.add_argument('--model', default='model/RF_V6.pkl', help='model file served as the default model')
+    parser.add_argument('--url', help='test a running server instead of starting one, e.g. http://localhost:5500')
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn'], default='werkzeug')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 10, 100, 1000, 10000], help='tasks per request, 0 replays the example file as is')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='measured requests per case')
+    parser.add_argument('--explain', nargs='+', default=['false', 'true'], help='explain modes to test')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--no-cache', action='store_true', help='start the server with PREDICT_CACHE=0')
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before a case is flagged')
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        process = start_server(args.model, port, args.server, {'PREDICT_CACHE': '0'} if args.no_cache else None)
+        url = f'http://127.0.0.1:{port}'
+    try:
+        cases = run_suite(url, args.sizes, args.concurrency, args.requests, args.explain, args.timeout)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    results = {
+        'model': args.model if args.url is None else None,
+        'url': args.url,
+        'server': args.server if args.url is None else None,
+        'cache': not args.no_cache,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cases': cases,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f'REGRESSION {message}')
+        print(f'{len(regressions)} regression(s) against {args.baseline}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,258 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cached single task lookup to a large SHAP run
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    escaped = [(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in items]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS, shared_dir=None, flush_interval=1.0):
+        """ Counters and histograms rendered in the Prometheus text format, with the stage timings of the current request kept
+        for a Server-Timing header.
+
+        Args:
+            buckets (tuple): histogram bucket upper bounds in seconds
+            shared_dir (str): directory where every worker process writes its metrics, /metrics then sums all workers.
+                None reports the serving process only
+            flush_interval (float): minimum seconds between two writes of this process' metrics to shared_dir
+        """
+        self.buckets = tuple(buckets)
+        self.shared_dir = shared_dir
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.flushed = 0.0
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        # A forked worker starts from zero, what the parent counted is already in the parent's own file
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric['series'] = {}
+
+    def counter(self, name, help_text):
+        self.metrics.setdefault(name, {'type': 'counter', 'help': help_text, 'series': {}})
+
+    def histogram(self, name, help_text):
+        self.metrics.setdefault(name, {'type': 'histogram', 'help': help_text, 'series': {}})
+
+    def inc(self, name, value=1, **labels):
+        """ Add value to a counter."""
+        key = _label_key(labels)
+        with self.lock:
+            series = self.metrics[name]['series']
+            series[key] = series.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, seconds, **labels):
+        """ Record one observation in a histogram."""
+        key = _label_key(labels)
+        with self.lock:
+            series = self.metrics[name]['series']
+            state = series.get(key)
+            if state is None:
+                state = series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    state['buckets'][i] += 1
+                    break
+            state['sum'] += seconds
+            state['count'] += 1
+        self._maybe_flush()
+
+    def start_request(self):
+        """ Start collecting the stage timings of the request served by this thread."""
+        self.local.timings = []
+
+    def end_request(self):
+        """ Stage timings of the finished request as (stage, seconds) pairs."""
+        timings = getattr(self.local, 'timings', None) or []
+        self.local.timings = None
+        return timings
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """ Time a block into api_stage_seconds, and into the Server-Timing of the current request."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('api_stage_seconds', elapsed, stage=stage, **labels)
+            timings = getattr(self.local, 'timings', None)
+            if timings is not None:
+                timings.append((stage, elapsed))
+
+    def _snapshot(self):
+        with self.lock:
+            return {
+                name: {'type': metric['type'], 'help': metric['help'],
+                       'series': [[list(key), json.loads(json.dumps(value))] for key, value in metric['series'].items()]}
+                for name, metric in self.metrics.items()
+            }
+
+    def _maybe_flush(self, force=False):
+        if not self.shared_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed < self.flush_interval:
+            return
+        self.flushed = now
+        # Write then rename, readers never see a half written file
+        path = os.path.join(self.shared_dir, f'metrics_{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _collect(self):
+        if not self.shared_dir:
+            return [self._snapshot()]
+        self._maybe_flush(force=True)
+        snapshots = []
+        for file_name in os.listdir(self.shared_dir):
+            if file_name.startswith('metrics_') and file_name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.shared_dir, file_name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
+
+    def render(self):
+        """ All metrics in the Prometheus text exposition format, summed over the workers when shared_dir is set."""
+        merged = {}
+        for snapshot in self._collect():
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {'type': metric['type'], 'help': metric['help'], 'series': {}})
+                for key, value in metric['series']:
+                    key = tuple(tuple(item) for item in key)
+                    if metric['type'] == 'counter':
+                        target['series'][key] = target['series'].get(key, 0) + value
+                    else:
+                        state = target['series'].setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                        state['buckets'] = [a + b for a, b in zip(state['buckets'], value['buckets'])]
+                        state['sum'] += value['sum']
+                        state['count'] += value['count']
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f'# HELP {name} {metric["help"]}')
+            lines.append(f'# TYPE {name} {metric["type"]}')
+            for key in sorted(metric['series']):
+                value = metric['series'][key]
+                if metric['type'] == 'counter':
+                    lines.append(f'{name}{_format_labels(key)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, value['buckets']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(key, {"le": str(bound)})} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(key, {"le": "+Inf"})} {value["count"]}')
+                lines.append(f'{name}_sum{_format_labels(key)} {value["sum"]}')
+                lines.append(f'{name}_count{_format_labels(key)} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+def server_timing(timings):
+    """ Server-Timing header value, stages timed several times in one request are summed."""
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in totals.items())
+
+class SamplingProfiler:
+    def __init__(self, interval_ms=10):
+        """ Low overhead sampling profiler: a background thread records the stack of every other thread at a fixed interval.
+        Samples are returned in the collapsed stack format read by flamegraph tools.
+
+        Args:
+            interval_ms (float): time between two samples
+        """
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        # Threads do not survive fork, restart sampling in the worker when it was started before the fork
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        if self.thread is not None:
+            self.thread = None
+            self.start()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval_ms=None):
+        if self.running:
+            return
+        if interval_ms:
+            self.interval = interval_ms / 1000
+        with self.lock:
+            self.samples = Counter()
+            self.sample_count = 0
+        self.started = time.time()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+
+    def _loop(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    self.samples[';'.join(reversed(stack))] += 1
+                self.sample_count += 1
+
+    def collapsed(self, limit=None):
+        """ Sampled stacks as 'frame;frame;frame count' lines, most frequent first."""
+        with self.lock:
+            items = self.samples.most_common(limit)
+        return '\n'.join(f'{stack} {count}' for stack, count in items) + '\n'
+
+    def describe(self):
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000,
+            'started': self.started,
+            'samples': self.sample_count,
+            'stacks': len(self.samples),
+        }
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import threading
+
+from runtime import MODEL_FILE, load_model
+from utility import ExplanationService, resolve_explainer_type, required_column_task
+
+# SHAP model code by model family: ML tree models, EL voting ensembles, DL (any other family) deep learning models
+MODEL_CODES = {'DT': 'ML', 'RF': 'ML', 'XGB': 'ML', 'EM': 'EL'}
+
+class UnknownModelError(KeyError):
+    # KeyError quotes its message, show it as is
+    def __str__(self):
+        return self.args[0]
+
+def model_fingerprint(path):
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+class ModelEntry:
+    def __init__(self, name, version, path, model_code=None, features=None, explainer='auto', shap_settings=None):
+        """ One servable model: its file, SHAP settings and feature order, with the model and explainer loaded on first use.
+
+        Args:
+            name (str): model family, e.g. 'RF' or 'CNN_LSTM'
+            version (int): model version
+            path (str): model file, .pkl for joblib pickles and .npz for NumPy weight bundles
+            model_code (str): 'ML', 'DL' or 'EL', taken from the model family when None
+            features (list): feature order expected by the model, required_column_task() when None
+            explainer (str): 'auto', 'tree', 'gradient' or 'kernel'
+            shap_settings (dict): nsamples and background_k of the explainer
+        """
+        self.name = name
+        self.version = version
+        self.path = path
+        self.model_code = model_code or MODEL_CODES.get(name, 'DL')
+        self.features = list(features or required_column_task())
+        self.explainer_kind = explainer
+        self.shap_settings = shap_settings or {}
+        self.fingerprint = None
+        self.model = None
+        self.report = None
+        self._explainer = None
+        self.prepared = False
+        self.pinned = False
+        self.lock = threading.Lock()
+
+    @property
+    def key(self):
+        return f'{self.name}_V{self.version}'
+
+    def load(self):
+        """ Load the model once, later calls return the loaded model."""
+        with self.lock:
+            if self.model is None:
+                started = time.perf_counter()
+                self.fingerprint = model_fingerprint(self.path)
+                self.model = load_model(self.path)
+                # Students written by distill.py carry their teacher and fidelity in a report next to the model file
+                report_path = os.path.splitext(self.path)[0] + '.json'
+                if os.path.isfile(report_path):
+                    with open(report_path) as f:
+                        self.report = json.load(f)
+                if self.explainer_kind == 'auto':
+                    self.explainer_kind = resolve_explainer_type(self.model, self.model_code)
+                print(f'Model {self.key} loaded from {self.path} in {time.perf_counter() - started:.2f}s')
+        return self.model
+
+    def explainer(self, background_df):
+        """ SHAP explainer of this model, built on first use with the background data in the model's feature order."""
+        model = self.load()
+        with self.lock:
+            if self._explainer is None:
+                self._explainer = ExplanationService(
+                    model,
+                    background_df[self.features],
+                    model_code=self.model_code,
+                    explainer=self.explainer_kind,
+                    nsamples=self.shap_settings.get('nsamples', 'auto'),
+                    background_k=self.shap_settings.get('background_k', 10)
+                )
+        return self._explainer
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def close(self):
+        """ Stop the prediction batcher on_load attached, once the entry is replaced. Requests still holding it finish unbatched."""
+        batcher = getattr(self, 'batcher', None)
+        if batcher is not None:
+            batcher.close()
+
+    def describe(self):
+        return {
+            'model': self.key,
+            'name': self.name,
+            'version': self.version,
+            'path': self.path,
+            'model_code': self.model_code,
+            'explainer': self.explainer_kind,
+            'features': self.features,
+            'loaded': self.loaded,
+            'distilled_from': self.report.get('teacher') if self.report else None,
+            'fidelity': self.report.get('fidelity') if self.report else None,
+        }
+
+class ModelRegistry:
+    def __init__(self, model_dir, background_df, default=None, default_file=None, explainer='auto', shap_settings=None,
+                 on_load=None, check_interval=5):
+        """ Lazily loaded, memory cached models of a model directory, with an atomically swappable default model.
+
+        Args:
+            model_dir (str): directory scanned for {NAME}_V{version}.pkl/.npz files
+            background_df (DataFrame): SHAP background data with every feature column
+            default (str): default model name or file path, the latest version of the first model found when None
+            default_file (str): file holding the default model name, shared by all workers so a swap reaches every process
+            explainer (str): explainer type for every model, 'auto' picks it per model
+            shap_settings (dict): nsamples and background_k of the explainers
+            on_load (function): called with every entry the first time it is served, e.g. to attach a batcher
+            check_interval (float): seconds between two checks of the model directory and the default file
+        """
+        self.model_dir = model_dir
+        self.background_df = background_df
+        self.default_file = default_file
+        self.explainer_kind = explainer
+        self.shap_settings = shap_settings or {}
+        self.on_load = on_load
+        self.check_interval = check_interval
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.checked = time.monotonic()
+        self.scan()
+
+        if default and os.path.isfile(default):
+            default = self.register(default, replace=True).key
+        self.default_name = self._read_default_file() or default or self._first_name()
+
+    def register(self, path, name=None, version=None, model_code=None, features=None, replace=False):
+        """ Add a model file to the registry, name and version are parsed from the file name when not given."""
+        match = MODEL_FILE.match(os.path.basename(path))
+        if name is None:
+            if match is None:
+                raise ValueError(f'{path} is not named like NAME_V1.pkl, pass the name and version')
+            name, version = match.group('name'), int(match.group('version'))
+        entry = ModelEntry(name, int(version or 0), path, model_code, features, self.explainer_kind, self.shap_settings)
+        with self.lock:
+            current = self.entries.get(entry.key)
+            # A NumPy bundle of the same model wins over the pickle, it does not need TensorFlow
+            if replace or current is None or (current.path.endswith('.pkl') and path.endswith('.npz') and not current.loaded and not current.pinned):
+                entry.pinned = replace
+                self.entries[entry.key] = entry
+                if current is not None:
+                    current.close()
+        return self.entries[entry.key]
+
+    def scan(self):
+        """ Register the model files of the model directory that are not known yet."""
+        if not self.model_dir or not os.path.isdir(self.model_dir):
+            return
+        for file_name in sorted(os.listdir(self.model_dir)):
+            if MODEL_FILE.match(file_name):
+                self.register(os.path.join(self.model_dir, file_name))
+
+    def _first_name(self):
+        names = sorted({entry.name for entry in self.entries.values()})
+        return names[0] if names else None
+
+    def _read_default_file(self):
+        if self.default_file and os.path.isfile(self.default_file):
+            with open(self.default_file) as f:
+                return f.read().strip() or None
+        return None
+
+    def resolve(self, name):
+        """ Find the entry of 'RF_V6', 'RF' (latest version) or a registered file path.
+
+        Raises:
+            UnknownModelError: unknown model
+        """
+        with self.lock:
+            if name in self.entries:
+                return self.entries[name]
+            for entry in self.entries.values():
+                if entry.path == name:
+                    return entry
+            versions = [entry for entry in self.entries.values() if entry.name == name]
+            if not versions:
+                raise UnknownModelError(f'Unknown model {name}, available models: {sorted(self.entries)}')
+            return max(versions, key=lambda entry: entry.version)
+
+    def refresh(self):
+        """ Pick up new model files, replaced model files and a changed default file. Runs at most every check_interval."""
+        now = time.monotonic()
+        if now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        self.scan()
+
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if entry.loaded and os.path.isfile(entry.path) and model_fingerprint(entry.path) != entry.fingerprint:
+                    print(f'Model file {entry.path} changed, {key} will be reloaded')
+                    self.entries[key] = ModelEntry(entry.name, entry.version, entry.path, entry.model_code, entry.features,
+                                                   self.explainer_kind, self.shap_settings)
+                    entry.close()
+
+        default = self._read_default_file()
+        if default and default != self.default_name:
+            self.set_default(default, persist=False)
+
+    def get(self, name=None):
+        """ Loaded entry of the requested model, the default model when name is empty.
+
+        Raises:
+            UnknownModelError: unknown model
+        """
+        self.refresh()
+        entry = self.resolve(name or self.default_name)
+        entry.load()
+        self._prepare(entry)
+        return entry
+
+    def _prepare(self, entry):
+        if self.on_load is None or entry.prepared:
+            return
+        with self.lock:
+            if not entry.prepared:
+                self.on_load(entry)
+                entry.prepared = True
+
+    def set_default(self, name, persist=True):
+        """ Load the new default model completely, then swap it in. Requests in flight keep the entry they started with.
+
+        Returns:
+            ModelEntry: the new default model
+        """
+        self.scan()
+        entry = self.resolve(name)
+        entry.load()
+        self._prepare(entry)
+        entry.explainer(self.background_df)
+        with self.lock:
+            self.default_name = entry.key
+        if persist and self.default_file:
+            # Write then rename, so other workers never read a half written name
+            tmp_path = f'{self.default_file}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(entry.key)
+            os.replace(tmp_path, self.default_file)
+        print(f'Default model is now {entry.key}')
+        return entry
+
+    def describe(self):
+        with self.lock:
+            entries = sorted(self.entries.values(), key=lambda entry: (entry.name, entry.version))
+            default = self.resolve(self.default_name).key if self.default_name else None
+        return {'default': default, 'models': [entry.describe() for entry in entries]}
@@ -0,0 +1,220 @@
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from runtime import MODEL_FILE, NumpyModel, load_model, round_half_up
+from distill import FEATURES, read_rows
+
+# Warm-start retraining of a served model on new simulation batches. The current model keeps what it learned and continues on the
+# new rows plus a replay sample of older data, then has to beat itself on a fixed holdout before it is saved as the next version.
+# Usage: python retrain.py model/RF_V6.pkl --new data/10_2021 --old data/30_2019/task_train.csv [--default-file model/default.txt]
+# Every source needs the API features and TaskDelay: the task_data table of a dataset simulated with the current simulate.py, which
+# records WorkerScore, Temperature, RainProb and WindSpeed, or a task_train file that has them. Older datasets lack them and are skipped.
+
+TARGET = 'TaskDelay'
+
+def read_sources(paths, features=FEATURES, target=TARGET):
+    # Task rows with the features and the target of every CSV/Parquet file or dataset directory that has them
+    frames = [df for df in (read_rows(path, features + [target]) for path in paths or []) if df is not None and len(df)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=features + [target])
+
+def row_hashes(df):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def fixed_holdout(path, old, size=2000, seed=0):
+    """ Holdout every candidate is judged on. It is drawn from the old rows on the first run and read back on every later run,
+    so versions stay comparable.
+
+    Returns:
+        DataFrame: holdout rows
+    """
+    if os.path.isfile(path):
+        return pd.read_csv(path)
+    if old.empty:
+        raise ValueError(f'{path} does not exist yet, pass --old data to draw it from')
+    holdout = old.sample(n=min(size, len(old) // 5 or 1), random_state=seed)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    holdout.to_csv(path, index=False)
+    print(f'Holdout of {len(holdout)} rows saved at {path}')
+    return holdout
+
+def training_rows(new, old, holdout, replay=1.0, seed=0):
+    """ New rows plus a replay sample of the old rows, replay * len(new) of them, so the model does not forget older datasets.
+    Rows of the holdout are never trained on.
+
+    Returns:
+        DataFrame: shuffled training rows
+    """
+    columns = list(holdout.columns)
+    held = set(row_hashes(holdout[columns]))
+    new = new[[h not in held for h in row_hashes(new[columns])]] if len(new) else new
+    old = old[[h not in held for h in row_hashes(old[columns])]] if len(old) else old
+    replayed = old.sample(n=min(len(old), int(len(new) * replay)), random_state=seed) if len(old) else old
+    return pd.concat([new, replayed], ignore_index=True).sample(frac=1, random_state=seed)
+
+def warm_start(model, X, y, extra=50, epochs=20, learning_rate=1e-4):
+    """ Copy of model trained further on X, y. Boosted models append trees, forests grow extra trees on the new rows, Keras models
+    continue from their weights with a small learning rate. Models without a way to continue are refitted on X, y.
+
+    Returns:
+        Tuple: the candidate model and how it was trained
+    """
+    if isinstance(model, NumpyModel):
+        raise ValueError('NumPy bundles can not be trained, retrain the Keras pickle and export it again with export_model.py')
+
+    if hasattr(model, 'get_booster'):
+        # A fresh estimator with the settings the pickle kept, get_params fails on pickles of older xgboost versions
+        defaults = type(model)().get_params()
+        settings = {key: getattr(model, key) for key in defaults if getattr(model, key, None) is not None}
+        candidate = type(model)(**dict(settings, n_estimators=extra))
+        candidate.fit(X, y, xgb_model=model.get_booster())
+        return candidate, f'{extra} boosting rounds appended'
+
+    if hasattr(model, 'warm_start') and hasattr(model, 'n_estimators'):
+        candidate = copy.deepcopy(model)
+        candidate.warm_start = True
+        candidate.n_estimators = model.n_estimators + extra
+        candidate.fit(X, y)
+        return candidate, f'{extra} trees appended'
+
+    if hasattr(model, 'layers') and hasattr(model, 'input_shape'):
+        import tensorflow as tf
+        candidate = tf.keras.models.clone_model(model)
+        candidate.set_weights(model.get_weights())
+        candidate.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate), loss='mae')
+        values = X.to_numpy(dtype=np.float32).reshape((-1,) + tuple(model.input_shape[1:]))
+        early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)
+        candidate.fit(values, y.to_numpy(dtype=np.float32), epochs=epochs, batch_size=32, validation_split=0.1,
+                      callbacks=[early_stopping], verbose=0)
+        return candidate, f'fine-tuned for up to {epochs} epochs at learning rate {learning_rate}'
+
+    # fit starts over with the same settings
+    candidate = copy.deepcopy(model)
+    candidate.fit(X, y)
+    return candidate, 'refitted, the model type has no warm start'
+
+def predict(model, X):
+    if hasattr(model, 'layers') and hasattr(model, 'input_shape'):
+        values = X.to_numpy(dtype=np.float32).reshape((-1,) + tuple(model.input_shape[1:]))
+        return np.asarray(model.predict(values, verbose=0)).reshape(-1)
+    return np.asarray(model.predict(X)).reshape(-1)
+
+def evaluate(model, holdout, features=FEATURES, target=TARGET):
+    predicted = predict(model, holdout[features])
+    truth = holdout[target].to_numpy(dtype=float)
+    return {
+        'mae': float(np.abs(predicted - truth).mean()),
+        'rmse': float(np.sqrt(((predicted - truth) ** 2).mean())),
+        'rounded_accuracy': float((round_half_up(predicted) == round_half_up(truth)).mean()),
+    }
+
+def next_version_path(model_path):
+    """ Path of the next version of a model, one above the highest version of its name in its folder."""
+    match = MODEL_FILE.match(os.path.basename(model_path))
+    if match is None:
+        raise ValueError(f'{model_path} is not named like NAME_V1.pkl')
+    name, model_dir = match.group('name'), os.path.dirname(model_path)
+    versions = [int(m.group('version')) for m in map(MODEL_FILE.match, os.listdir(model_dir or '.')) if m and m.group('name') == name]
+    return os.path.join(model_dir, f'{name}_V{max(versions) + 1}.pkl')
+
+def publish(model, path, report, default_file=None):
+    """ Save the model and its report under a new version. Both are written to temporary files and renamed, the model first, so the
+    API never loads half a model and no report describes a version that was not saved. With default_file the API workers switch
+    to it on their next check.
+    """
+    import joblib
+    report_path = os.path.splitext(path)[0] + '.json'
+    tmp_path, tmp_report_path = f'{path}.{os.getpid()}.tmp', f'{report_path}.{os.getpid()}.tmp'
+    try:
+        joblib.dump(model, tmp_path)
+        with open(tmp_report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, path)
+        os.replace(tmp_report_path, report_path)
+    finally:
+        # Left behind only when a step failed
+        for leftover in [tmp_path, tmp_report_path]:
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    if default_file:
+        key = os.path.splitext(os.path.basename(path))[0]
+        with open(f'{default_file}.{os.getpid()}.tmp', 'w') as f:
+            f.write(key)
+        os.replace(f'{default_file}.{os.getpid()}.tmp', default_file)
+    print(f'Published {path}')
+
+def retrain(model_path, new_paths, old_paths=None, holdout_path=None, replay=1.0, extra=50, min_improvement=0.0,
+            default_file=None, seed=0):
+    """ Continue training the current model on new rows and publish it as the next version only if it improves on the holdout.
+
+    Args:
+        model_path (str): current production model, e.g. model/RF_V6.pkl
+        new_paths (list): CSV/Parquet files or dataset directories with the new rows
+        old_paths (list): earlier data, for the replay sample and for drawing the holdout on the first run
+        holdout_path (str): fixed holdout CSV, data/holdout/{NAME}.csv when None
+        replay (float): old rows replayed per new row
+        extra (int): trees or boosting rounds added to tree models
+        min_improvement (float): relative holdout MAE reduction the candidate needs, 0.02 = 2%
+        default_file (str): MODEL_DEFAULT_FILE of the API, switched to the new version when it is published
+        seed (int): seed of the holdout draw and the replay sample
+
+    Returns:
+        dict: report with the holdout scores of both models and the published path, None when nothing was published
+    """
+    match = MODEL_FILE.match(os.path.basename(model_path))
+    name = match.group('name') if match else os.path.splitext(os.path.basename(model_path))[0]
+    holdout_path = holdout_path or os.path.join('data', 'holdout', f'{name}.csv')
+    new, old = read_sources(new_paths), read_sources(old_paths)
+    if new.empty:
+        raise ValueError(f'None of {new_paths} has the columns {FEATURES + [TARGET]}, simulate the new batch with the current simulate.py')
+    holdout = fixed_holdout(holdout_path, old, seed=seed)
+    rows = training_rows(new, old, holdout, replay, seed)
+
+    model = load_model(model_path)
+    started = time.perf_counter()
+    candidate, method = warm_start(model, rows[FEATURES], rows[TARGET], extra)
+    seconds = time.perf_counter() - started
+
+    current_scores, candidate_scores = evaluate(model, holdout), evaluate(candidate, holdout)
+    improved = candidate_scores['mae'] < current_scores['mae'] * (1 - min_improvement)
+    report = {
+        'parent': model_path,
+        'method': method,
+        'new': list(new_paths),
+        'old': list(old_paths or []),
+        'rows': {'new': int(len(new)), 'old': int(len(old)), 'train': int(len(rows)), 'holdout': int(len(holdout))},
+        'holdout': holdout_path,
+        'current': current_scores,
+        'candidate': candidate_scores,
+        'train_seconds': round(seconds, 1),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    print(f'{method} in {seconds:.1f}s on {len(rows)} rows, holdout MAE {current_scores["mae"]:.4f} -> {candidate_scores["mae"]:.4f}')
+    if not improved:
+        print(f'The candidate does not improve on {model_path} by {min_improvement:.0%}, nothing published')
+        return None
+
+    path = next_version_path(model_path)
+    report['published'] = path
+    publish(candidate, path, report, default_file)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Warm-start retraining of a served model on new simulation batches')
+    parser.add_argument('model', help='current model, e.g. model/RF_V6.pkl')
+    parser.add_argument('--new', nargs='+', required=True, help='CSV/Parquet files or dataset directories with new rows')
+    parser.add_argument('--old', nargs='*', default=[], help='earlier data for the replay sample and the first holdout')
+    parser.add_argument('--holdout', help='fixed holdout CSV, data/holdout/{NAME}.csv by default, created on the first run')
+    parser.add_argument('--replay', type=float, default=1.0, help='old rows replayed per new row')
+    parser.add_argument('--extra', type=int, default=50, help='trees or boosting rounds added to tree models')
+    parser.add_argument('--min-improvement', type=float, default=0.0, help='relative holdout MAE reduction needed to publish')
+    parser.add_argument('--default-file', help='MODEL_DEFAULT_FILE of the API, switched to the new version when it is published')
+    args = parser.parse_args()
+
+    report = retrain(args.model, args.new, args.old, args.holdout, args.replay, args.extra, args.min_improvement, args.default_file)
+    sys.exit(0 if report else 1)
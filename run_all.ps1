@@ -1,5 +1,9 @@
 #!/bin/bash
 
+# Every stage records its inputs in <dataset>/manifest.json and is skipped when they
+# have not changed since the last run, pass --force to a stage to rerun it anyway.
+# To build several datasets at once use: python src/pipeline.py --count 10 30 --year 2019 2020
+
 # Run the first script
 # python src/restart.py
 
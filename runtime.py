@@ -0,0 +1,166 @@
+import re
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+# Lightweight CPU inference for the Keras models exported by export_model.py, needs NumPy only
+
+# Model files are named {NAME}_V{version}.pkl or .npz, e.g. CNN_LSTM_V7.pkl. Shared by the model registry and retrain.py
+MODEL_FILE = re.compile(r'^(?P<name>[A-Za-z][A-Za-z0-9_]*?)_V(?P<version>\d+)\.(?P<ext>pkl|npz)$')
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'hard_sigmoid': lambda x: np.clip(0.2 * x + 0.5, 0, 1),
+    'elu': lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+}
+
+def _activation(name):
+    if name not in ACTIVATIONS:
+        raise ValueError(f'Unsupported activation {name}')
+    return ACTIVATIONS[name]
+
+def _windows(x, size, stride):
+    # (rows, steps, channels) -> (rows, out_steps, channels, size) without copying
+    windows = np.lib.stride_tricks.sliding_window_view(x, size, axis=1)
+    return windows[:, ::stride]
+
+def conv1d(x, config, kernel, bias=None):
+    out = np.einsum('nlck,kcf->nlf', _windows(x, kernel.shape[0], config['strides'][0]), kernel)
+    if bias is not None:
+        out = out + bias
+    return _activation(config['activation'])(out)
+
+def max_pooling1d(x, config):
+    return _windows(x, config['pool_size'][0], config['strides'][0]).max(axis=-1)
+
+def flatten(x, config):
+    return x.reshape(len(x), -1)
+
+def repeat_vector(x, config):
+    return np.repeat(x[:, None, :], config['n'], axis=1)
+
+def dense(x, config, kernel, bias=None):
+    out = x @ kernel
+    if bias is not None:
+        out = out + bias
+    return _activation(config['activation'])(out)
+
+def lstm(x, config, kernel, recurrent_kernel, bias=None):
+    # Keras gate order is input, forget, cell, output
+    units = recurrent_kernel.shape[0]
+    activation = _activation(config['activation'])
+    recurrent_activation = _activation(config['recurrent_activation'])
+    # Input projections of every time step in one matmul
+    projected = x @ kernel
+    if bias is not None:
+        projected = projected + bias
+
+    h = np.zeros((len(x), units), dtype=x.dtype)
+    c = np.zeros((len(x), units), dtype=x.dtype)
+    outputs = []
+    for t in range(x.shape[1]):
+        z = projected[:, t] + h @ recurrent_kernel
+        i = recurrent_activation(z[:, :units])
+        f = recurrent_activation(z[:, units:2 * units])
+        o = recurrent_activation(z[:, 3 * units:])
+        c = f * c + i * activation(z[:, 2 * units:3 * units])
+        h = o * activation(c)
+        outputs.append(h)
+    return np.stack(outputs, axis=1) if config['return_sequences'] else h
+
+def batch_normalization(x, config, *weights):
+    weights = list(weights)
+    gamma = weights.pop(0) if config['scale'] else 1.0
+    beta = weights.pop(0) if config['center'] else 0.0
+    mean, variance = weights
+    return (x - mean) / np.sqrt(variance + config['epsilon']) * gamma + beta
+
+def dropout(x, config):
+    return x
+
+LAYERS = {
+    'Conv1D': conv1d,
+    'MaxPooling1D': max_pooling1d,
+    'Flatten': flatten,
+    'RepeatVector': repeat_vector,
+    'Dense': dense,
+    'LSTM': lstm,
+    'BatchNormalization': batch_normalization,
+    'Dropout': dropout,
+}
+
+class NumpyModel:
+    def __init__(self, layers, input_shape, dtype='float32'):
+        """ Sequential model evaluated with NumPy, a drop-in for Keras model.predict in the API.
+
+        Args:
+            layers (list): (class name, config, weight arrays) of every layer
+            input_shape (tuple): model input shape, (None, features) or (None, steps, channels)
+            dtype (str): compute dtype
+        """
+        for class_name, config, weights in layers:
+            if class_name not in LAYERS:
+                raise ValueError(f'Unsupported layer {class_name}')
+            if config.get('padding', 'valid') != 'valid':
+                raise ValueError(f'Unsupported padding {config["padding"]} in {class_name}')
+        self.dtype = np.dtype(dtype)
+        self.model_layers = [(LAYERS[name], config, [w.astype(self.dtype) for w in weights]) for name, config, weights in layers]
+        self.input_shape = tuple(input_shape)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a weight bundle written by export_model.py."""
+        with np.load(path, allow_pickle=False) as bundle:
+            spec = json.loads(str(bundle['spec']))
+            layers = [(layer['class_name'], layer['config'], [bundle[key] for key in layer['weights']]) for layer in spec['layers']]
+        return cls(layers, [None] + spec['input_shape'][1:])
+
+    def predict(self, X, batch_size=None, verbose=0):
+        """ Keras compatible predict, flat rows are reshaped to the model input shape.
+
+        Returns:
+            ndarray: predictions of shape (rows, outputs)
+        """
+        x = np.asarray(X, dtype=self.dtype)
+        x = x.reshape((-1,) + self.input_shape[1:])
+        for layer, config, weights in self.model_layers:
+            x = layer(x, config, *weights)
+        return x
+
+def load_model(path):
+    """ Load the API model, .npz weight bundles use the NumPy runtime and anything else is unpickled with joblib."""
+    if str(path).endswith('.npz'):
+        return NumpyModel.load(path)
+    import joblib
+    return joblib.load(path)
+
+def round_half_up(predictions):
+    predictions = np.asarray(predictions).reshape(-1)
+    return np.where(predictions < 0.5, 0, np.where(predictions % 1 >= 0.5, np.ceil(predictions), np.floor(predictions))).astype(int)
+
+def check_parity(model_path, csv_path, features=None):
+    """ Compare the rounded predictions of a model with the Prediction column of a saved output file.
+
+    Returns:
+        float: share of rows with the same rounded prediction
+    """
+    model = load_model(model_path)
+    df = pd.read_csv(csv_path)
+    features = features or ['Duration', 'Trade', 'Progress', 'WorkerScore', 'Temperature', 'RainProb', 'WindSpeed']
+    predicted = round_half_up(model.predict(df[features]))
+    match = predicted == df['Prediction'].to_numpy()
+    print(f'{model_path}: {match.sum()}/{len(df)} rounded predictions match {csv_path}')
+    for idx in np.flatnonzero(~match)[:10]:
+        print(f'  row {idx}: expected {df["Prediction"].iloc[idx]}, got {predicted[idx]}')
+    return match.mean()
+
+if __name__ == "__main__":
+    # Parity check: python runtime.py model/CNN_LSTM_V7.npz test/predictions_output_LSTM.csv
+    if len(sys.argv) != 3:
+        print('Usage: python runtime.py <model> <predictions_output.csv>')
+        sys.exit(1)
+    sys.exit(0 if check_parity(sys.argv[1], sys.argv[2]) == 1.0 else 1)
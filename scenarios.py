@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+# What-if weather scenarios for one project: the task features are tiled once per scenario with the scenario's weather, so every
+# scenario is scored in one model call and propagated through the project's dependency graph in one pass.
+
+WEATHER_COLUMNS = ['Temperature', 'RainProb', 'WindSpeed']
+
+def load_weather(path):
+    """ Daily historical weather, one row per calendar day with gaps filled from the previous day.
+
+    Returns:
+        DataFrame: Temperature, RainProb and WindSpeed indexed by date
+    """
+    df = pd.read_csv(path)
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    df = df.set_index('datetime')[WEATHER_COLUMNS].astype(float).sort_index()
+    df = df[~df.index.duplicated(keep='last')]
+    return df.asfreq('D').ffill()
+
+def planned_starts(graph, durations):
+    """ Day offset of every task from the project start, each task starting when its last predecessor is planned to finish.
+
+    Returns:
+        ndarray: start offsets in days
+    """
+    durations = np.asarray(durations, dtype=np.float64)
+    return graph.propagate(durations) - durations
+
+def weather_windows(weather, start_dates, offsets, durations):
+    """ Average weather of every task over the days it is planned to run, for every project start date, from prefix sums of
+    the daily weather.
+
+    Args:
+        weather (DataFrame): daily weather from load_weather
+        start_dates (DatetimeIndex): project start date of every scenario
+        offsets (array): planned start offset of every task in days
+        durations (array): task durations in days
+
+    Returns:
+        ndarray: array of shape (scenarios, tasks, weather columns)
+
+    Raises:
+        ValueError: a scenario runs past the days covered by the weather history
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    days = np.maximum(np.asarray(durations, dtype=np.int64), 1)
+    first = weather.index.get_indexer(start_dates)
+    last_day = int((offsets + days).max()) if len(offsets) else 0
+    if (first < 0).any() or first.max() + last_day > len(weather):
+        raise ValueError(f'The weather history covers {weather.index[0].date()} to {weather.index[-1].date()}, '
+                         f'project starts must lie between {weather.index[0].date()} and '
+                         f'{(weather.index[-1] - pd.Timedelta(days=last_day - 1)).date()}')
+
+    prefix = np.vstack([np.zeros((1, weather.shape[1])), np.cumsum(weather.to_numpy(), axis=0)])
+    begin = first[:, None] + offsets[None, :]
+    return (prefix[begin + days] - prefix[begin]) / days[None, :, None]
+
+def scenario_frame(task_df, weather, features):
+    """ Feature rows of every scenario and task, scenario by scenario, with the weather columns replaced.
+
+    Args:
+        task_df (DataFrame): task features of the project
+        weather (ndarray): weather of shape (scenarios, 3) for the whole project or (scenarios, tasks, 3) per task
+        features (list): feature order of the model
+
+    Returns:
+        DataFrame: scenarios * tasks rows
+    """
+    n_scenarios, n_tasks = len(weather), len(task_df)
+    values = np.tile(task_df[features].to_numpy(dtype=np.float64), (n_scenarios, 1, 1))
+    weather = np.asarray(weather, dtype=np.float64)
+    if weather.ndim == 2:
+        weather = np.broadcast_to(weather[:, None, :], (n_scenarios, n_tasks, weather.shape[1]))
+    for j, col in enumerate(WEATHER_COLUMNS):
+        if col in features:
+            values[:, :, features.index(col)] = weather[:, :, j]
+    return pd.DataFrame(values.reshape(n_scenarios * n_tasks, len(features)), columns=features)
+
+def delay_distribution(totals):
+    """ Summary of the project delay over the scenarios.
+
+    Returns:
+        Dictionary: mean, spread and percentiles, and how many scenarios end with each delay
+    """
+    totals = np.asarray(totals)
+    delays, counts = np.unique(totals, return_counts=True)
+    return {
+        'mean': float(totals.mean()),
+        'std': float(totals.std()),
+        'min': int(totals.min()),
+        'p10': float(np.percentile(totals, 10)),
+        'p50': float(np.percentile(totals, 50)),
+        'p90': float(np.percentile(totals, 90)),
+        'max': int(totals.max()),
+        'histogram': [{'delay': int(d), 'scenarios': int(c), 'share': float(c / len(totals))} for d, c in zip(delays, counts)],
+    }
@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import multiprocessing
+import queue as queue_module
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from utils import loadConfig
+
+STAGES = ['generate', 'simulate', 'preprocess']
+
+# Functions timed inside each stage as (module, function, how many rows one call handles), times are inclusive of nested calls
+HOT_FUNCTIONS = {
+    'simulate': [('simulate', 'preprocess_task', lambda args: len(args[0])),
+                 ('simulate', 'simulate_one_day', None),
+                 ('simulate', 'assessWeather', None)],
+    'preprocess': [('preprocess', 'preprocess_task', lambda args: len(args[0])),
+                   ('preprocess', 'estEndDate', None)],
+}
+
+def peak_rss_mb():
+    """ Peak resident memory of this process in MB, None where it can't be measured."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024**2 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 1024**2, 1)
+        except (ImportError, AttributeError):
+            return None
+
+def instrument(module, name, rows_of, stats):
+    """ Replace module.name with a wrapper that adds its calls, rows and time to stats[f'{module}.{name}']."""
+    target = sys.modules[module]
+    function = getattr(target, name)
+    entry = stats.setdefault(f'{module}.{name}', {'calls': 0, 'rows': 0, 'seconds': 0.0})
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            entry['seconds'] += time.perf_counter() - started
+            entry['calls'] += 1
+            entry['rows'] += rows_of(args) if rows_of else 1
+
+    setattr(target, name, timed)
+
+def run_generate(config):
+    # Columnar generator, the same tables generate.run writes without going through MySQL
+    import scale_generate
+    tasks, projects = scale_generate.generate(config)
+    scale_generate.save_data(config, tasks, projects)
+    return len(tasks)
+
+def run_simulate(config):
+    import simulate
+    from registry import dataset_dir, read_manifest
+    simulate.run(config, force=True)
+    return read_manifest(dataset_dir(config))['stages']['simulate']['rows']['task_report']
+
+def run_preprocess(config):
+    import preprocess
+    from registry import dataset_dir, read_manifest
+    preprocess.run(config, force=True)
+    return read_manifest(dataset_dir(config))['stages']['preprocess']['rows']['task_data']
+
+RUNNERS = {'generate': run_generate, 'simulate': run_simulate, 'preprocess': run_preprocess}
+
+def stage_worker(stage, config, quiet, queue):
+    """ Run one stage in a fresh process, so its peak memory is its own, and put its measurements on queue."""
+    if quiet:
+        devnull = open(os.devnull, 'w')
+        sys.stdout = sys.stderr = devnull
+
+    # Import the stage modules before measuring, their import time and memory are reported separately
+    for module, _, _ in HOT_FUNCTIONS.get(stage, []):
+        __import__(module)
+    baseline_rss = peak_rss_mb()
+    functions = {}
+    for module, name, rows_of in HOT_FUNCTIONS.get(stage, []):
+        instrument(module, name, rows_of, functions)
+
+    started = time.perf_counter()
+    try:
+        rows = RUNNERS[stage](config)
+    except (Exception, SystemExit) as e:
+        queue.put({'status': 'failed', 'error': repr(e)})
+        return
+    queue.put({
+        'status': 'ok',
+        'seconds': time.perf_counter() - started,
+        'rows': rows,
+        'baseline_rss_mb': baseline_rss,
+        'peak_rss_mb': peak_rss_mb(),
+        'functions': functions,
+    })
+
+def run_stage(stage, config, timeout=None, quiet=True):
+    """ Run a stage in a child process.
+
+    Returns:
+        dict: wall time, rows, peak memory and hot function timings, or the status 'timeout' or 'failed'
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=stage_worker, args=(stage, config, quiet, queue))
+    process.start()
+    deadline = time.monotonic() + timeout if timeout else None
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except queue_module.Empty:
+            if not process.is_alive():
+                result = {'status': 'failed', 'error': f'exit code {process.exitcode}'}
+            elif deadline is not None and time.monotonic() > deadline:
+                result = {'status': 'timeout'}
+    process.join(5)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+    return result
+
+def run_benchmark(config, sizes, stages=STAGES, data_dir=None, timeout=None, quiet=True):
+    """ Run every stage on a synthetic dataset of each size, stopping a stage at the first size that times out or fails.
+
+    Returns:
+        DataFrame: one row per size and stage or hot function
+    """
+    data_dir = data_dir or os.path.join(config["DATA_DIR"], 'benchmark')
+    rows = []
+    stopped = set()
+    for size in sizes:
+        run_config = dict(config)
+        run_config.update({'PROJECT_COUNT': int(size), 'RUN_ID': f'bench_{size}', 'DATA_DIR': data_dir, 'GENERATOR': 'columnar',
+                           'SIMULATION_SOURCE': 'csv'})
+        for stage in stages:
+            if stage in stopped:
+                rows.append({'projects': size, 'stage': stage, 'name': stage, 'status': 'skipped'})
+                continue
+            print(f'[{size} projects] {stage}...', flush=True)
+            result = run_stage(stage, run_config, timeout, quiet)
+            if result['status'] != 'ok':
+                print(f'[{size} projects] {stage} {result["status"]} {result.get("error", "")}, larger sizes are skipped')
+                # Later stages read what this one writes
+                stopped.update(stages[stages.index(stage):])
+                rows.append({'projects': size, 'stage': stage, 'name': stage, 'status': result['status']})
+                continue
+
+            rows.append({'projects': size, 'stage': stage, 'name': stage, 'status': 'ok', 'calls': 1,
+                         'seconds': round(result['seconds'], 3), 'rows': result['rows'],
+                         'rows_per_s': round(result['rows'] / result['seconds'], 1) if result['seconds'] else None,
+                         'baseline_rss_mb': result['baseline_rss_mb'], 'peak_rss_mb': result['peak_rss_mb']})
+            for name, stats in result['functions'].items():
+                rows.append({'projects': size, 'stage': stage, 'name': name, 'status': 'ok', 'calls': stats['calls'],
+                             'seconds': round(stats['seconds'], 3), 'rows': stats['rows'],
+                             'rows_per_s': round(stats['rows'] / stats['seconds'], 1) if stats['seconds'] else None})
+    return pd.DataFrame(rows)
+
+def scaling_table(results):
+    """ Seconds per size side by side for every stage and hot function, with the empirical scaling exponent between the two largest
+    sizes that completed (1 is linear, 2 quadratic).
+
+    Returns:
+        DataFrame: one row per stage or function
+    """
+    done = results[results['status'] == 'ok']
+    table = done.pivot_table(index=['stage', 'name'], columns='projects', values='seconds', sort=False)
+    table.columns = [f'{size}_s' for size in table.columns]
+
+    def exponent(row):
+        points = [(int(col[:-2]), value) for col, value in row.items() if pd.notna(value) and value > 0]
+        if len(points) < 2:
+            return None
+        (n1, t1), (n2, t2) = points[-2:]
+        return round(np.log(t2 / t1) / np.log(n2 / n1), 2)
+
+    table['exponent'] = table.apply(exponent, axis=1)
+    return table.reset_index()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark generate, simulate and preprocess on synthetic datasets, without MySQL')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000], help='project counts')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--data-dir', help='where the benchmark datasets are written, DATA_DIR/benchmark by default')
+    parser.add_argument('--timeout', type=float, help='seconds a stage may run before it is stopped and larger sizes are skipped')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the stages')
+    parser.add_argument('--output', default='benchmark_results', help='prefix of the .json and .csv result files')
+    args = parser.parse_args()
+
+    config = loadConfig(args.config)
+    results = run_benchmark(config, args.sizes, [s for s in STAGES if s in args.stages], args.data_dir, args.timeout, not args.verbose)
+    table = scaling_table(results)
+
+    pd.set_option('display.width', 200)
+    print(results.drop(columns='stage').to_string(index=False))
+    print()
+    print(table.to_string(index=False))
+
+    results.to_csv(f'{args.output}.csv', index=False)
+    with open(f'{args.output}.json', 'w') as f:
+        json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'sizes': args.sizes,
+                   'results': json.loads(results.to_json(orient='records')),
+                   'scaling': json.loads(table.to_json(orient='records'))}, f, indent=2)
+    print(f'Results saved at {args.output}.json and {args.output}.csv')
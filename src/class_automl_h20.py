@@ -1,8 +1,11 @@
 import sys
 import h2o
 from h2o.automl import H2OAutoML
+import os
 import pandas as pd
 
+from storage import load_matrix
+
 class H2OModel:
     def __init__(self, df, y_target):
         self.df = df
@@ -31,6 +34,28 @@ class H2OModel:
 
         self.model = self.aml.leader
 
+    def continue_training(self, model_path, extra_trees=50):
+        """ Continue a saved GBM or DRF model on the new data from its checkpoint instead of running AutoML again.
+
+        Args:
+            model_path (str): saved H2O binary model, e.g. model/30_2018_30
+            extra_trees (int): trees added to the model
+
+        Returns:
+            Model: the continued model, compared on the validation frame with get_mae
+        """
+        from h2o.estimators import H2OGradientBoostingEstimator, H2ORandomForestEstimator
+        estimators = {'gbm': H2OGradientBoostingEstimator, 'drf': H2ORandomForestEstimator}
+        parent = h2o.load_model(model_path)
+        if parent.algo not in estimators:
+            raise ValueError(f'{model_path} is a {parent.algo} model, only gbm and drf models can continue from a checkpoint')
+
+        self.x_features = [x for x in self.df.columns.tolist() if x != self.y_target]
+        self.model = estimators[parent.algo](checkpoint=parent.model_id, ntrees=parent.actual_params['ntrees'] + extra_trees,
+                                             seed=10)
+        self.model.train(x=self.x_features, y=self.y_target, training_frame=self.data_train, validation_frame=self.data_valid)
+        return self.model
+
     def get_model(self):
         return self.model
 
@@ -40,15 +65,33 @@ class H2OModel:
     def get_shap(self):
         return self.model.shap_summary_plot(self.data_test)
 
+    def save_mojo(self, dir_path, name=None):
+        """ Export the leader as a MOJO zip with the h2o-genmodel jar, for in-process scoring with h2o_mojo.MojoScorer.
+
+        Returns:
+            str: path of the MOJO zip
+        """
+        # h2o_mojo.py lives in the repository root, next to the serving code
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from h2o_mojo import save_mojo
+        return save_mojo(self.model, dir_path, name)
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python class_automl_h20.py <data_path> <target_column>")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python class_automl_h20.py <data_path|matrix_manifest.json> <target_column> [mojo_dir]")
         sys.exit(1)
 
     data_path = sys.argv[1]
-    data_file = pd.read_csv(data_path)
     target_column = sys.argv[2] 
+    if data_path.endswith('_manifest.json'):
+        # Matrix exported by preprocess.py, avoids re-parsing the training CSV
+        dir_path, name = os.path.split(data_path[:-len('_manifest.json')])
+        X, y, manifest = load_matrix(dir_path, name)
+        data_file = pd.DataFrame(X, columns=manifest['features'], copy=False)
+        data_file[manifest['target']] = y
+    else:
+        data_file = pd.read_csv(data_path)
 
     model_obj = H2OModel(data_file, target_column)
     model_obj.initialize()
@@ -58,4 +101,6 @@ if __name__ == "__main__":
     mae = model_obj.get_mae()
 
     print(f"MAE: {mae}")
+    if len(sys.argv) == 4:
+        print(f"Leader MOJO saved at {model_obj.save_mojo(sys.argv[3])}")
     model_obj.get_shap()
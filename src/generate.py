@@ -1,14 +1,19 @@
 import random
 import pandas as pd
 import os
-import mysql.connector
 from datetime import datetime, timedelta
 import sys
+from faker import Faker
 
-from project import Project
+import scale_generate
 from utils import loadConfig
+from storage import write_table
+from registry import dataset_dir, config_digest, is_fresh, record_stage
 
 def project_generator(config):
+    # Project writes to MySQL, imported here like the driver so the columnar path doesn't need it
+    from project import Project
+
     n = config["PROJECT_COUNT"]
     start_date = config["PROJECT_START_DATE"]
     start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
@@ -26,12 +31,14 @@ def project_generator(config):
         project.tosql()
 
 def save_data(config):
+    # Imported here so the columnar generator and the pipeline run without the MySQL driver
+    import mysql.connector
+
     server = config["SERVER"]
     database = config["DATABASE"]
     user = config['USERNAME']
     password = config["PASSWORD"]
     port = config["PORT"]
-    data_dir = config["DATA_DIR"]
 
     try:
         conn = mysql.connector.connect(
@@ -54,23 +61,43 @@ def save_data(config):
         conn.close()
 
         print("SQL script executed successfully.")
-        dir_name = str(config["PROJECT_COUNT"]) + '_' + config["PROJECT_START_DATE"][:4]
-        dir_path = os.path.join(data_dir, dir_name)
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
+        dir_path = dataset_dir(config, create=True)
         
-        task_path = os.path.join(dir_path, 'task.csv')
-        project_path = os.path.join(dir_path, 'project.csv')
-        tasks.to_csv(task_path, index=False)
-        projects.to_csv(project_path, index=False)
+        write_table(tasks, dir_path, 'task', config)
+        write_table(projects, dir_path, 'project', config)
         
         print(f'All data saved at {dir_path}')
+        return tasks, projects
 
     except mysql.connector.Error as e:
         print("Error connecting to MySQL:", e)
         sys.exit(1)
 
+def run(config, force=False, restart_db=False):
+    dir_path = dataset_dir(config, create=True)
+    inputs = {'config': config_digest(config)}
+    if not force and is_fresh(dir_path, 'generate', inputs, ['task', 'project']):
+        print(f'Generated data at {dir_path} is up to date, skipping generation')
+        return False
+
+    started = datetime.now()
+    if config.get("GENERATOR", 'sql') == 'columnar':
+        tasks, projects = scale_generate.generate(config)
+        scale_generate.save_data(config, tasks, projects)
+    else:
+        if restart_db:
+            # Projects accumulate in the database, start from an empty one so runs don't mix
+            import restart
+            restart.run(config)
+        if config.get("SEED") is not None:
+            random.seed(config["SEED"])
+            Faker.seed(config["SEED"])
+
+        project_generator(config)
+        tasks, projects = save_data(config)
+    record_stage(config, dir_path, 'generate', inputs, {'task': len(tasks), 'project': len(projects)}, started)
+    return True
+
 if __name__ == "__main__":
     config = loadConfig('config.yaml')
-    project_generator(config)
-    save_data(config)
+    run(config, force='--force' in sys.argv)
@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+import generate
+import simulate
+import preprocess
+from utils import loadConfig
+from registry import run_id
+
+STAGES = ['generate', 'simulate', 'preprocess']
+RUNNERS = {'generate': generate.run, 'simulate': simulate.run, 'preprocess': preprocess.run}
+
+def expand_grid(config, counts=None, years=None, seeds=None):
+    """ Build one config per combination of project count, start year and seed. Values missing from the command line are taken
+    from PIPELINE_GRID in the config file, then from the single values of the config itself.
+
+    Returns:
+        List: a list of run configs
+    """
+    grid = config.get("PIPELINE_GRID") or {}
+    counts = counts or grid.get("PROJECT_COUNT") or [config["PROJECT_COUNT"]]
+    years = years or grid.get("PROJECT_START_YEAR") or [config["PROJECT_START_DATE"][:4]]
+    seeds = seeds or grid.get("SEED") or [config.get("SEED")]
+
+    configs = []
+    for count, year, seed in itertools.product(counts, years, seeds):
+        run_config = dict(config)
+        run_config["PROJECT_COUNT"] = int(count)
+        run_config["PROJECT_START_DATE"] = f'{year}' + config["PROJECT_START_DATE"][4:]
+        run_config["SEED"] = seed
+        configs.append(run_config)
+
+    # Runs that would share a {count}_{year} directory get derived run IDs instead
+    if len({run_id(c) for c in configs}) < len(configs):
+        for run_config in configs:
+            run_config["RUN_ID"] = 'auto'
+
+    return configs
+
+def worker_count(config, n_runs):
+    """ Number of concurrent runs, bounded by the CPU count, PIPELINE_WORKERS and the memory budget.
+    PIPELINE_RUN_MEMORY_GB is the expected peak memory of one run.
+    """
+    workers = min(n_runs, config.get("PIPELINE_WORKERS") or os.cpu_count() or 1)
+
+    run_memory = config.get("PIPELINE_RUN_MEMORY_GB", 1.0)
+    budget = config.get("PIPELINE_MEMORY_GB")
+    if budget is None:
+        try:
+            import psutil
+            budget = psutil.virtual_memory().available / 1024**3 * 0.8
+        except ImportError:
+            budget = None
+    if budget is not None:
+        workers = min(workers, max(1, int(budget // run_memory)))
+
+    return max(1, workers)
+
+def run_stages(config, stages, force=False, restart_db=False):
+    """ Run the given stages of one config in order, stopping at the first failure.
+
+    Returns:
+        Dictionary: run ID and the wall time in seconds of each stage, 'skipped' for up to date stages
+    """
+    result = {'run_id': run_id(config)}
+    for stage in stages:
+        started = time.perf_counter()
+        try:
+            if stage == 'generate':
+                ran = generate.run(config, force=force, restart_db=restart_db)
+            else:
+                ran = RUNNERS[stage](config, force=force)
+        except (Exception, SystemExit) as e:
+            result[stage] = 'failed'
+            result['error'] = str(e)
+            break
+        result[stage] = round(time.perf_counter() - started, 2) if ran else 'skipped'
+    return result
+
+def database_stages(configs, stages):
+    """ Stages that go through the one MySQL database: generation with GENERATOR sql and simulation with SIMULATION_SOURCE sql.
+    They run back to back for one config at a time, the database only ever holds the projects of the run being generated.
+
+    Returns:
+        List: the stages to run serially, in DAG order
+
+    Raises:
+        ValueError: several runs would simulate from the database without generating into it first
+    """
+    serial = [s for s in ['generate'] if s in stages and configs[0].get("GENERATOR", 'sql') == 'sql']
+    if 'simulate' in stages and configs[0]["SIMULATION_SOURCE"] == 'sql':
+        if not serial and len(configs) > 1:
+            raise ValueError('SIMULATION_SOURCE sql reads whatever the last SQL generation left in the database, run the grid with '
+                             'SIMULATION_SOURCE csv or with the generate stage and GENERATOR sql')
+        serial.append('simulate')
+    return serial
+
+def run_pipeline(configs, stages=STAGES, force=False):
+    """ Execute the generate -> simulate -> preprocess DAG of every config. The stages of one run are sequential, independent runs are
+    executed concurrently in a process pool. Stages that go through the shared SQL database run serially, config by config, before
+    the pool starts.
+
+    Returns:
+        DataFrame: summary table with one row per run
+    """
+    results = {run_id(c): {'run_id': run_id(c)} for c in configs}
+    serial_stages = database_stages(configs, stages)
+    parallel_stages = [s for s in stages if s not in serial_stages]
+
+    for run_config in configs if serial_stages else []:
+        # Simulating from SQL needs this run's projects in the database, so generation can not be skipped as up to date
+        results[run_id(run_config)].update(run_stages(run_config, serial_stages, force or 'simulate' in serial_stages, restart_db=True))
+
+    # A run whose database stages failed has nothing for its later stages to read
+    pending = [c for c in configs if 'error' not in results[run_id(c)]] if parallel_stages else []
+    workers = worker_count(configs[0], len(pending))
+    print(f'Running {len(pending)} pipelines with {workers} workers')
+
+    # A fresh process per run returns its memory to the system once the run is done
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(run_stages, c, parallel_stages, force): run_id(c) for c in pending}
+        for future in as_completed(futures):
+            rid = futures[future]
+            try:
+                results[rid].update(future.result())
+            except Exception as e:
+                results[rid].update({'error': str(e)})
+            print(f'[{rid}] done')
+
+    summary = pd.DataFrame(list(results.values()))
+    columns = ['run_id'] + [s for s in STAGES if s in summary.columns] + (['error'] if 'error' in summary.columns else [])
+    return summary[columns]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run generate -> simulate -> preprocess for a grid of configs in parallel')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--count', nargs='+', type=int, help='project counts')
+    parser.add_argument('--year', nargs='+', help='project start years')
+    parser.add_argument('--seed', nargs='+', type=int, help='random seeds')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--workers', type=int, help='maximum number of concurrent runs')
+    parser.add_argument('--force', action='store_true', help='rerun stages that are up to date')
+    args = parser.parse_args()
+
+    config = loadConfig(args.config)
+    if args.workers:
+        config["PIPELINE_WORKERS"] = args.workers
+
+    configs = expand_grid(config, args.count, args.year, args.seed)
+    try:
+        summary = run_pipeline(configs, args.stages, args.force)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    print(summary.to_string(index=False))
+    summary_path = os.path.join(config["DATA_DIR"], 'pipeline_summary.csv')
+    summary.to_csv(summary_path, index=False)
+    print(f'Summary saved at {summary_path}')
+
+    if 'error' in summary.columns and summary['error'].notna().any():
+        sys.exit(1)
@@ -1,17 +1,19 @@
 import os
+import sys
 import pandas as pd
+from datetime import datetime
 
 from utils import isWeekend, estEndDate, loadConfig
+from storage import read_table, write_table, write_matrix
+from registry import dataset_dir, table_fingerprints, is_fresh, record_stage
 
 def read_data(config):
-    data_dir = config["DATA_DIR"]
-    dir_name = str(config["PROJECT_COUNT"]) + '_' + config["PROJECT_START_DATE"][:4]
-    dir_path = os.path.join(data_dir,dir_name)
+    dir_path = dataset_dir(config)
     
-    tasks = pd.read_csv(os.path.join(dir_path, 'task_report.csv'))
-    projects = pd.read_csv(os.path.join(dir_path, 'project_report.csv'))
-    tasks_detail = pd.read_csv(os.path.join(dir_path, 'task.csv'))
-    projects_detail = pd.read_csv(os.path.join(dir_path, 'project.csv'))
+    tasks = read_table(dir_path, 'task_report', config)
+    projects = read_table(dir_path, 'project_report', config)
+    tasks_detail = read_table(dir_path, 'task', config)
+    projects_detail = read_table(dir_path, 'project', config)
     return tasks, tasks_detail, projects, projects_detail
 
 def preprocess_task(df):
@@ -28,12 +30,13 @@ def preprocess_task(df):
     df['TaskDelay'] = df.apply(lambda x: x['ActualEndDate'].date() - estEndDate(x['ActualStartDate'].date(), x['Duration'], x['WorkDay']),axis=1).dt.days
 
     TaskToday = df.groupby(['Date','ProjectID'])['ID'].count().reset_index(name='TaskToday')
-    df = pd.merge(tasks,TaskToday,on=['Date','ProjectID'],how='left')
+    df = pd.merge(df,TaskToday,on=['Date','ProjectID'],how='left')
     return df
 
 def feature_engineering_task(df):
     # df['Priority'] = df['Priority'].apply(lambda x: 1 if x=='Critical' else 0)
-    status_ohe = pd.get_dummies(df['Status'], prefix='Is').astype(int)
+    # Status is categorical on read, only one-hot encode the states that occur
+    status_ohe = pd.get_dummies(df['Status'].astype(object), prefix='Is').astype(int)
     df = pd.concat([df, status_ohe], axis=1)
     df.drop(columns='Status', inplace=True)
     
@@ -54,8 +57,15 @@ def preprocess_project(df):
     df['Delay'] = (df['ActualEndDate'] - df['EndDate']).dt.days
     return df
 
-if __name__ == "__main__":
-    config = loadConfig('config.yaml')
+def run(config, force=False):
+    dir_path = dataset_dir(config)
+    inputs = table_fingerprints(dir_path, ['task_report', 'project_report', 'task', 'project'], config)
+    inputs['MATRIX_EXPORT'] = config.get("MATRIX_EXPORT", True)
+    if not force and is_fresh(dir_path, 'preprocess', inputs, ['task_data', 'task_train', 'project_data', 'project_train']):
+        print(f'Processed data at {dir_path} is up to date, skipping preprocessing')
+        return False
+
+    started = datetime.now()
     tasks, tasks_detail, projects, projects_details = read_data(config)
     
     tasks = preprocess_task(tasks)
@@ -66,13 +76,19 @@ if __name__ == "__main__":
     projects_df =  projects.drop(columns=['Date','ProjectID','StartDate','EndDate','ActualStartDate','ActualEndDate'])
     projects_df = projects_df.astype(float)
     
-    data_dir = config["DATA_DIR"]
-    dir_name = str(config["PROJECT_COUNT"]) + '_' + config["PROJECT_START_DATE"][:4]
-    dir_path = os.path.join(data_dir,dir_name)
-    
-    tasks.to_csv(os.path.join(dir_path,'task_data.csv'),index=False)
-    tasks_df.to_csv(os.path.join(dir_path,'task_train.csv'),index=False)
-    projects.to_csv(os.path.join(dir_path,'project_data.csv'),index=False)
-    projects_df.to_csv(os.path.join(dir_path,'project_train.csv'),index=False)
+    write_table(tasks, dir_path, 'task_data', config)
+    write_table(tasks_df, dir_path, 'task_train', config)
+    write_table(projects, dir_path, 'project_data', config)
+    write_table(projects_df, dir_path, 'project_train', config)
+
+    if config.get("MATRIX_EXPORT", True):
+        write_matrix(tasks_df, dir_path, 'task_train', 'TaskDelay')
+        write_matrix(projects_df, dir_path, 'project_train', 'Delay')
     
-    print(f'All processed data is saved at {dir_path}')
\ No newline at end of file
+    print(f'All processed data is saved at {dir_path}')
+    record_stage(config, dir_path, 'preprocess', inputs, {'task_data': len(tasks), 'task_train': len(tasks_df), 'project_data': len(projects), 'project_train': len(projects_df)}, started)
+    return True
+
+if __name__ == "__main__":
+    config = loadConfig('config.yaml')
+    run(config, force='--force' in sys.argv)
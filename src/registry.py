@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from storage import table_path
+
+MANIFEST_FILE = 'manifest.json'
+REGISTRY_FILE = 'registry.json'
+
+# Config keys that change the generated data, used to derive run IDs
+GENERATION_KEYS = ['PROJECT_COUNT', 'PROJECT_START_DATE', 'SEED', 'GENERATOR']
+
+def config_digest(config, keys=GENERATION_KEYS):
+    subset = {key: config.get(key) for key in keys}
+    # The columnar generator draws from the SCALE_GENERATOR distributions, they change its data as much as the keys do
+    if keys is GENERATION_KEYS and config.get("GENERATOR") == 'columnar':
+        subset['SCALE_GENERATOR'] = config.get("SCALE_GENERATOR") or {}
+    return hashlib.sha1(json.dumps(subset, sort_keys=True, default=str).encode()).hexdigest()
+
+def legacy_dir_name(config):
+    return str(config["PROJECT_COUNT"]) + '_' + config["PROJECT_START_DATE"][:4]
+
+def run_id(config):
+    """ Resolve the run ID of a config. An empty RUN_ID keeps the legacy {count}_{year} directory, 'auto' derives an ID from the
+    generation settings so runs with a different seed or generator no longer overwrite each other.
+
+    Returns:
+        string: run ID, also the directory name inside DATA_DIR
+    """
+    rid = config.get("RUN_ID")
+    if not rid:
+        return legacy_dir_name(config)
+    if rid == 'auto':
+        return f'{legacy_dir_name(config)}_s{config.get("SEED")}_{config_digest(config)[:8]}'
+    return str(rid)
+
+def dataset_dir(config, create=False):
+    dir_path = os.path.join(config["DATA_DIR"], run_id(config))
+    if create and not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    return dir_path
+
+def read_manifest(dir_path):
+    path = os.path.join(dir_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'stages': {}}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def write_manifest(dir_path, manifest):
+    # Write then rename so a crashed stage never leaves a half written manifest
+    path = os.path.join(dir_path, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=4, default=str)
+    os.replace(path + '.tmp', path)
+
+def file_fingerprint(path):
+    """ Make-style fingerprint of a file, based on its size and modification time."""
+    if path is None or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+def table_fingerprints(dir_path, names, config=None):
+    data_format = config.get("DATA_FORMAT", 'csv') if config else None
+    return {name: file_fingerprint(table_path(dir_path, name, data_format)) for name in names}
+
+def is_fresh(dir_path, stage, inputs, outputs):
+    """ Check whether a stage can be skipped: it completed before with the same inputs and all of its outputs still exist.
+
+    Args:
+        dir_path (string): dataset directory
+        stage (string): stage name, e.g. 'simulate'
+        inputs (dict): fingerprints of everything the stage reads
+        outputs (list): table names the stage writes
+
+    Returns:
+        bool: True if the stage is up to date
+    """
+    record = read_manifest(dir_path)['stages'].get(stage)
+    if record is None or record.get('inputs') != inputs:
+        return False
+    return all(table_path(dir_path, name) is not None for name in outputs)
+
+def record_stage(config, dir_path, stage, inputs, rows, started):
+    """ Record a completed stage in the run manifest and the registry index.
+
+    Args:
+        config (dict): loaded config of the run
+        dir_path (string): dataset directory
+        stage (string): stage name
+        inputs (dict): fingerprints of everything the stage read
+        rows (dict): row count of each table the stage wrote
+        started (datetime): stage start time
+    """
+    manifest = read_manifest(dir_path)
+    manifest['run_id'] = run_id(config)
+    manifest['seed'] = config.get("SEED")
+    manifest['config'] = {key: value for key, value in config.items() if key not in ('USERNAME', 'PASSWORD', 'API_KEY')}
+    manifest['stages'][stage] = {
+        'inputs': inputs,
+        'rows': rows,
+        'started': started.isoformat(timespec='seconds'),
+        'completed': datetime.now().isoformat(timespec='seconds'),
+    }
+    # Downstream stages were built from the previous outputs and are stale now
+    order = ['generate', 'simulate', 'preprocess']
+    if stage in order:
+        for later in order[order.index(stage) + 1:]:
+            manifest['stages'].pop(later, None)
+    write_manifest(dir_path, manifest)
+    update_registry(config, dir_path, stage)
+
+@contextmanager
+def registry_lock(data_dir, timeout=30):
+    # Lock file shared by concurrent pipeline workers, works on both Windows and Linux
+    lock_path = os.path.join(data_dir, REGISTRY_FILE + '.lock')
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.time() > deadline:
+                # Stale lock left by a killed process
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+                deadline = time.time() + timeout
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+def update_registry(config, dir_path, stage):
+    path = os.path.join(config["DATA_DIR"], REGISTRY_FILE)
+    with registry_lock(config["DATA_DIR"]):
+        registry = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                registry = json.load(file)
+
+        entry = registry.setdefault(run_id(config), {'created': datetime.now().isoformat(timespec='seconds')})
+        entry['path'] = dir_path
+        entry['seed'] = config.get("SEED")
+        entry['last_stage'] = stage
+        entry['updated'] = datetime.now().isoformat(timespec='seconds')
+
+        with open(path + '.tmp', 'w') as file:
+            json.dump(registry, file, indent=4)
+        os.replace(path + '.tmp', path)
+
+if __name__ == "__main__":
+    from utils import loadConfig
+
+    config = loadConfig('config.yaml')
+    path = os.path.join(config["DATA_DIR"], REGISTRY_FILE)
+    if not os.path.exists(path):
+        print('No runs registered yet.')
+    else:
+        with open(path, 'r') as file:
+            registry = json.load(file)
+        for rid, entry in registry.items():
+            print(f"{rid:<40} {entry['last_stage']:<12} {entry['updated']}  {entry['path']}")
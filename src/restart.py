@@ -93,8 +93,7 @@ def df_to_mysql(df, config):
     except mysql.connector.Error as e:
         print("Error connecting to MySQL:", e)
 
-if __name__ == "__main__":
-    config = loadConfig('config.yaml')
+def run(config):
     weather_path = config["WEATHER_PATH"]
 
     execute_sql_script(config)
@@ -104,3 +103,7 @@ if __name__ == "__main__":
     
     user = User(50)
     user.tosql()
+
+if __name__ == "__main__":
+    config = loadConfig('config.yaml')
+    run(config)
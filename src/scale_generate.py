@@ -0,0 +1,181 @@
+import sys
+import numpy as np
+import pandas as pd
+from datetime import date
+from faker import Faker
+
+from utils import loadConfig
+from storage import write_table
+from registry import dataset_dir
+
+DEFAULTS = {
+    'TASK_COUNT': [80, 150],
+    'BRANCH_THRESHOLD': 120,
+    'INTERVAL_EXTRA': [1, 6],
+    'OFFSET_MONTHS': [0, 36],
+    'WORKDAYS': [31, 63, 127],
+    'LARGE': {'COST': [1000, 3000], 'DURATION': [8, 20], 'TRADE': [22, 37]},
+    'SMALL': {'COST': [200, 1000], 'DURATION': [2, 8], 'TRADE': [1, 22]},
+    'WORKER_SCORE': [30, 100],
+    'GAP_DAYS': [0, 2],
+    'BRANCH_JITTER_DAYS': [0, 7],
+    'RESTART_AFTER': 30,
+    'RESTART_PROB': 0.02,
+    'RESTART_MIN_REMAINING': 40,
+    'NAME_POOL': 1000,
+}
+
+def load_settings(config):
+    settings = dict(DEFAULTS)
+    settings.update(config.get("SCALE_GENERATOR") or {})
+    return settings
+
+def randint(rng, bounds, size):
+    """ Inclusive integer range like random.randint, vectorized."""
+    return rng.integers(bounds[0], bounds[1] + 1, size=size)
+
+def weekmask(workday):
+    """ Convert the binary workday pattern (bit 0 is Monday) into a numpy weekmask string."""
+    return ''.join('1' if workday & (1 << i) else '0' for i in range(7))
+
+def end_dates(start, duration, workday):
+    """ Vectorized utils.estEndDate for a single workday pattern: the (duration-1)th workday after the start date."""
+    offset = duration - 1
+    end = np.busday_offset(start, offset, roll='backward', weekmask=weekmask(workday))
+    return np.where(offset > 0, end, start)
+
+def task_structure(task_count, interval, settings, rng):
+    """ Decide the scale of every task and where each dependency chain starts, following the rules of Project.generate_task:
+    every branch starts with a large task, and after RESTART_AFTER consecutive tasks a large task may restart the chain.
+
+    Returns:
+        Tuple: boolean arrays is_large and branch_start over all tasks of all projects
+    """
+    total = int(task_count.sum())
+    is_large = np.zeros(total, dtype=bool)
+    branch_start = np.zeros(total, dtype=bool)
+    restart = rng.random(total) < settings['RESTART_PROB']
+    restart_after = settings['RESTART_AFTER']
+    min_remaining = settings['RESTART_MIN_REMAINING']
+
+    i = 0
+    for count, step in zip(task_count.tolist(), interval.tolist()):
+        curr_count = 0
+        for remaining in range(count, 0, -1):
+            if curr_count == 0:
+                is_large[i] = True
+                branch_start[i] = True
+            elif curr_count > restart_after and restart[i] and remaining > min_remaining:
+                is_large[i] = True
+                curr_count = 0
+            curr_count += 1
+            if curr_count % step == 0:
+                curr_count = 0
+            i += 1
+
+    return is_large, branch_start
+
+def generate(config):
+    """ Generate project and task tables in columnar form, without Project objects or the database.
+
+    Returns:
+        Tuple: task and project DataFrames with the same columns as the tables saved by generate.save_data
+    """
+    settings = load_settings(config)
+    rng = np.random.default_rng(config.get("SEED"))
+    n = config["PROJECT_COUNT"]
+    start_date = np.datetime64(config["PROJECT_START_DATE"], 'D')
+
+    # Project level attributes
+    task_count = randint(rng, settings['TASK_COUNT'], n)
+    branches = np.where(task_count > settings['BRANCH_THRESHOLD'], 3, 2)
+    interval = task_count // branches + randint(rng, settings['INTERVAL_EXTRA'], n)
+    project_start = start_date + randint(rng, settings['OFFSET_MONTHS'], n) * 28
+    workday = rng.choice(settings['WORKDAYS'], size=n)
+
+    # Task level attributes, one row per task of every project
+    project_idx = np.repeat(np.arange(n), task_count)
+    total = len(project_idx)
+    is_large, branch_start = task_structure(task_count, interval, settings, rng)
+
+    large, small = settings['LARGE'], settings['SMALL']
+    cost = np.where(is_large, randint(rng, large['COST'], total), randint(rng, small['COST'], total))
+    duration = np.where(is_large, randint(rng, large['DURATION'], total), randint(rng, small['DURATION'], total))
+    trade = np.where(is_large, randint(rng, large['TRADE'], total), randint(rng, small['TRADE'], total))
+    worker_score = randint(rng, settings['WORKER_SCORE'], total)
+    gap = randint(rng, settings['GAP_DAYS'], total)
+    # The first branch starts on the project start date, later branches are jittered
+    first_task = np.r_[True, project_idx[1:] != project_idx[:-1]]
+    jitter = np.where(first_task, 0, randint(rng, settings['BRANCH_JITTER_DAYS'], total))
+
+    # Dates are a recurrence along each chain, so walk all chains in lockstep one position at a time
+    chain = np.cumsum(branch_start) - 1
+    chain_first = np.flatnonzero(branch_start)
+    position = np.arange(total) - chain_first[chain]
+    task_workday = workday[project_idx]
+
+    starts = np.empty(total, dtype='datetime64[D]')
+    ends = np.empty(total, dtype='datetime64[D]')
+    for pos in range(int(position.max()) + 1):
+        idx = np.flatnonzero(position == pos)
+        if pos == 0:
+            starts[idx] = project_start[project_idx[idx]] + jitter[idx]
+        else:
+            starts[idx] = ends[idx - 1] + gap[idx - 1]
+        for wd in settings['WORKDAYS']:
+            sel = idx[task_workday[idx] == wd]
+            ends[sel] = end_dates(starts[sel], duration[sel], wd)
+
+    fake = Faker()
+    fake.seed_instance(config.get("SEED"))
+    names = np.array(fake.words(nb=settings['NAME_POOL']))
+    today = pd.Timestamp(date.today())
+
+    task_id = np.arange(1, total + 1)
+    # Large tasks start a new dependency chain, every other task depends on the previous one
+    parent = pd.array(task_id - 1, dtype='Int32')
+    parent[is_large] = pd.NA
+
+    tasks = pd.DataFrame({
+        'ID': task_id,
+        'Name': names[rng.integers(0, len(names), total)],
+        'StartDate': starts,
+        'EndDate': ends,
+        'ParentTaskID': parent,
+        'Cost': cost.astype(float),
+        'Priority': np.where(is_large, 'Critical', 'Normal'),
+        'Progress': 0,
+        'ProjectID': project_idx + 1,
+        'ActualStartDate': pd.NaT,
+        'ActualEndDate': pd.NaT,
+        'Status': 'Not Started',
+        'Duration': duration,
+        'AssigneeID': 1,
+        'Trade': trade,
+        'CreateDate': today,
+        'WorkerScore': worker_score,
+    })
+
+    projects = pd.DataFrame({
+        'ID': np.arange(1, n + 1),
+        'Name': [f'project{i}' for i in range(1, n + 1)],
+        'Status': 'Active',
+        'Workday': workday,
+        'AssigneeID': 1,
+        'CreateDate': today,
+    })
+
+    return tasks, projects
+
+def save_data(config, tasks, projects):
+    dir_path = dataset_dir(config, create=True)
+    write_table(tasks, dir_path, 'task', config)
+    write_table(projects, dir_path, 'project', config)
+    print(f'{len(projects)} projects and {len(tasks)} tasks saved at {dir_path}')
+
+if __name__ == "__main__":
+    config = loadConfig('config.yaml')
+    if len(sys.argv) > 1:
+        config["PROJECT_COUNT"] = int(sys.argv[1])
+    tasks, projects = generate(config)
+    save_data(config, tasks, projects)
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from utils import loadConfig
+from storage import read_table, table_path
+from registry import dataset_dir
+
+# Sliding windows over the day-by-day history of every task, for the LSTM and CNN-LSTM models. The histories are stored once,
+# sorted by task and date; a window is a strided view into them, so millions of windows cost the memory of their start indexes.
+# Export: python src/sequence.py [window] [stride]   Train: SequenceDataset.load(dir_path, 'task').batches(256)
+
+SEQUENCE_FEATURES = ['Cost', 'Priority', 'Progress', 'Duration', 'Trade', 'TaskLength', 'IsBadWeather', 'WeatherAssessment',
+                     'StartDelay', 'DayCount', 'Is_Delayed']
+SEQUENCE_TARGET = 'TaskDelay'
+
+def read_histories(dir_path, config=None):
+    """ Task-day rows of a dataset with the columns preprocess.py derives, from task_data or, before preprocessing, task_report.
+
+    Returns:
+        DataFrame: one row per task and day
+    """
+    if table_path(dir_path, 'task_data') is not None:
+        return read_table(dir_path, 'task_data', config)
+    from preprocess import preprocess_task
+    return preprocess_task(read_table(dir_path, 'task_report', config))
+
+def history_arrays(df, features=SEQUENCE_FEATURES, target=SEQUENCE_TARGET):
+    """ Sort the task-day rows by task and date into one contiguous float32 block.
+
+    Returns:
+        Tuple: feature block of shape (rows, features), target vector and task ID of every row
+    """
+    df = df.sort_values(['ID', 'Date'], kind='stable')
+    columns = {}
+    for col in features:
+        if col == 'Priority':
+            columns[col] = (df[col].astype(object) == 'Critical').to_numpy(dtype=np.float32)
+        elif col.startswith('Is_') and col not in df.columns:
+            columns[col] = (df['Status'].astype(object) == col[3:]).to_numpy(dtype=np.float32)
+        else:
+            columns[col] = df[col].to_numpy(dtype=np.float32)
+    values = np.ascontiguousarray(np.column_stack([columns[col] for col in features]), dtype=np.float32)
+    return values, df[target].to_numpy(dtype=np.float32), df['ID'].to_numpy()
+
+def window_starts(ids, window, stride=1):
+    """ First row of every window that lies within the history of one task, every stride days. Tasks with a history shorter than
+    window have no windows.
+
+    Args:
+        ids (ndarray): task ID of every row, rows of one task next to each other
+        window (int): days per window
+        stride (int): days between the starts of two windows of a task
+
+    Returns:
+        ndarray: int64 start rows
+    """
+    n = len(ids)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    group_start = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    group_len = np.diff(np.r_[group_start, n])
+    rows = np.arange(n)
+    first = np.repeat(group_start, group_len)
+    offset = rows - first
+    valid = (offset + window <= np.repeat(group_len, group_len)) & (offset % stride == 0)
+    return rows[valid].astype(np.int64)
+
+def window_view(values, window):
+    """ Every run of window consecutive rows of values, as a read-only view of shape (rows - window + 1, window, features)."""
+    return sliding_window_view(values, window, axis=0).transpose(0, 2, 1)
+
+class SequenceDataset:
+    def __init__(self, values, targets, starts, window, features=SEQUENCE_FEATURES, target=SEQUENCE_TARGET):
+        """ Windows of task histories, stored as the history block plus start rows.
+
+        Args:
+            values (ndarray): feature block sorted by task and date, may be memory-mapped
+            targets (ndarray): target of every row, a window is labelled with the target of its last day
+            starts (ndarray): start row of every window, see window_starts
+            window (int): days per window
+            features (list): column names of values
+            target (string): target column name
+        """
+        self.values = values
+        self.targets = targets
+        self.starts = starts
+        self.window = window
+        self.features = list(features)
+        self.target = target
+        self.windows = window_view(values, window)
+
+    @classmethod
+    def from_frame(cls, df, window, stride=1, features=SEQUENCE_FEATURES, target=SEQUENCE_TARGET):
+        values, targets, ids = history_arrays(df, features, target)
+        return cls(values, targets, window_starts(ids, window, stride), window, features, target)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def batch(self, index):
+        """ Windows and targets of the given window indexes, only these windows are copied out of the history block.
+
+        Returns:
+            Tuple: array of shape (len(index), window, features) and the target vector
+        """
+        starts = self.starts[index]
+        return np.asarray(self.windows[starts]), np.asarray(self.targets[starts + self.window - 1])
+
+    def batches(self, batch_size=256, shuffle=True, seed=None, epochs=1):
+        """ Stream (X, y) batches, e.g. for model.fit(dataset.batches(256, epochs=None), steps_per_epoch=-(-len(dataset) // 256)).
+
+        Args:
+            batch_size (int): windows per batch
+            shuffle (bool): visit the windows in a new random order every epoch
+            seed (int): seed of the shuffling
+            epochs (int): passes over the windows, None repeats forever
+
+        Yields:
+            Tuple: window batch of shape (batch, window, features) and its targets
+        """
+        rng = np.random.default_rng(seed)
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            order = rng.permutation(len(self)) if shuffle else np.arange(len(self))
+            for i in range(0, len(order), batch_size):
+                # Sorted indexes read a memory-mapped block in storage order
+                yield self.batch(np.sort(order[i:i + batch_size]) if shuffle else order[i:i + batch_size])
+            epoch += 1
+
+    def save(self, dir_path, name):
+        """ Write the history block, targets and start rows as .npy files with a JSON manifest, for SequenceDataset.load."""
+        paths = sequence_paths(dir_path, name)
+        np.save(paths['values'], np.asarray(self.values))
+        np.save(paths['targets'], np.asarray(self.targets))
+        np.save(paths['starts'], np.asarray(self.starts))
+        manifest = {
+            'features': self.features,
+            'target': self.target,
+            'window': int(self.window),
+            'rows': int(self.values.shape[0]),
+            'windows': int(len(self)),
+            'dtype': 'float32',
+        }
+        with open(paths['manifest'], 'w') as file:
+            json.dump(manifest, file, indent=4)
+
+    @classmethod
+    def load(cls, dir_path, name, mmap_mode='r'):
+        """ Open a dataset written by save without reading it into memory."""
+        paths = sequence_paths(dir_path, name)
+        with open(paths['manifest'], 'r') as file:
+            manifest = json.load(file)
+        arrays = {key: np.load(paths[key], mmap_mode=mmap_mode) for key in ['values', 'targets', 'starts']}
+        return cls(arrays['values'], arrays['targets'], arrays['starts'], manifest['window'], manifest['features'], manifest['target'])
+
+def sequence_paths(dir_path, name):
+    paths = {key: os.path.join(dir_path, f'{name}_seq_{key}.npy') for key in ['values', 'targets', 'starts']}
+    paths['manifest'] = os.path.join(dir_path, f'{name}_seq_manifest.json')
+    return paths
+
+def run(config, window=7, stride=1):
+    dir_path = dataset_dir(config)
+    dataset = SequenceDataset.from_frame(read_histories(dir_path, config), window, stride)
+    dataset.save(dir_path, 'task')
+    print(f'{len(dataset)} windows of {window} days from {dataset.values.shape[0]} task-day rows saved at {dir_path}')
+    return dataset
+
+if __name__ == "__main__":
+    config = loadConfig('config.yaml')
+    run(config, *[int(arg) for arg in sys.argv[1:3]])
@@ -1,22 +1,25 @@
 import pandas as pd
 import sys
+import random
 import os
-from datetime import timedelta
-import mysql.connector
+from datetime import datetime, timedelta
 from tqdm import tqdm
 
 from utils import *
+from storage import read_table, write_table
+from registry import dataset_dir, config_digest, file_fingerprint, table_fingerprints, is_fresh, record_stage
 
 def fromcsv(config):
-    data_dir = config["DATA_DIR"]
-    dir_name = str(config["PROJECT_COUNT"]) + '_' + config["PROJECT_START_DATE"][:4]
-    dir_path = os.path.join(data_dir, dir_name)
+    dir_path = dataset_dir(config)
     
-    tasks = pd.read_csv(os.path.join(dir_path, 'task.csv'))
-    projects = pd.read_csv(os.path.join(dir_path, 'project.csv'))
+    tasks = read_table(dir_path, 'task', config)
+    projects = read_table(dir_path, 'project', config)
     return tasks, projects
 
 def fromsql(config):
+    # Imported here so CSV simulations and benchmarks run without the MySQL driver
+    import mysql.connector
+
     server = config["SERVER"]
     database = config["DATABASE"]
     user = config['USERNAME']
@@ -166,18 +169,31 @@ def simulate_one_day(curr_date, tasks, projects, task_report, project_report, we
     return
 
 def save_report(config, task_reports, project_reports):
-    data_dir = config["DATA_DIR"]
-    dir_name = str(config["PROJECT_COUNT"]) + '_' + config["PROJECT_START_DATE"][:4]
-    dir_path = os.path.join(data_dir, dir_name)
+    dir_path = dataset_dir(config, create=True)
     
-    task_reports.to_csv(os.path.join(dir_path, 'task_report.csv'), index=False)
-    project_reports.to_csv(os.path.join(dir_path, 'project_report.csv'), index=False)
+    write_table(task_reports, dir_path, 'task_report', config)
+    write_table(project_reports, dir_path, 'project_report', config)
     print(f'Simulation result saved at {dir_path}')
     
     return
 
-if __name__ == "__main__":
-    config = loadConfig('config.yaml')
+def run(config, force=False):
+    global pbar
+    dir_path = dataset_dir(config)
+    inputs = {
+        'config': config_digest(config, ['SEED', 'SIMULATION_SOURCE', 'WEATHER_HISTORICAL_PATH']),
+        'weather': file_fingerprint(config["WEATHER_HISTORICAL_PATH"]),
+        **table_fingerprints(dir_path, ['task', 'project'], config)
+    }
+    # Tables read from SQL have no fingerprint, always simulate them again
+    if not force and config["SIMULATION_SOURCE"] == 'csv' and is_fresh(dir_path, 'simulate', inputs, ['task_report', 'project_report']):
+        print(f'Simulation result at {dir_path} is up to date, skipping simulation')
+        return False
+
+    started = datetime.now()
+    if config.get("SEED") is not None:
+        random.seed(config["SEED"])
+
     tasks, projects = read_data(config)
     weather_historical = read_historical(config)
     tasks = preprocess_task(tasks, weather_historical, projects)
@@ -206,3 +222,9 @@ if __name__ == "__main__":
     pbar.close()
     
     save_report(config, task_reports, project_reports)
+    record_stage(config, dir_path, 'simulate', inputs, {'task_report': len(task_reports), 'project_report': len(project_reports)}, started)
+    return True
+
+if __name__ == "__main__":
+    config = loadConfig('config.yaml')
+    run(config, force='--force' in sys.argv)
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+FORMATS = ['parquet', 'feather', 'csv']
+
+STATUS_CATEGORIES = ['Not Started', 'On Progress', 'Delayed', 'Completed']
+PRIORITY_CATEGORIES = ['Normal', 'Critical']
+
+TASK_DATES = ['StartDate', 'EndDate', 'ActualStartDate', 'ActualEndDate']
+TASK_CATEGORIES = {'Status': STATUS_CATEGORIES, 'Priority': PRIORITY_CATEGORIES}
+TASK_WEATHER = ['Temperature', 'RainProb', 'WindSpeed', 'WeatherAssessment']
+
+# Explicit column types for every table written to the data directory, so readers
+# no longer have to re-parse dates or re-infer dtypes from CSV text.
+SCHEMAS = {
+    'project': {
+        'dates': ['CreateDate'],
+        'categories': {'Status': ['Active']},
+        'ints': {'ID': 'int32', 'Workday': 'int16', 'AssigneeID': 'int16'},
+    },
+    'task': {
+        'dates': TASK_DATES + ['CreateDate'],
+        'categories': TASK_CATEGORIES,
+        'ints': {'ID': 'int32', 'ProjectID': 'int32', 'ParentTaskID': 'Int32', 'Progress': 'int16', 'Duration': 'int16',
+                 'AssigneeID': 'int16', 'Trade': 'int16', 'WorkerScore': 'int16'},
+        'floats': ['Cost'],
+    },
+    'task_report': {
+        'dates': ['Date'] + TASK_DATES,
+        'categories': TASK_CATEGORIES,
+        'ints': {'ID': 'int32', 'ProjectID': 'int32', 'Progress': 'int16', 'Duration': 'int16', 'Trade': 'int16',
+                 'TaskLength': 'int16', 'WorkerScore': 'int16', 'WorkDay': 'int16', 'IsBadWeather': 'int8'},
+        'floats': ['Cost'] + TASK_WEATHER,
+    },
+    'task_data': {
+        'dates': ['Date'] + TASK_DATES,
+        'categories': TASK_CATEGORIES,
+        'ints': {'ID': 'int32', 'ProjectID': 'int32', 'Duration': 'int16', 'Trade': 'int16', 'TaskLength': 'int16',
+                 'WorkerScore': 'int16', 'WorkDay': 'int16', 'IsBadWeather': 'int8', 'Weekend': 'int8',
+                 'StartDelay': 'int16', 'DayCount': 'int16', 'TaskDelay': 'int16', 'TaskToday': 'int16'},
+        'floats': ['Cost', 'Progress'] + TASK_WEATHER,
+    },
+    'task_train': {
+        'ints': {'Duration': 'int16', 'Trade': 'int16', 'TaskLength': 'int16', 'WorkerScore': 'int16',
+                 'StartDelay': 'int16', 'TaskDelay': 'int16', 'Is_Delayed': 'int8'},
+        'floats': ['Cost', 'Progress'] + TASK_WEATHER,
+    },
+    'project_report': {
+        'dates': ['Date'] + TASK_DATES,
+        'ints': {'ProjectID': 'int32', 'TotalTask': 'int16', 'StartedTask': 'int16', 'OnGoingTask': 'int16',
+                 'DelayedTask': 'int16', 'CompletedTask': 'int16', 'WorkDay': 'int32'},
+        'floats': ['TotalSpent', 'WeatherAssessment'],
+    },
+    'project_data': {
+        'dates': ['Date'] + TASK_DATES,
+        'ints': {'ProjectID': 'int32', 'TotalTask': 'int16', 'StartedTask': 'int16', 'OnGoingTask': 'int16',
+                 'DelayedTask': 'int16', 'CompletedTask': 'int16', 'WorkDay': 'int32', 'Weekend': 'int8',
+                 'DayCount': 'int16', 'Delay': 'int16'},
+        'floats': ['TotalSpent', 'WeatherAssessment', 'Progress'],
+    },
+    'project_train': {},
+}
+
+def apply_schema(df, name):
+    """ Cast the columns of a table to the dtypes declared in SCHEMAS. Columns that are not part of the schema are left untouched.
+
+    Args:
+        df (DataFrame): table to cast, modified in place
+        name (string): table name, e.g. 'task_report'
+
+    Returns:
+        DataFrame: the typed table
+    """
+    schema = SCHEMAS.get(name, {})
+
+    for col in schema.get('dates', []):
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format='ISO8601')
+
+    for col, categories in schema.get('categories', {}).items():
+        if col in df.columns:
+            extra = sorted(set(df[col].dropna().unique()) - set(categories))
+            df[col] = pd.Categorical(df[col], categories=categories + extra)
+
+    for col, dtype in schema.get('ints', {}).items():
+        if col in df.columns:
+            values = pd.to_numeric(df[col])
+            # Fall back to the nullable integer type when the column has gaps
+            if values.isna().any() and dtype[0].islower():
+                dtype = dtype.capitalize()
+            df[col] = values.astype(dtype)
+
+    for col in schema.get('floats', []):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col]).astype('float64')
+
+    return df
+
+def table_path(dir_path, name, data_format=None):
+    """ Find the stored file of a table, preferring the given format and falling back to the others.
+
+    Returns:
+        string: path to the table file, None if the table does not exist in any format
+    """
+    formats = [data_format] + [f for f in FORMATS if f != data_format] if data_format else FORMATS
+    for fmt in formats:
+        path = os.path.join(dir_path, f'{name}.{fmt}')
+        if os.path.exists(path):
+            return path
+    return None
+
+def read_table(dir_path, name, config=None):
+    """ Read a table from a dataset directory and apply its schema.
+
+    Args:
+        dir_path (string): dataset directory, e.g. data/30_2019
+        name (string): table name without extension, e.g. 'task'
+        config (dict): loaded config, DATA_FORMAT decides which file is preferred
+
+    Returns:
+        DataFrame: the typed table
+    """
+    data_format = config.get("DATA_FORMAT", 'csv') if config else None
+    path = table_path(dir_path, name, data_format)
+    if path is None:
+        raise FileNotFoundError(f"Table '{name}' not found in {dir_path}")
+
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    elif path.endswith('.feather'):
+        df = pd.read_feather(path)
+    else:
+        df = pd.read_csv(path)
+
+    return apply_schema(df, name)
+
+def write_table(df, dir_path, name, config):
+    """ Write a table to a dataset directory using DATA_FORMAT. A CSV copy is kept when CSV_EXPORT is set for compatibility with older tooling.
+
+    Args:
+        df (DataFrame): table to write
+        dir_path (string): dataset directory, e.g. data/30_2019
+        name (string): table name without extension, e.g. 'task'
+        config (dict): loaded config
+    """
+    data_format = config.get("DATA_FORMAT", 'csv')
+    csv_export = config.get("CSV_EXPORT", True)
+
+    if data_format not in FORMATS:
+        print(f"Invalid data format '{data_format}'. Please use one of {FORMATS}.")
+        sys.exit(1)
+
+    if data_format != 'csv':
+        typed = apply_schema(df.copy(), name).reset_index(drop=True)
+        if data_format == 'parquet':
+            typed.to_parquet(os.path.join(dir_path, f'{name}.parquet'), index=False)
+        else:
+            typed.to_feather(os.path.join(dir_path, f'{name}.feather'))
+
+    if data_format == 'csv' or csv_export:
+        df.to_csv(os.path.join(dir_path, f'{name}.csv'), index=False)
+
+    return
+
+def matrix_paths(dir_path, name):
+    return (os.path.join(dir_path, f'{name}_X.npy'),
+            os.path.join(dir_path, f'{name}_y.npy'),
+            os.path.join(dir_path, f'{name}_manifest.json'))
+
+def write_matrix(df, dir_path, name, target):
+    """ Export a training table as a float32 feature matrix and target vector in .npy format, with a JSON manifest describing the columns.
+    The arrays can be opened with np.load(mmap_mode='r') so several trainers share one page-cached copy.
+
+    Args:
+        df (DataFrame): numeric training table, e.g. task_train
+        dir_path (string): dataset directory
+        name (string): base name of the exported files
+        target (string): target column, every other column is a feature
+    """
+    x_path, y_path, manifest_path = matrix_paths(dir_path, name)
+    features = [col for col in df.columns if col != target]
+
+    X = np.ascontiguousarray(df[features].to_numpy(dtype=np.float32))
+    y = df[target].to_numpy(dtype=np.float32)
+    np.save(x_path, X)
+    np.save(y_path, y)
+
+    manifest = {
+        'features': features,
+        'target': target,
+        'rows': int(X.shape[0]),
+        'dtype': 'float32',
+        'X': os.path.basename(x_path),
+        'y': os.path.basename(y_path),
+    }
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=4)
+
+    return
+
+def load_matrix(dir_path, name, mmap_mode='r'):
+    """ Open a matrix exported by write_matrix without copying it into memory.
+
+    Returns:
+        Tuple: feature matrix, target vector and the manifest dictionary
+    """
+    _, _, manifest_path = matrix_paths(dir_path, name)
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+
+    X = np.load(os.path.join(dir_path, manifest['X']), mmap_mode=mmap_mode)
+    y = np.load(os.path.join(dir_path, manifest['y']), mmap_mode=mmap_mode)
+    return X, y, manifest
+
+def sample_rows(X, n, seed=42):
+    """ Sample rows of a (memory-mapped) matrix in storage order, only the selected rows are read from disk."""
+    rng = np.random.default_rng(seed)
+    idx = np.sort(rng.choice(X.shape[0], size=min(n, X.shape[0]), replace=False))
+    return np.asarray(X[idx])
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python src/storage.py <dataset_dir> <parquet|feather>")
+        sys.exit(1)
+
+    dir_path = sys.argv[1]
+    config = {"DATA_FORMAT": sys.argv[2], "CSV_EXPORT": False}
+    for name in SCHEMAS:
+        if table_path(dir_path, name, 'csv') is None:
+            continue
+        df = read_table(dir_path, name, {"DATA_FORMAT": 'csv'})
+        write_table(df, dir_path, name, config)
+        print(f'{name} converted to {sys.argv[2]}')
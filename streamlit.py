@@ -5,44 +5,111 @@ import shap
 import mpld3
 import streamlit.components.v1 as components
 import os
+import sys
 import random
+import joblib
 import numpy as np
 from scipy import stats
 from sklearn.tree import DecisionTreeRegressor
 from sklearn.metrics import mean_absolute_error
 
-def read_csv_files(directory):
-    files = ['task_data.csv', 'task_train.csv', 'project_data.csv', 'project_train.csv']
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from storage import read_table, table_path, load_matrix, matrix_paths
+
+FILES = ['task_data.csv', 'task_train.csv', 'project_data.csv', 'project_train.csv']
+MODEL_DIR = 'model'
+
+def dataset_version(directory):
+    """ Modification times of the dataset tables, part of every cache key so regenerated data is read again."""
+    version = []
+    for file in FILES:
+        path = table_path(directory, os.path.splitext(file)[0])
+        version.append((file, os.stat(path).st_mtime_ns if path else None))
+    return tuple(version)
+
+@st.cache_resource(show_spinner="Reading data...")
+def read_csv_files(directory, version):
+    # Cached once per server for every dataset version, the frames are shared by all sessions and must not be modified
     dataframes = {}
-    for file in files:
-        filepath = os.path.join(directory, file)
-        if os.path.exists(filepath):
-            dataframes[file] = pd.read_csv(filepath)
-        else:
-            st.warning(f"File {file} not found in directory {directory}.")
+    for file in FILES:
+        name = os.path.splitext(file)[0]
+        if table_path(directory, name) is not None:
+            dataframes[file] = read_table(directory, name)
+    if os.path.exists(matrix_paths(directory, 'task_train')[2]):
+        dataframes['task_train.npy'] = load_matrix(directory, 'task_train')
     return dataframes
 
-def train_model(dataframes, target):
+def split_projects(tasks, seed=0):
+    """ Fixed validation and test projects (10% each) of a dataset, the same split on every run."""
+    rng = random.Random(seed)
+    project_ids = sorted(tasks['ProjectID'].unique().tolist())
+    indices = rng.sample(project_ids, int(0.2 * len(project_ids)))
+    val_indices = rng.sample(indices, int(0.5 * len(indices)))
+    test_indices = [x for x in indices if x not in val_indices]
+    return val_indices, test_indices
+
+def pretrained_models(dir_name):
+    """ Model files of model/ trained for this dataset: {dir_name}_dt.pkl saved by this app, then {dir_name}.pkl."""
+    names = [f'{dir_name}_dt.pkl', f'{dir_name}.pkl']
+    return [os.path.join(MODEL_DIR, name) for name in names if os.path.exists(os.path.join(MODEL_DIR, name))]
+
+@st.cache_resource(show_spinner="Loading model...")
+def load_model(directory, version, dir_name, target):
+    """ Pretrained model of the dataset when one in model/ fits its columns, otherwise a decision tree trained here. Cached per dataset
+    version, so the tree is trained once per server instead of once per session.
+
+    Returns:
+        dict: model, explainer, features, train and validation MAE, test row indices and where the model came from
+    """
+    dataframes = read_csv_files(directory, version)
     tasks = dataframes.get('task_data.csv')
     tasks_df = dataframes.get('task_train.csv')
-
     if tasks is None or tasks_df is None:
-        st.error("Required data files are missing.")
-        return None, None, None, None
+        return None
+
+    val_indices, test_indices = split_projects(tasks)
+    val_idx = tasks.index[tasks['ProjectID'].isin(val_indices)]
+    test_idx = tasks.index[tasks['ProjectID'].isin(test_indices)]
+
+    for path in pretrained_models(dir_name):
+        try:
+            model = joblib.load(path)
+        except Exception as e:
+            print(f'Skipping {path}: {e}')
+            continue
+        features = list(getattr(model, 'feature_names_in_', []))
+        if features and all(col in tasks_df.columns for col in features):
+            train_mask = ~tasks_df.index.isin(val_idx.union(test_idx))
+            result = {
+                'model': model,
+                'explainer': shap.Explainer(model, feature_names=features),
+                'features': features,
+                'mae_train': mean_absolute_error(tasks_df.loc[train_mask, target], model.predict(tasks_df.loc[train_mask, features])),
+                'mae_val': mean_absolute_error(tasks_df.loc[val_idx, target], model.predict(tasks_df.loc[val_idx, features])),
+                'test_idx': test_idx.tolist(),
+                'source': path,
+            }
+            return result
+
+    model, explainer, mae_train, mae_val, test_idx = train_model(dataframes, target, val_idx, test_idx)
+    return {'model': model, 'explainer': explainer, 'features': list(model.feature_names_in_), 'mae_train': mae_train,
+            'mae_val': mae_val, 'test_idx': test_idx, 'source': None}
 
-    X = tasks_df.copy()
-    y = X.pop(target)
+def train_model(dataframes, target, val_idx, test_idx):
+    tasks_df = dataframes.get('task_train.csv')
+
+    matrix = dataframes.get('task_train.npy')
+    if matrix is not None and matrix[2]['target'] == target:
+        # Memory-mapped float32 export from preprocess.py, wrapped without copying
+        X_mm, y_mm, manifest = matrix
+        X = pd.DataFrame(X_mm, columns=manifest['features'], copy=False)
+        y = pd.Series(y_mm, copy=False)
+    else:
+        X = tasks_df.copy()
+        y = X.pop(target)
     
     cols = X.columns
 
-    # Split the data
-    project_ids = tasks['ProjectID'].unique().tolist()
-    indices = random.sample(project_ids, int(0.2 * len(project_ids)))
-    val_indices = random.sample(indices, int(0.5 * len(indices)))
-    test_indices = [x for x in indices if x not in val_indices]
-    val_idx = tasks.loc[tasks['ProjectID'].isin(val_indices)].index.tolist()
-    test_idx = tasks.loc[tasks['ProjectID'].isin(test_indices)].index.tolist()
-
     X_val = X[X.index.isin(val_idx)]
     y_val = y[y.index.isin(val_idx)]
     X_train = X[(~X.index.isin(test_idx)) & (~X.index.isin(val_idx))]
@@ -60,32 +127,92 @@ def train_model(dataframes, target):
     
     explainer = shap.Explainer(model,feature_names=cols)
     
-    return model, explainer, mae_train, mae_val, test_idx
+    return model, explainer, mae_train, mae_val, list(test_idx)
+
+def prefix_fits(df, keys):
+    """ stats.linregress of Progress against the row position for every prefix of every group, from cumulative sums in one pass.
+    Row i of the result is the fit of the group's rows up to and including row i.
+
+    Returns:
+        DataFrame: slope, intercept and residual standard deviation aligned with df
+    """
+    y = df['Progress'].astype(float)
+    sums = pd.DataFrame({'y': y, 'xy': 0.0, 'yy': y * y}, index=df.index)
+    n = df.groupby(keys, sort=False).cumcount().astype(float) + 1
+    x = n - 1
+    sums['xy'] = x * y
+    sums = sums.groupby([df[key] for key in keys], sort=False).cumsum()
+
+    sx = n * (n - 1) / 2
+    sxx = (n - 1) * n * (2 * n - 1) / 6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sums['xy'] - sx * sums['y']) / (n * sxx - sx ** 2)
+        intercept = (sums['y'] - slope * sx) / n
+        ssr = sums['yy'] - 2 * intercept * sums['y'] - 2 * slope * sums['xy'] + n * intercept ** 2 + 2 * intercept * slope * sx + slope ** 2 * sxx
+    return pd.DataFrame({'slope': slope, 'intercept': intercept, 'std': np.sqrt(np.maximum(ssr, 0) / n)})
+
+@st.cache_resource(show_spinner="Indexing projects...")
+def build_views(directory, version, dir_name, target):
+    """ Test tasks and projects grouped once per dataset version: rows per project, rows per task and task IDs per project and
+    date, with the progress fits of every prefix, so widget changes only look up precomputed groups.
+
+    Returns:
+        dict: the grouped frames and the prediction rows of the test tasks
+    """
+    dataframes = read_csv_files(directory, version)
+    bundle = load_model(directory, version, dir_name, target)
+
+    tasks = dataframes['task_data.csv']
+    test_tasks = tasks[tasks.index.isin(bundle['test_idx'])].reset_index(drop=True)
+    pred_data = dataframes['task_train.csv'][dataframes['task_train.csv'].index.isin(bundle['test_idx'])].reset_index(drop=True)
+    test_tasks['Date'] = pd.to_datetime(test_tasks['Date']).dt.date
+    # Position in pred_data, the row the model scores for the selected task and date
+    test_tasks['index'] = test_tasks.index
+    test_tasks = pd.concat([test_tasks, prefix_fits(test_tasks, ['ProjectID', 'ID'])], axis=1)
+
+    projects = dataframes['project_data.csv'].copy()
+    projects['Date'] = pd.to_datetime(projects['Date']).dt.date
+    projects = pd.concat([projects.reset_index(drop=True), prefix_fits(projects.reset_index(drop=True), ['ProjectID'])], axis=1)
+
+    return {
+        'pred_data': pred_data,
+        'project_ids': test_tasks['ProjectID'].unique(),
+        'project_tasks': {pid: group for pid, group in test_tasks.groupby('ProjectID', sort=False)},
+        'task_history': {key: group.reset_index(drop=True) for key, group in test_tasks.groupby(['ProjectID', 'ID'], sort=False)},
+        'task_ids': {key: group.unique().tolist() for key, group in test_tasks.groupby(['ProjectID', 'Date'], sort=False)['ID']},
+        'project_history': {pid: group.reset_index(drop=True) for pid, group in projects.groupby('ProjectID', sort=False)},
+    }
 
 def process_input(dir_name):
     data_dir = os.path.join('data', dir_name)
     if not os.path.exists(data_dir):
         st.warning("Specified directory does not exist.")
-        return None
-    dataframes = read_csv_files(data_dir)
+        return None, None
+    version = dataset_version(data_dir)
+    dataframes = read_csv_files(data_dir, version)
+    for file in FILES:
+        if file not in dataframes:
+            st.warning(f"File {file} not found in directory {data_dir}.")
     if not dataframes:
         st.warning("No data found in the specified directory.")
-        return None
-    return dataframes
+        return None, None
+    return data_dir, version
 
-def plot_task_progression(data):
+def plot_task_progression(data, fit=None):
     fig, ax = plt.subplots(figsize=(15,4))
     ax.scatter(data['Date'], data['Progress'], label='Progress', s=100)
     # ax.axvline(pd.to_datetime(data['EndDate']).iloc[0], color='blue', linestyle='--', label='Planned end date')
     if len(data['Progress'].unique())>1:
-        # Fit line
-        slope, intercept, r_value, p_value, std_err = stats.linregress(data.index, data['Progress'])
+        # Fit line, precomputed for every prefix by build_views
+        if fit is None:
+            slope, intercept, r_value, p_value, std_err = stats.linregress(data.index, data['Progress'])
+            std_residuals = np.std(data['Progress'] - (slope * data.index + intercept))
+        else:
+            slope, intercept, std_residuals = fit
         line = slope * data.index + intercept
         ax.plot(data['Date'], line, color='red', label='Fit Line')
 
         # Error area
-        residuals = data['Progress'] - (slope * data.index + intercept)
-        std_residuals = np.std(residuals)
         ax.fill_between(data['Date'], line - std_residuals, line + std_residuals, color='red', alpha=0.2, label='Error Area')
 
         # Predict the date when progress achieves 100
@@ -101,19 +228,21 @@ def plot_task_progression(data):
     ax.legend()
     return fig
 
-def plot_project_progression(data):
+def plot_project_progression(data, fit=None):
     fig, ax = plt.subplots(figsize=(15,4))
     ax.scatter(data['Date'], data['Progress'], label='Progress', s=10)
     # ax.axvline(pd.to_datetime(data['EndDate']).iloc[0], color='blue', linestyle='--', label='Planned end date')
     if len(data['Progress'].unique())>1:
-        # Fit line
-        slope, intercept, r_value, p_value, std_err = stats.linregress(data.index, data['Progress'])
+        # Fit line, precomputed for every prefix by build_views
+        if fit is None:
+            slope, intercept, r_value, p_value, std_err = stats.linregress(data.index, data['Progress'])
+            std_residuals = np.std(data['Progress'] - (slope * data.index + intercept))
+        else:
+            slope, intercept, std_residuals = fit
         line = slope * data.index + intercept
         ax.plot(data['Date'], line, color='red', label='Fit Line')
 
         # Error area
-        residuals = data['Progress'] - (slope * data.index + intercept)
-        std_residuals = np.std(residuals)
         ax.fill_between(data['Date'], line - std_residuals, line + std_residuals, color='red', alpha=0.2, label='Error Area')
 
         # Predict the date when progress achieves 100
@@ -129,10 +258,9 @@ def plot_project_progression(data):
     ax.legend()
     return fig
 
-def predict_and_plot(model, explainer, data):
+def predict_and_plot(model, explainer, data, features):
     ground_truth = data['TaskDelay']
-    data = data.drop('TaskDelay')
-    data_np = data.to_numpy().reshape(1, -1)
+    data_np = data[features].to_numpy(dtype=float).reshape(1, -1)
     data_pred = model.predict(data_np)
     st.write(f'The selected tasks is estimated to be delayed for **{data_pred[0]:.2f} days**, true delay is **{ground_truth} days**')
     
@@ -145,48 +273,54 @@ def predict_and_plot(model, explainer, data):
         st.write('The SHAP Score determines how each feature affect the prediction result.')
         st.pyplot(fig)
     
-def display(data):
+def last_fit(data):
+    row = data.iloc[-1]
+    return row['slope'], row['intercept'], row['std']
+
+def display(bundle, views):
     with st.expander("About the Model"):
-        st.write(f"Model Type : Decision Tree Regressor")
-        st.write(f"**Train MAE: {data['mae_train']:.2f} | Validation MAE: {data['mae_val']:.2f}**")
-    
-    test_tasks = data['test_data']
-    test_tasks['Date'] = pd.to_datetime(test_tasks['Date']).dt.date
-    test_projects = data['dataframes']['project_data.csv']
-    test_projects['Date'] = pd.to_datetime(test_projects['Date']).dt.date
-    pred_data = data['pred_data']
-    test_tasks_pids = test_tasks['ProjectID'].unique()
-    
+        st.write(f"Model Type : {type(bundle['model']).__name__}" + (f" (pretrained, {bundle['source']})" if bundle['source'] else ''))
+        st.write(f"**Train MAE: {bundle['mae_train']:.2f} | Validation MAE: {bundle['mae_val']:.2f}**")
+
+    pred_data = views['pred_data']
+    test_tasks_pids = views['project_ids']
+
     if len(test_tasks_pids) > 0:
         test_pid_select = st.sidebar.selectbox('Test Project ID :', test_tasks_pids, help='select project ID from the test set')
-        test_tasks_select_data = test_tasks[test_tasks['ProjectID'] == test_pid_select]
-        
+        test_tasks_select_data = views['project_tasks'][test_pid_select]
+
         with st.expander("About the Project"):
             st.write(f"Project ID : **{test_pid_select}**")
             st.write(f"Number of tasks : **{test_tasks_select_data['ID'].nunique()}**")
             st.write(f"Workday : **{test_tasks_select_data['WorkDay'].mean()}**")
             st.write(f"Project Start Date : **{test_tasks_select_data['ActualStartDate'].min()}**")
             st.write(f"Project End Date : **{test_tasks_select_data['ActualEndDate'].max()}**")
-        
+
         available_dates = test_tasks_select_data['Date']
         selected_date = st.sidebar.date_input("Select Date", value=available_dates.min(), min_value=available_dates.min(), max_value=available_dates.max(), help='select a date from available dates in the project')
-            
+
         st.sidebar.info(f'Valid date range is from {available_dates.min()} to {available_dates.max()}')
-        test_tasks_select_data_filtered = test_tasks_select_data[test_tasks_select_data['Date'] == selected_date]
-        test_tasks_ids = test_tasks_select_data_filtered['ID'].unique().tolist()
+        test_tasks_ids = views['task_ids'].get((test_pid_select, selected_date), [])
         test_tasks_select = st.sidebar.selectbox('Test Tasks ID :', test_tasks_ids, help='select task ID from the project')
-        task_select_data = test_tasks_select_data[(test_tasks_select_data['ID'] == test_tasks_select) & (test_tasks_select_data['Date'] <= selected_date)].reset_index(drop=False)
-        
+
         st.write(f"### Current date : {selected_date}")
-        test_projects_select_data = test_projects[(test_projects['ProjectID'] == test_pid_select) & (test_projects['Date']<= selected_date)].reset_index(drop=True)
-        fig_project = plot_project_progression(test_projects_select_data)
-        st.pyplot(fig_project)
-        
+        project_history = views['project_history'].get(test_pid_select)
+        test_projects_select_data = project_history[project_history['Date'] <= selected_date] if project_history is not None else project_history
+        if test_projects_select_data is not None and len(test_projects_select_data) > 0:
+            fig_project = plot_project_progression(test_projects_select_data, last_fit(test_projects_select_data))
+            st.pyplot(fig_project)
+
+        if test_tasks_select is None:
+            st.warning("No task is running on the selected date.")
+            return
+        task_history = views['task_history'][(test_pid_select, test_tasks_select)]
+        task_select_data = task_history[task_history['Date'] <= selected_date]
+
         data_last_index = task_select_data.iloc[-1]['index']
         data_last = pred_data.iloc[data_last_index]
-        predict_and_plot(data['model'], data['explainer'], data_last)
-        
-        fig_task = plot_task_progression(task_select_data)
+        predict_and_plot(bundle['model'], bundle['explainer'], data_last, bundle['features'])
+
+        fig_task = plot_task_progression(task_select_data, last_fit(task_select_data))
         st.pyplot(fig_task)
     else:
         st.warning("No test data available.")
@@ -195,35 +329,28 @@ def main():
     st.title("AI Delay Prediction")
     st.sidebar.title("Source Data")
 
-    if 'results' not in st.session_state:
-        st.session_state.results = {}
-    
     dir_name = st.sidebar.text_input("Enter directory name:")
-    
-    if dir_name and dir_name not in st.session_state.results:
-        dataframes = process_input(dir_name)
-        if dataframes:
-            st.write("Training model...")
-            model, explainer, mae_train, mae_val, test_idx = train_model(dataframes, 'TaskDelay')
-            if model is not None:
-                st.write("Model training complete!")
-                test_data = dataframes['task_data.csv'][dataframes['task_data.csv'].index.isin(test_idx)].reset_index(drop=True)
-                pred_data = dataframes['task_train.csv'][dataframes['task_train.csv'].index.isin(test_idx)].reset_index(drop=True)
-                st.session_state.results[dir_name] = {
-                    'model' : model,
-                    'explainer' : explainer,
-                    'dataframes' : dataframes,
-                    'mae_train' : mae_train,
-                    'mae_val' : mae_val,
-                    'test_data' : test_data,
-                    'pred_data' : pred_data
-                }
-        else:
-            st.error("Error processing input data.")
-    
-    if dir_name in st.session_state.results:
-        data = st.session_state.results[dir_name]
-        display(data)
+    if not dir_name:
+        return
+
+    data_dir, version = process_input(dir_name)
+    if data_dir is None:
+        st.error("Error processing input data.")
+        return
+
+    # Loaded or trained once per dataset version, later reruns and sessions reuse the cached model and views
+    bundle = load_model(data_dir, version, dir_name, 'TaskDelay')
+    if bundle is None:
+        st.error("Required data files are missing.")
+        return
+    views = build_views(data_dir, version, dir_name, 'TaskDelay')
+
+    if bundle['source'] is None and st.sidebar.button('Save model to model/', help='later runs load it instead of training'):
+        path = os.path.join(MODEL_DIR, f'{dir_name}_dt.pkl')
+        joblib.dump(bundle['model'], path)
+        st.sidebar.success(f'Model saved at {path}')
+
+    display(bundle, views)
 
 if __name__ == "__main__":
     main()
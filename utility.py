@@ -1,7 +1,7 @@
 import shap
 import numpy as np
-from collections import defaultdict, deque
 import pandas as pd
+from graph import TaskGraph
 
 class VotingRegressorWrapper:
     def __init__(self, voting_regressor):
@@ -11,57 +11,103 @@ class VotingRegressorWrapper:
         # This returns the ensemble prediction
         return self.voting_regressor.predict(X)
 
-class SHAP_Evaluation:
-    def __init__(self, model, df, background_df, model_code):
+def resolve_explainer_type(model, model_code=None):
+    # Tree ensembles get exact TreeSHAP, Keras models a gradient explainer, anything else the model-agnostic kernel
+    name = type(model).__name__
+    if name.startswith(('DecisionTree', 'RandomForest', 'ExtraTrees', 'GradientBoosting', 'XGB', 'LGBM')):
+        return 'tree'
+    if model_code == 'ML':
+        return 'tree'
+    if hasattr(model, 'layers') and hasattr(model, 'input_shape'):
+        return 'gradient'
+    return 'kernel'
+
+class ExplanationService:
+    def __init__(self, model, background_df, model_code='DL', explainer='auto', nsamples='auto', background_k=10):
+        """ Long-lived SHAP explainer, built once at startup and reused by every request.
+
+        Args:
+            model: fitted model with a predict method
+            background_df (DataFrame): background data, its columns define the feature order
+            model_code (string): 'ML' for tree models, 'DL' for deep learning models, 'EL' for voting ensembles
+            explainer (string): 'auto', 'tree', 'gradient' or 'kernel'
+            nsamples (int or 'auto'): number of model evaluations per explained row for the kernel explainer
+            background_k (int): summarise the background with k-means to k weighted rows, None to use it as is
+        """
         self.model = model
-        self.df = df
-        self.background_def = background_df
-        self.model_code = model_code
-
-    def SHAP_Calculation(self):
-        #Machine Learning Model
-        if self.model_code == 'ML':
-            explainer = shap.Explainer(self.model)
-            shap_values =  explainer(self.df)
-
-            return shap_values
-        
-        #Deep Learning model
-        elif self.model_code == 'DL':
-            explainer = shap.KernelExplainer(self.model.predict, self.background_def)
-            shap_values = explainer.shap_values(self.df)
+        self.feature_names = list(background_df.columns)
+        self.nsamples = nsamples
+        self.kind = resolve_explainer_type(model, model_code) if explainer == 'auto' else explainer
+
+        if self.kind == 'tree':
+            self.explainer = shap.TreeExplainer(model)
+        elif self.kind == 'gradient':
+            background = background_df.to_numpy(dtype=np.float32)
+            self.explainer = shap.GradientExplainer(model, self._model_input(background))
+        else:
+            if background_k and len(background_df) > background_k:
+                background = shap.kmeans(background_df, background_k)
+            else:
+                background = background_df
+            predict = VotingRegressorWrapper(model).predict if model_code == 'EL' else model.predict
+            self.explainer = shap.KernelExplainer(predict, background)
+
+    def _model_input(self, values):
+        # Keras models may expect (rows, features, 1), reshape flat rows to the model input shape
+        shape = getattr(self.model, 'input_shape', None)
+        if shape is None:
+            return values
+        return values.reshape((-1,) + tuple(d for d in shape[1:]))
+
+    def shap_values(self, df):
+        """ Compute SHAP values of every row.
+
+        Returns:
+            ndarray: array of shape (rows, features)
+        """
+        df = df[self.feature_names]
+        if self.kind == 'tree':
+            values = self.explainer.shap_values(df)
+        elif self.kind == 'gradient':
+            values = self.explainer.shap_values(self._model_input(df.to_numpy(dtype=np.float32)))
+        else:
+            values = self.explainer.shap_values(df, nsamples=self.nsamples, silent=True)
+
+        if isinstance(values, list):
+            values = values[0]
+        return np.asarray(values).reshape(len(df), len(self.feature_names))
+
+    def shap_dicts(self, df):
+        shap_values = self.shap_values(df)
+        return [{col: float(val) for col, val in zip(self.feature_names, row)} for row in shap_values]
+
+def explain_mode(args, default='true'):
+    # ?explain=true (default) computes SHAP in the request, false skips it, async computes it in a background job
+    value = str(args.get('explain', default)).lower()
+    if value == 'async':
+        return 'async'
+    return 'none' if value in ('false', '0', 'no', 'none') else 'sync'
             
-            return shap_values
-        
-        #Ensemble Model
-        elif self.model_code == 'EL':
-            wrapped_model = VotingRegressorWrapper(self.model)
-            explainer = shap.KernelExplainer(wrapped_model.predict, self.df)
-            shap_values = explainer.shap_values(self.df)
-
-            return shap_values
-
-    
-    def SHAP_Dictionary(self):
-        shap_values = self.SHAP_Calculation()
-
-        #For Deep Learning and Ensemble Learning model
-        if (self.model_code == 'EL') or (self.model_code == 'DL'):
-            shap_values = shap_values.reshape(-1, len(self.df.columns))
-            shap_dicts = []
-            for row in shap_values:
-                shap_dicts.append({col: val for col, val in zip(self.df.columns, row)})
-            return shap_dicts
-        
-        #For Machine Learning model
-        elif (self.model_code == 'ML'):
-            shap_dicts = []
-            for row in shap_values.values:
-                shap_dicts.append({col: val for col, val in zip(self.df.columns, row)})
-
-            return shap_dicts
+def round_predictions(predictions):
+    # Round half up to whole days, predictions below half a day are no delay
+    predictions = np.asarray(predictions)
+    return np.where(predictions < 0.5, 0, np.where(predictions % 1 >= 0.5, np.ceil(predictions), np.floor(predictions)).astype(int))
+
+def read_chunks(file, chunk_size=1000):
+    """ Read an uploaded CSV or NDJSON file in chunks, the format is taken from the file name or content type.
+
+    Args:
+        file (FileStorage): uploaded file
+        chunk_size (int): rows per chunk
+
+    Returns:
+        Iterator: DataFrame chunks
+    """
+    name = (file.filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in (file.mimetype or ''):
+        return pd.read_json(file.stream, lines=True, chunksize=chunk_size)
+    return pd.read_csv(file.stream, chunksize=chunk_size)
 
-            
 def required_column_task():
     
     required_columns = [
@@ -94,72 +140,40 @@ def required_column_project():
     return required_columns
 
 
-# Create a graph of tasks and their dependencies
-def build_graph(df):
-    graph = defaultdict(list)
-    indegree = defaultdict(int)
-    
-    # Build the graph and indegree count
-    for index, row in df.iterrows():
-        task_id = row['Id']
-        if row['Predecessor']:
-            for pre_id in row['Predecessor']:
-                graph[pre_id].append(task_id)
-                indegree[task_id] += 1
-        else:
-            indegree[task_id]  # Ensure tasks with no predecessors are tracked
-    
-    return graph, indegree
+def project_delay_analysis(df):
+    """ Propagate the predicted task delays through the dependency graph.
 
-# Perform topological sort (Kahn's algorithm)
-def topological_sort(graph, indegree):
-    zero_indegree_queue = deque([task for task in indegree if indegree[task] == 0])
-    sorted_tasks = []
-    
-    while zero_indegree_queue:
-        task = zero_indegree_queue.popleft()
-        sorted_tasks.append(task)
-        
-        for successor in graph[task]:
-            indegree[successor] -= 1
-            if indegree[successor] == 0:
-                zero_indegree_queue.append(successor)
-    
-    return sorted_tasks
+    Args:
+        df (DataFrame): project tasks with Id, Predecessor and Prediction columns
 
+    Returns:
+        Dictionary: total delay, critical path task IDs, and per task accumulated delay and slack
 
-def project_total_delay(df):
-    # Ensure the Predecessor column is properly formatted as a list of integers
-    df['Predecessor'] = df['Predecessor'].apply(lambda x: [int(i) for i in str(x).split(',')] if x != '0' else [])
-    # Build the task graph and calculate indegrees
-    graph, indegree = build_graph(df)
-
-    # Get the topologically sorted tasks
-    sorted_tasks = topological_sort(graph, indegree)
-
-    # Initialize task delays
-    task_delays = {}
-
-    # Process tasks in topological order to calculate delays
-    for task_id in sorted_tasks:
-        task_row = df[df['Id'] == task_id].iloc[0]
-        predecessors = task_row['Predecessor']
-        
-        # Calculate start delay from predecessors
-        if predecessors:
-            # Get the maximum delay among the predecessors
-            predecessor_delays = [task_delays[pre_id] for pre_id in predecessors]
-            start_delay = max(predecessor_delays) if predecessor_delays else 0
-        else:
-            start_delay = 0
-        
-        # Total delay is the start delay plus the task's own prediction delay
-        task_delays[task_id] = start_delay + task_row['Prediction']
+    Raises:
+        ValueError: unknown predecessors, duplicate task IDs or a dependency cycle
+    """
+    graph = TaskGraph.from_frame(df)
+    return graph.analyse(df['Prediction'].to_numpy())
 
-    # The total project delay is the maximum delay among all tasks
-    total_project_delay = max(task_delays.values())
+def projects_delay_analysis(df, project_col='Project'):
+    """ project_delay_analysis for many projects in one pass over a graph of all their tasks.
 
-    return total_project_delay
+    Args:
+        df (DataFrame): tasks with Id, Predecessor and Prediction columns, the rows of a project next to each other
+        project_col (string): project column, task IDs only have to be unique within a project
+
+    Returns:
+        list: one project_delay_analysis dictionary per project, in the order the projects first appear
+
+    Raises:
+        ValueError: unknown predecessors, duplicate task IDs or a dependency cycle, with the project at fault
+    """
+    graph = TaskGraph.from_projects(df, project_col)
+    return graph.analyse_projects(df['Prediction'].to_numpy())
+
+def project_total_delay(df):
+    # The total project delay is the largest accumulated delay among all tasks
+    return project_delay_analysis(df)['total_delay']
 
 def calculate_shap_average(df):
     # Create a new DataFrame to store SHAP values for each feature